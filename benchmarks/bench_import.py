@@ -0,0 +1,86 @@
+"""
+Benchmark of the start-up time of the package and the cli.
+
+Runs each target in a new interpreter with python -X importtime, reporting the median import time (the cumulative
+time of the top-level imports) and wall time of --repeat runs, and the slowest modules imported. pandas and
+auto_reference_generator should only be imported when a Dataframe is needed, so a target which imports either of
+them fails the benchmark, as does a median import time over --max-ms if set; the exit code is non-zero on failure,
+so it can guard start-up time in CI.
+
+Usage: python benchmarks/bench_import.py [--targets package hash cli-version] [--repeat 5] [--max-ms 150] [--output bench_import.json]
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import argparse, json, os, statistics, subprocess, sys, time
+
+TARGETS = {'package': "import opex_manifest_generator",
+           'hash': "from opex_manifest_generator import HashGenerator",
+           'generator': "from opex_manifest_generator.opex_manifest import OpexManifestGenerator",
+           'cli-version': "import sys; sys.argv = ['opex_generate', '--version']; from opex_manifest_generator.cli import run_cli; run_cli()",
+           'cli-help': "import sys; sys.argv = ['opex_generate', '--help']; from opex_manifest_generator.cli import run_cli; run_cli()"}
+FORBIDDEN = ['pandas', 'auto_reference_generator']
+SLOWEST_MODULES = 5
+
+def parse_importtime(stderr: str) -> tuple:
+    """Returns the total import time in microseconds, and the cumulative time of each module, from -X importtime output."""
+    total = 0
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        cumulative = int(cumulative)
+        modules[name.strip()] = cumulative
+        if not name.startswith("  "):
+            # Top-level imports; nested imports are indented beneath them and included in their cumulative time.
+            total += cumulative
+    return total, modules
+
+def run_target(code: str) -> dict:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output = True, text = True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Target failed: {code}\n{result.stderr}")
+    total, modules = parse_importtime(result.stderr)
+    return {'import_ms': total / 1000, 'wall_ms': wall * 1000, 'modules': modules}
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the start-up time of the package and the cli")
+    parser.add_argument("--targets", nargs = '+', choices = list(TARGETS), default = list(TARGETS))
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--max-ms", type = float, default = None, help = "Fail if the median import time of any target is over this")
+    parser.add_argument("--output", default = None, help = "Path of the JSON results, if set")
+    args = parser.parse_args()
+    print(f"{'target':>12} {'import ms':>10} {'wall ms':>10} {'modules':>8}  slowest modules")
+    results = []
+    failed = False
+    for target in args.targets:
+        runs = [run_target(TARGETS[target]) for _ in range(args.repeat)]
+        modules = runs[-1]['modules']
+        slowest = sorted(modules.items(), key = lambda item: item[1], reverse = True)[:SLOWEST_MODULES]
+        forbidden = [name for name in FORBIDDEN if any(module == name or module.startswith(name + ".") for module in modules)]
+        result = {'target': target, 'code': TARGETS[target],
+                  'import_ms': statistics.median(run['import_ms'] for run in runs),
+                  'wall_ms': statistics.median(run['wall_ms'] for run in runs),
+                  'modules': len(modules), 'forbidden': forbidden,
+                  'slowest': [{'module': name.strip(), 'ms': cumulative / 1000} for name, cumulative in slowest]}
+        results.append(result)
+        slowest_text = ", ".join(f"{slow['module']} {slow['ms']:.1f}" for slow in result['slowest'])
+        print(f"{target:>12} {result['import_ms']:>10.1f} {result['wall_ms']:>10.1f} {result['modules']:>8}  {slowest_text}")
+        if forbidden:
+            print(f"FAIL: {target} imports {', '.join(forbidden)}")
+            failed = True
+        if args.max_ms is not None and result['import_ms'] > args.max_ms:
+            print(f"FAIL: {target} took {result['import_ms']:.1f} ms to import, over {args.max_ms} ms")
+            failed = True
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as f:
+            json.dump({'python': sys.version, 'repeat': args.repeat, 'max_ms': args.max_ms, 'results': results}, f, indent = 2)
+        print(f"Results written to: {args.output}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
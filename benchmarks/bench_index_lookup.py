@@ -0,0 +1,56 @@
+"""
+Benchmark for Dataframe lookups.
+
+Compares the previous per-entry column scan and .loc[idx, column].item() reads against the path
+index and records built by build_records, reading the Title and Security of every row once,
+for increasing spreadsheet sizes.
+
+Usage: python benchmarks/bench_index_lookup.py [--rows 1000 10000 50000]
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import argparse, time
+import pandas as pd
+from opex_manifest_generator.common import check_nan
+from opex_manifest_generator.opex_manifest import OpexManifestGenerator
+
+def build_generator(rows: int) -> OpexManifestGenerator:
+    omg = OpexManifestGenerator(root = ".")
+    omg.df = pd.DataFrame({omg.INDEX_FIELD: [f"/root/folder{i // 100}/file{i}.txt" for i in range(rows)],
+                           omg.TITLE_FIELD: [f"Title {i}" for i in range(rows)],
+                           omg.SECURITY_FIELD: ["open" if i % 2 else "closed" for i in range(rows)]})
+    omg.column_headers = omg.df.columns.values.tolist()
+    omg.set_input_flags()
+    return omg
+
+def column_scan(omg: OpexManifestGenerator, paths: list) -> float:
+    start = time.perf_counter()
+    for path in paths:
+        idx = omg.df.loc[omg.df[omg.INDEX_FIELD] == path, omg.INDEX_FIELD].index
+        check_nan(omg.df.loc[idx, omg.TITLE_FIELD].item())
+        check_nan(omg.df.loc[idx, omg.SECURITY_FIELD].item())
+    return time.perf_counter() - start
+
+def records(omg: OpexManifestGenerator, paths: list) -> float:
+    start = time.perf_counter()
+    omg.build_records()
+    for path in paths:
+        omg.xip_df_lookup(omg.record_lookup(path))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark Dataframe lookups")
+    parser.add_argument("--rows", nargs = '+', type = int, default = [1000, 5000, 20000])
+    args = parser.parse_args()
+    print(f"{'rows':>10} {'column scan (s)':>16} {'records (s)':>16} {'speed up':>10}")
+    for rows in args.rows:
+        omg = build_generator(rows)
+        paths = omg.df[omg.INDEX_FIELD].tolist()
+        scan = column_scan(omg, paths)
+        indexed = records(omg, paths)
+        print(f"{rows:>10} {scan:>16.3f} {indexed:>16.3f} {scan / indexed:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark of loading --input spreadsheets.
+
+Writes a synthetic input of --rows rows in each format, then times loading it with each --input-loader:
+'stream', which builds the records row by row, and 'dataframe', which reads the file with pandas first.
+--columns adds that many columns the run doesn't use, which are left unread, so load time should barely grow with them.
+Each load is made in its own process, so peak RSS is that load's alone (including importing what the
+loader needs); the best of --repeat loads is reported as rows/s, and written to --output as JSON if set.
+
+Usage: python benchmarks/bench_input_loader.py [--rows 100000] [--formats csv xlsx json xml] [--columns 0] [--repeat 3] [--output bench_input_loader.json]
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import argparse, json, os, shutil, subprocess, sys, tempfile, time
+
+FORMATS = ['csv', 'xlsx', 'json', 'xml']
+LOADERS = ['stream', 'dataframe']
+
+def write_input(path: str, input_format: str, rows: int, columns: int = 0) -> None:
+    import pandas as pd
+    df = pd.DataFrame({'FullName': [f"/accession/folder{i // 100}/file{i}.txt" for i in range(rows)],
+                       'Title': [f"File {i}" for i in range(rows)],
+                       'Description': [f"Description of file {i}" if i % 3 else None for i in range(rows)],
+                       'Security': ["open" if i % 2 else "closed" for i in range(rows)],
+                       'SourceID': [f"{i:08d}" for i in range(rows)],
+                       'Ignore': [i % 50 == 0 for i in range(rows)]})
+    for column in range(columns):
+        df[f"Notes {column}"] = [f"Note {column} on file {i}" for i in range(rows)]
+    if input_format == 'csv':
+        df.to_csv(path, index = False)
+    elif input_format == 'xlsx':
+        df.to_excel(path, index = False)
+    elif input_format == 'json':
+        df.to_json(path, orient = 'records')
+    elif input_format == 'xml':
+        df.to_xml(path, index = False)
+
+def run_writer(path: str, input_format: str, rows: int, columns: int = 0) -> None:
+    """Writes the input in a new process; peak RSS is kept across exec on Linux, so loads are started from a small process."""
+    config = {'path': path, 'format': input_format, 'rows': rows, 'columns': columns}
+    subprocess.run([sys.executable, os.path.abspath(__file__), "--write", json.dumps(config)], check = True)
+
+def run_worker(input_path: str, input_loader: str) -> dict:
+    """Loads the input once in a new process, returning its elapsed seconds, peak RSS and row count."""
+    config = {'input': input_path, 'input_loader': input_loader}
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(config)],
+                            check = True, capture_output = True, text = True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+def worker(config: dict) -> None:
+    import logging
+    from opex_manifest_generator.opex_manifest import OpexManifestGenerator
+    logging.basicConfig(level = logging.ERROR)
+    start = time.perf_counter()
+    omg = OpexManifestGenerator(root = ".", input = config['input'], input_loader = config['input_loader'])
+    omg.init_df()
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'seconds': elapsed, 'peak_rss_mb': peak_rss_mb(), 'rows': len(omg.records)}))
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, KiB elsewhere.
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        worker(json.loads(sys.argv[2]))
+        return
+    if len(sys.argv) == 3 and sys.argv[1] == "--write":
+        config = json.loads(sys.argv[2])
+        write_input(config['path'], config['format'], config['rows'], config['columns'])
+        return
+    parser = argparse.ArgumentParser(description = "Benchmark loading --input spreadsheets with each --input-loader")
+    parser.add_argument("--rows", type = int, default = 100000)
+    parser.add_argument("--formats", nargs = '+', choices = FORMATS, default = FORMATS)
+    parser.add_argument("--loaders", nargs = '+', choices = LOADERS, default = LOADERS)
+    parser.add_argument("--columns", type = int, default = 0, help = "Number of unused columns to add to the input")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--dir", default = None, help = "Directory to write the inputs in")
+    parser.add_argument("--output", default = None, help = "Path of the JSON results, if set")
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp(prefix = "bench_input_loader_", dir = args.dir)
+    try:
+        print(f"{'format':>8} {'loader':>10} {'MB':>8} {'seconds':>10} {'rows/s':>12} {'peak RSS MB':>12}")
+        results = []
+        for input_format in args.formats:
+            input_path = os.path.join(work_dir, f"input.{input_format}")
+            run_writer(input_path, input_format, args.rows, args.columns)
+            size_mb = os.path.getsize(input_path) / 1e6
+            for input_loader in args.loaders:
+                runs = [run_worker(input_path, input_loader) for _ in range(args.repeat)]
+                if any(run['rows'] != args.rows for run in runs):
+                    raise RuntimeError(f"{input_loader} loaded {runs[0]['rows']} of {args.rows} rows from {input_path}")
+                best = min(run['seconds'] for run in runs)
+                peak_rss = max((run['peak_rss_mb'] for run in runs if run['peak_rss_mb'] is not None), default = None)
+                result = {'format': input_format, 'loader': input_loader, 'rows': args.rows, 'columns': args.columns, 'size_mb': size_mb,
+                          'seconds': best, 'rows_per_s': args.rows / best, 'peak_rss_mb': peak_rss, 'runs': runs}
+                results.append(result)
+                print(f"{input_format:>8} {input_loader:>10} {size_mb:>8.1f} {best:>10.3f} {result['rows_per_s']:>12.0f} "
+                      f"{peak_rss if peak_rss is not None else '-':>12}")
+        if args.output:
+            with open(args.output, 'w', encoding = 'utf-8') as f:
+                json.dump({'python': sys.version, 'rows': args.rows, 'columns': args.columns, 'repeat': args.repeat, 'results': results}, f, indent = 2)
+            print(f"Results written to: {args.output}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark suite for the main modes of the generator.
+
+Builds a synthetic accession (see synthetic_accession.py), with a matching input spreadsheet and metadata
+template, then times a full run of each mode: plain (Folder manifests only), fixity with several algorithms,
+fixity with PAX fixity, autoref catalog, input with -m exact, zip, and clear-opex. Each run is made in its own
+process, so peak RSS is that mode's alone, and the tree is rebuilt before every run so each starts from the
+same state (and a warm page cache; point --dir at the storage you want to measure). The best of --repeat runs
+is reported as files/s and MB/s, and every run is written to --output as JSON, to compare between releases.
+
+Usage: python benchmarks/bench_modes.py [--modes plain fixity autoref] [--depth 3] [--fan-out 4] [--files 20] [--output bench_modes.json]
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import argparse, json, os, platform, shutil, subprocess, sys, tempfile, time
+from datetime import datetime
+from synthetic_accession import add_tree_arguments, accession_from_args
+
+MODES = ['plain', 'fixity', 'pax-fixity', 'autoref', 'input', 'zip', 'clear-opex']
+
+def mode_options(mode: str, args: argparse.Namespace, input_path: str, metadata_dir: str) -> tuple:
+    """Returns the (prepare, timed) generator options for a mode; prepare is run untimed beforehand, if set."""
+    fixity = {'algorithm': args.algorithm}
+    if mode == 'plain':
+        return None, {}
+    if mode == 'fixity':
+        return None, fixity
+    if mode == 'pax-fixity':
+        return None, dict(fixity, pax_fixity = True)
+    if mode == 'autoref':
+        return None, {'autoref_flag': 'catalog'}
+    if mode == 'input':
+        return None, {'input': input_path, 'metadata_flag': 'e', 'metadata_dir': metadata_dir}
+    if mode == 'zip':
+        return None, {'algorithm': args.algorithm[:1], 'zip_flag': True}
+    if mode == 'clear-opex':
+        return {'algorithm': args.algorithm[:1]}, {'clear_opex_flag': True}
+    raise ValueError(f'Unknown mode: {mode}')
+
+def run_worker(root: str, output_path: str, options: dict) -> dict:
+    """Runs the generator once in a new process, returning its elapsed seconds and peak RSS."""
+    config = {'root': root, 'output_path': output_path, 'options': options}
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(config)],
+                            check = True, capture_output = True, text = True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+def worker(config: dict) -> None:
+    import logging
+    from opex_manifest_generator.opex_manifest import OpexManifestGenerator
+    logging.basicConfig(level = logging.ERROR)
+    start = time.perf_counter()
+    try:
+        OpexManifestGenerator(root = config['root'], output_path = config['output_path'], **config['options']).main()
+    except SystemExit:
+        # Clearing Opexes with no other options ends the run with SystemExit.
+        pass
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'seconds': elapsed, 'peak_rss_mb': peak_rss_mb()}))
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, KiB elsewhere.
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+def version_info() -> dict:
+    info = {'python': platform.python_version(), 'platform': platform.platform(), 'date': datetime.now().isoformat(timespec = 'seconds')}
+    try:
+        from importlib.metadata import version
+        info['version'] = version('opex_manifest_generator')
+    except Exception:
+        info['version'] = None
+    try:
+        info['commit'] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = os.path.dirname(os.path.abspath(__file__)),
+                                        check = True, capture_output = True, text = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        info['commit'] = None
+    return info
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        worker(json.loads(sys.argv[2]))
+        return
+    parser = argparse.ArgumentParser(description = "Benchmark the main modes of the generator on a synthetic accession")
+    parser.add_argument("--modes", nargs = '+', choices = MODES, default = MODES)
+    parser.add_argument("--algorithm", nargs = '+', default = ['SHA-1', 'MD5', 'SHA-256'], choices = ['SHA-1', 'MD5', 'SHA-256', 'SHA-512'])
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--jobs", type = int, default = 1, help = "Passed to every run, see --jobs")
+    parser.add_argument("--writer-threads", type = int, default = 0, help = "Passed to every run, see --writer-threads")
+    parser.add_argument("--input-format", choices = ['csv', 'xlsx'], default = 'csv')
+    parser.add_argument("--dir", default = None, help = "Directory to create the test accession in")
+    parser.add_argument("--output", default = "bench_modes.json", help = "Path of the JSON results")
+    add_tree_arguments(parser)
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp(prefix = "bench_modes_", dir = args.dir)
+    try:
+        root = os.path.join(work_dir, "accession")
+        output_path = os.path.join(work_dir, "output")
+        metadata_dir = os.path.join(work_dir, "metadata")
+        input_path = os.path.join(work_dir, f"accession_input.{args.input_format}")
+        accession = accession_from_args(root, args).build()
+        accession.write_template(metadata_dir)
+        accession.write_input(input_path)
+        tree = accession.summary()
+        common = {'jobs': args.jobs, 'writer_threads': args.writer_threads, 'fixity_cache_flag': False}
+        print(f"{tree['files']} files, {tree['folders']} folders, {tree['bytes'] / 1e6:.1f} MB")
+        print(f"{'mode':>12} {'seconds':>10} {'files/s':>10} {'MB/s':>10} {'peak RSS MB':>12}")
+        results = []
+        for mode in args.modes:
+            prepare, options = mode_options(mode, args, input_path, metadata_dir)
+            runs = []
+            for _ in range(args.repeat):
+                shutil.rmtree(root)
+                shutil.rmtree(output_path, ignore_errors = True)
+                accession_from_args(root, args).build()
+                if prepare is not None:
+                    run_worker(root, output_path, dict(common, **prepare))
+                runs.append(run_worker(root, output_path, dict(common, **options)))
+            best = min(run['seconds'] for run in runs)
+            peak_rss = max((run['peak_rss_mb'] for run in runs if run['peak_rss_mb'] is not None), default = None)
+            result = {'mode': mode, 'options': options, 'seconds': best, 'files_per_s': tree['files'] / best,
+                      'mb_per_s': tree['bytes'] / 1e6 / best, 'peak_rss_mb': peak_rss, 'runs': runs}
+            results.append(result)
+            print(f"{mode:>12} {best:>10.3f} {result['files_per_s']:>10.1f} {result['mb_per_s']:>10.1f} {peak_rss if peak_rss is not None else '-':>12}")
+        with open(args.output, 'w', encoding = 'utf-8') as f:
+            json.dump(dict(version_info(), tree = tree, repeat = args.repeat, jobs = args.jobs, writer_threads = args.writer_threads,
+                           results = results), f, indent = 2)
+        print(f"Results written to: {args.output}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+if __name__ == "__main__":
+    main()
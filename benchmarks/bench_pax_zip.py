@@ -0,0 +1,75 @@
+"""
+Benchmark for pax zip fixity generation.
+
+Builds a zip of --members members, half stored and half deflated, then compares the previous approach
+of reopening the archive and decompressing every member once per algorithm through a 4 KiB buffer,
+against hash_pax_zip with one pass per member, raw reads of stored members, and --jobs threads.
+Checks every approach produces the same hashes.
+
+Usage: python benchmarks/bench_pax_zip.py [--members 200] [--member-kb 1024] [--jobs 1 4] [--algorithm SHA-1 MD5]
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import argparse, os, tempfile, time, zipfile
+from opex_manifest_generator.hash import hash_pax_zip, new_hash
+
+def per_algorithm(zip_path: str, algorithms: list) -> list:
+    """The previous implementation: a new ZipFile and a full decompression of every member for each algorithm."""
+    hashes = {}
+    for algorithm in algorithms:
+        with zipfile.ZipFile(zip_path, 'r') as z:
+            for file in z.filelist:
+                hash = new_hash(algorithm)
+                with z.open(file.filename, 'r') as data:
+                    while True:
+                        buff = data.read(4096)
+                        if not buff:
+                            break
+                        hash.update(buff)
+                hashes.setdefault(file.filename, {})[algorithm] = hash.hexdigest().upper()
+    return list(hashes.items())
+
+def make_zip(directory: str, members: int, member_kb: int) -> str:
+    fd, zip_path = tempfile.mkstemp(prefix = "bench_pax_", suffix = ".pax.zip", dir = directory)
+    os.close(fd)
+    # Half random (incompressible) data so deflate has real work, half text-like data.
+    random_data = os.urandom(member_kb * 1024)
+    text_data = (b"opex manifest generator " * (member_kb * 1024 // 24 + 1))[:member_kb * 1024]
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        for i in range(members):
+            compression = zipfile.ZIP_STORED if i % 2 == 0 else zipfile.ZIP_DEFLATED
+            z.writestr(f"content/file{i:05}.tif", random_data if i % 4 < 2 else text_data, compress_type = compression)
+    return zip_path
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark pax zip fixity generation")
+    parser.add_argument("--members", type = int, default = 200)
+    parser.add_argument("--member-kb", type = int, default = 1024)
+    parser.add_argument("--jobs", nargs = '+', type = int, default = [1, 4])
+    parser.add_argument("--algorithm", nargs = '+', default = ['SHA-1', 'MD5'], choices = ['SHA-1', 'MD5', 'SHA-256', 'SHA-512'])
+    parser.add_argument("--dir", default = None, help = "Directory to create the test zip in")
+    args = parser.parse_args()
+    zip_path = make_zip(args.dir, args.members, args.member_kb)
+    try:
+        modes = [("per algorithm (previous)", lambda: per_algorithm(zip_path, args.algorithm))]
+        for jobs in args.jobs:
+            modes.append((f"single pass, {jobs} jobs", lambda jobs = jobs: hash_pax_zip(zip_path, args.algorithm, jobs = jobs)))
+        size_mb = args.members * args.member_kb / 1024
+        print(f"{'mode':>26} {'seconds':>10} {'MB/s':>10}")
+        expected = None
+        for name, func in modes:
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            if expected is None:
+                expected = result
+            elif result != expected:
+                raise AssertionError(f"{name} produced different hashes")
+            print(f"{name:>26} {elapsed:>10.3f} {size_mb / elapsed:>10.1f}")
+    finally:
+        os.remove(zip_path)
+
+if __name__ == "__main__":
+    main()
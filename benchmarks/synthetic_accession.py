@@ -0,0 +1,200 @@
+"""
+Synthetic accession generator for benchmarks.
+
+Builds a reproducible tree of folders and files, configured by depth, fan-out, files per folder and
+file size distribution, with PAX folders and pax.zip archives spread through it. Alongside the tree it
+can write a metadata template and an input spreadsheet with a row for every file and folder, filling the
+Title, Description, Security and Identifier columns and a column for every element of the template
+(named by exact path, for use with -m exact).
+
+Usage: python benchmarks/synthetic_accession.py DIR [--depth 3] [--fan-out 4] [--files 20] [--size-distribution lognormal]
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import argparse, csv, math, os, random, zipfile
+from lxml import etree as ET
+
+SIZE_DISTRIBUTIONS = ['fixed', 'uniform', 'lognormal']
+
+TEMPLATE_NS = "http://www.example.org/opex-benchmark"
+TEMPLATE = f"""<bench:record xmlns:bench="{TEMPLATE_NS}">
+    <bench:title/>
+    <bench:creator/>
+    <bench:date/>
+    <bench:extent/>
+    <bench:subjects>
+        <bench:subject/>
+    </bench:subjects>
+</bench:record>
+"""
+
+class SyntheticAccession():
+    """
+    A reproducible synthetic tree: the same arguments and seed always produce the same names, sizes and content.
+
+    :param root: the directory to build the tree in; created if missing
+    :param depth: the number of levels of folders below root
+    :param fan_out: the number of folders in each folder above the deepest level
+    :param files: the number of files in each folder
+    :param mean_kb: the mean file size in KiB
+    :param size_distribution: how file sizes vary {fixed, uniform, lognormal}
+    :param pax_folders: the number of PAX folders to add, spread across the tree
+    :param pax_zips: the number of pax.zip archives to add, spread across the tree
+    :param pax_members: the number of files in each PAX folder or archive
+    :param seed: the random seed
+    """
+    def __init__(self, root: str, depth: int = 3, fan_out: int = 4, files: int = 20, mean_kb: float = 64,
+                 size_distribution: str = "lognormal", pax_folders: int = 0, pax_zips: int = 0, pax_members: int = 10, seed: int = 1):
+        if size_distribution not in SIZE_DISTRIBUTIONS:
+            raise ValueError(f'size_distribution must be one of {SIZE_DISTRIBUTIONS}, got: {size_distribution}')
+        self.root = os.path.abspath(root)
+        self.depth = depth
+        self.fan_out = fan_out
+        self.files = files
+        self.mean_kb = mean_kb
+        self.size_distribution = size_distribution
+        self.pax_folders = pax_folders
+        self.pax_zips = pax_zips
+        self.pax_members = pax_members
+        self.seed = seed
+        self.file_count = 0
+        self.folder_count = 0
+        self.total_bytes = 0
+        self.entries = []
+
+    def file_size(self, rng: random.Random) -> int:
+        mean = self.mean_kb * 1024
+        if self.size_distribution == "fixed":
+            return int(mean)
+        if self.size_distribution == "uniform":
+            return rng.randint(0, int(2 * mean))
+        # A long tail of large files, as in most accessions; sigma of 1.5 puts the median at about a third of the mean.
+        sigma = 1.5
+        return int(rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma))
+
+    def write_file(self, path: str, rng: random.Random) -> None:
+        size = self.file_size(rng)
+        with open(path, 'wb') as f:
+            f.write(rng.randbytes(size))
+        self.file_count += 1
+        self.total_bytes += size
+        self.entries.append(path)
+
+    def build(self) -> "SyntheticAccession":
+        """Writes the tree, returning self with its file, folder and byte counts."""
+        rng = random.Random(self.seed)
+        os.makedirs(self.root, exist_ok = True)
+        self.entries = [self.root]
+        folders = []
+        level = [self.root]
+        for _ in range(self.depth):
+            next_level = []
+            for parent in level:
+                for i in range(self.fan_out):
+                    folder = os.path.join(parent, f"folder{i:03}")
+                    os.makedirs(folder, exist_ok = True)
+                    self.entries.append(folder)
+                    next_level.append(folder)
+            folders.extend(next_level)
+            level = next_level
+        self.folder_count = len(folders) + 1
+        for folder in [self.root] + folders:
+            for i in range(self.files):
+                self.write_file(os.path.join(folder, f"file{i:05}.bin"), rng)
+        # PAX folders and archives are spread evenly through the tree, deepest folders first.
+        targets = list(reversed([self.root] + folders))
+        for i in range(self.pax_folders):
+            pax = os.path.join(targets[i % len(targets)], f"package{i:03}.pax")
+            os.makedirs(os.path.join(pax, "Representation_Preservation"), exist_ok = True)
+            self.entries.extend([pax, os.path.join(pax, "Representation_Preservation")])
+            for m in range(self.pax_members):
+                self.write_file(os.path.join(pax, "Representation_Preservation", f"member{m:03}.bin"), rng)
+        for i in range(self.pax_zips):
+            zip_path = os.path.join(targets[i % len(targets)], f"archive{i:03}.pax.zip")
+            with zipfile.ZipFile(zip_path, 'w') as z:
+                for m in range(self.pax_members):
+                    size = self.file_size(rng)
+                    info = zipfile.ZipInfo(f"Representation_Preservation/member{m:03}.bin", (2020, 1, 1, 0, 0, 0))
+                    info.compress_type = zipfile.ZIP_STORED if m % 2 == 0 else zipfile.ZIP_DEFLATED
+                    z.writestr(info, rng.randbytes(size))
+            self.file_count += 1
+            self.total_bytes += os.path.getsize(zip_path)
+            self.entries.append(zip_path)
+        return self
+
+    def write_template(self, metadata_dir: str) -> str:
+        """Writes the metadata template into metadata_dir, returning its path."""
+        os.makedirs(metadata_dir, exist_ok = True)
+        template_path = os.path.join(metadata_dir, "Benchmark Template.xml")
+        with open(template_path, 'w', encoding = 'utf-8') as f:
+            f.write(TEMPLATE)
+        return template_path
+
+    def template_columns(self) -> list:
+        """The exact path of each leaf element of the template, as used for column headers with -m exact."""
+        template = ET.ElementTree(ET.fromstring(TEMPLATE))
+        root_ln = ET.QName(template.getroot()).localname
+        columns = []
+        for elem in template.getroot().iter():
+            if elem is template.getroot() or len(elem):
+                continue
+            columns.append(template.getelementpath(elem).replace(f"{{{TEMPLATE_NS}}}", root_ln + ":"))
+        return columns
+
+    def write_input(self, input_path: str) -> str:
+        """Writes an input spreadsheet (csv or xlsx, by extension) with a row for every file and folder."""
+        columns = ["FullName", "Title", "Description", "Security", "Identifier"] + self.template_columns()
+        rows = []
+        for n, path in enumerate(self.entries):
+            name = os.path.basename(path)
+            row = [path, f"Title of {name}", f"Description of {name}", "open" if n % 3 else "closed", f"BENCH/{n}"]
+            for column in columns[5:]:
+                row.append("2020-01-01" if column.endswith("date") else f"{column.split(':')[-1]} {n}")
+            rows.append(row)
+        if input_path.endswith('.xlsx'):
+            import pandas as pd
+            pd.DataFrame(rows, columns = columns).to_excel(input_path, index = False)
+        else:
+            with open(input_path, 'w', newline = '', encoding = 'utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                writer.writerows(rows)
+        return input_path
+
+    def summary(self) -> dict:
+        return {'depth': self.depth, 'fan_out': self.fan_out, 'files_per_folder': self.files, 'mean_kb': self.mean_kb,
+                'size_distribution': self.size_distribution, 'pax_folders': self.pax_folders, 'pax_zips': self.pax_zips,
+                'pax_members': self.pax_members, 'seed': self.seed,
+                'files': self.file_count, 'folders': self.folder_count, 'bytes': self.total_bytes}
+
+def add_tree_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--depth", type = int, default = 3)
+    parser.add_argument("--fan-out", type = int, default = 4)
+    parser.add_argument("--files", type = int, default = 20, help = "Files in each folder")
+    parser.add_argument("--mean-kb", type = float, default = 64)
+    parser.add_argument("--size-distribution", choices = SIZE_DISTRIBUTIONS, default = "lognormal")
+    parser.add_argument("--pax-folders", type = int, default = 4)
+    parser.add_argument("--pax-zips", type = int, default = 4)
+    parser.add_argument("--pax-members", type = int, default = 10)
+    parser.add_argument("--seed", type = int, default = 1)
+
+def accession_from_args(root: str, args: argparse.Namespace) -> SyntheticAccession:
+    return SyntheticAccession(root, depth = args.depth, fan_out = args.fan_out, files = args.files, mean_kb = args.mean_kb,
+                              size_distribution = args.size_distribution, pax_folders = args.pax_folders, pax_zips = args.pax_zips,
+                              pax_members = args.pax_members, seed = args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Generate a synthetic accession, input spreadsheet and metadata template")
+    parser.add_argument("dir", help = "Directory to create the accession, spreadsheet and template in")
+    add_tree_arguments(parser)
+    parser.add_argument("--input-format", choices = ['csv', 'xlsx'], default = 'csv')
+    args = parser.parse_args()
+    accession = accession_from_args(os.path.join(args.dir, "accession"), args).build()
+    accession.write_template(os.path.join(args.dir, "metadata"))
+    accession.write_input(os.path.join(args.dir, f"accession_input.{args.input_format}"))
+    print(accession.summary())
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,30 @@ Author: Christopher Prince
 license: Apache License 2.0"
 """
 
-from .opex_manifest import OpexManifestGenerator,OpexDir,OpexFile
-from .hash import HashGenerator
 from .common import *
-from .cli import parse_args,run_cli
-import importlib.metadata
 
 __author__ = "Christopher Prince (c.pj.prince@gmail.com)"
 __license__ = "Apache License Version 2.0"
-__version__ = importlib.metadata.version("opex_manifest_generator")
\ No newline at end of file
+
+# The generator and cli are imported on first use, so importing the package (say for HashGenerator) stays quick.
+LAZY_IMPORTS = {'OpexManifestGenerator': '.opex_manifest',
+                'OpexDir': '.opex_manifest',
+                'OpexFile': '.opex_manifest',
+                'HashGenerator': '.hash',
+                'parse_args': '.cli',
+                'run_cli': '.cli'}
+
+def __getattr__(name: str):
+    if name in LAZY_IMPORTS:
+        import importlib
+        value = getattr(importlib.import_module(LAZY_IMPORTS[name], __name__), name)
+    elif name == '__version__':
+        import importlib.metadata
+        value = importlib.metadata.version("opex_manifest_generator")
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+def __dir__() -> list:
+    return sorted(set(globals()) | set(LAZY_IMPORTS) | {'__version__'})
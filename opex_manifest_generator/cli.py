@@ -6,13 +6,21 @@ license: Apache License 2.0"
 """
 
 import argparse, os, inspect, time, logging
-from opex_manifest_generator.opex_manifest import OpexManifestGenerator
-import importlib.metadata
 from datetime import datetime
-from opex_manifest_generator.common import running_time 
+from opex_manifest_generator.common import running_time, sort_folders_first
 
 logger = logging.getLogger(__name__)
 
+class VersionAction(argparse.Action):
+    """As argparse's version action, but only looks the version up when asked for, as importlib.metadata is slow to import."""
+    def __init__(self, option_strings, dest = argparse.SUPPRESS, default = argparse.SUPPRESS, help = "show program's version number and exit"):
+        super().__init__(option_strings = option_strings, dest = dest, default = default, nargs = 0, help = help)
+
+    def __call__(self, parser, namespace, values, option_string = None):
+        import importlib.metadata
+        print(f'{parser.prog} {importlib.metadata.version("opex_manifest_generator")}')
+        parser.exit()
+
 def parse_args():
     parser = argparse.ArgumentParser(description = "OPEX Manifest Generator for Preservica Uploads")
     parser.add_argument('root', nargs='?', default = os.getcwd(),
@@ -24,6 +32,74 @@ def parse_args():
     parser.add_argument("--pax-fixity", required = False, action = 'store_true', default = False,
                         help="""Enables use of PAX fixity generation, in line with Preservica's Recommendation.
                         "Files / folders ending in .pax or .pax.zip will have individual files in folder / zip added to Opex.""")
+    parser.add_argument("-j", "--jobs", required = False, type = int, default = 1,
+                        help="Set the number of workers used to generate fixities. Files are hashed ahead of the walk; output order is unaffected.")
+    parser.add_argument("--jobs-mode", required = False, choices = ['thread', 'process'], default = 'thread', type = str.lower,
+                        help="Set whether fixity workers are threads (default) or processes.")
+    parser.add_argument("--hash-buffer", required = False, type = size_helper, default = None,
+                        help="""Set the number of bytes read at a time when generating fixities. By default the buffer is sized to each file,
+                        in whole file system blocks, up to 1 MiB. Can also be set with HASH_BUFFER in the options file.""")
+    parser.add_argument("--hash-read-mode", required = False, choices = ['readinto', 'mmap'], default = None, type = str.lower,
+                        help="""Set how files are read when generating fixities: 'readinto' (default) reads into a reused buffer;
+                        'mmap' maps files over 16 MiB into memory instead, which can be faster for large files on local disks.
+                        Can also be set with HASH_READ_MODE in the options file.""")
+    parser.add_argument("--hash-io-policy", required = False, choices = ['default', 'fadvise', 'direct'], default = 'default', type = str.lower,
+                        help="""Set how fixity reads use the operating system's page cache. 'fadvise' tells the system each file is read once
+                        and drops it from the cache once hashed; 'direct' bypasses the cache (falling back to 'fadvise' where unsupported).
+                        Use either to avoid evicting other services' data from the cache when hashing large shares. Linux only.""")
+    parser.add_argument("--hash-rate-limit", required = False, type = size_helper, default = None,
+                        help="""Set the maximum number of bytes read per second when generating fixities, shared across all workers,
+                        so a run can share storage with other services. Accepts K, M and G suffixes, e.g. 200M.""")
+    parser.add_argument("--processes", required = False, type = int, default = 1,
+                        help="""Set the number of processes used to generate Opexes. The root is split into independent sub-folders,
+                        each generated in its own process; parent folder manifests are written once their sub-folders are complete.""")
+    parser.add_argument("--partition-depth", required = False, type = int, default = 1,
+                        help="Set the depth below root at which folders are split between processes when using --processes. Default is 1.")
+    parser.add_argument("--fixity-cache", required = False, action = 'store_true', default = False, dest = 'fixity_cache_flag',
+                        help="""Set to cache fixities between runs, in an SQLite database (<root>_FixityCache.sqlite) in the meta directory.
+                        Fixities of files which haven't changed since they were cached (same path, size, modified time and inode)
+                        are reused rather than regenerated. Off by default.""")
+    parser.add_argument("--fixity-cache-path", required = False, default = None,
+                        help="""Set the path of the fixity cache. Setting a path turns the cache on by itself, without --fixity-cache.
+                        Defaults to the meta directory.""")
+    parser.add_argument("--fixity-cache-size", required = False, type = int, default = 1000000,
+                        help="Set the maximum number of entries kept in the fixity cache; the least recently used are removed first.")
+    parser.add_argument("--resume", required = False, action = 'store_true', default = False, dest = 'resume_flag',
+                        help="""Resume an interrupted run from its journal in the meta directory. Entries the interrupted run completed
+                        are replayed into the exports rather than scanned or hashed again; use the same options as the interrupted run.""")
+    parser.add_argument("--no-journal", required = False, action = 'store_false', default = True, dest = 'journal_flag',
+                        help="Set to disable the run journal, so an interrupted run can't be resumed. Only runs generating fixities or removing files are journaled.")
+    parser.add_argument("--no-pretty-print", required = False, action = 'store_false', default = True, dest = 'pretty_print',
+                        help="Set to write Opexes without indentation, making them smaller and quicker to write.")
+    parser.add_argument("--incremental", required = False, action = 'store_true', default = False, dest = 'incremental_flag',
+                        help="""Only regenerate what changed since the last incremental run, using a snapshot in the meta directory.
+                        Opexes are regenerated for new or modified Files (by size and modified time), Folder manifests are only rewritten
+                        if their contents changed, and Opexes of Files or Folders no longer present are removed. Cannot be used with zip.""")
+    parser.add_argument("--writer-threads", required = False, type = int, default = 0,
+                        help="""Set the number of threads writing File Opexes (and Zips) in the background, so the walk and hashing
+                        don't wait on each write; useful on network storage. Each Folder's Opex is still written once everything below it is.
+                        Default is 0, writing them during the walk.""")
+    parser.add_argument("--writer-queue", required = False, type = int, default = 1000,
+                        help="Set the number of File Opexes which may wait to be written before the walk waits for the writer threads. Default is 1000.")
+    parser.add_argument("--profile", required = False, action = 'store_true', default = False, dest = 'profile_flag',
+                        help="""Time each stage of the run (scanning, lookups, hashing, metadata, serialising, writing and zipping),
+                        writing a report with totals, percentiles and the slowest entries to the meta directory as JSON and text.""")
+    parser.add_argument("--cprofile", required = False, action = 'store_true', default = False, dest = 'cprofile_flag',
+                        help="Write a cProfile dump of the run to the meta directory, for use with pstats or snakeviz.")
+    parser.add_argument("--progress", required = False, action = 'store_true', default = False, dest = 'progress_flag',
+                        help="""Log a progress line every --progress-interval seconds, with the Files and bytes done and the rate of
+                        each stage (Folders scanned, Files hashed, Opexes written). The tree is counted alongside the run, so lines also
+                        give the percentage done and an estimate of the time remaining. Use with --log-file for headless runs.""")
+    parser.add_argument("--progress-interval", required = False, type = float, default = 30.0,
+                        help="Set the number of seconds between progress lines. Default is 30.")
+    parser.add_argument("--no-prescan", required = False, action = 'store_false', default = True, dest = 'prescan_flag',
+                        help="Set to not count the tree for --progress, so progress lines give no percentage or estimate.")
+    parser.add_argument("--metrics", required = False, choices = ['prometheus', 'json'], default = None, type = str.lower, dest = 'metrics_format',
+                        help="""Write the run's metrics to the meta directory, alongside the Fixity export, as a Prometheus textfile (.prom)
+                        or a JSON document: entries processed, bytes hashed by algorithm, Opex and Zip bytes written, lookups, fixity cache
+                        hit rate and the wall and CPU time of each stage. Written at the end of the run, even if it fails.""")
+    parser.add_argument("--metrics-interval", required = False, type = float, default = None,
+                        help="Set the number of seconds between writes of --metrics during the run. By default they are only written at the end.")
     parser.add_argument("--fixity-export", required = False, action = 'store_false', default = True,
                         help="""Set whether to export the generated fixity list to a text file in the meta directory.
                         Enabled by default, disable with this flag.""")
@@ -55,6 +131,10 @@ def parse_args():
     # Input Options
     parser.add_argument("-i", "--input", required = False, nargs='?', 
                         help="Set to utilise a CSV / XLSX spreadsheet to import data from")
+    parser.add_argument("--input-loader", required = False, choices = ['dataframe', 'stream'], default = 'dataframe', type = str.lower,
+                        help = """Set how the input is read. 'dataframe' (the default) reads it into a Dataframe. 'stream' reads CSV, XLSX, XML and JSON
+                        (a list of records) files row by row, without a Dataframe, keeping cells as written rather than converting them to numbers;
+                        other files are read into a Dataframe.""")
     parser.add_argument("-rm", "--remove", required = False, action = "store_true", default = False,
                         help="Set whether to enable removals of files and folders from a directory. ***Currently in testing")    
     parser.add_argument("--removal-export", required = False, action = 'store_false', default = True,
@@ -120,13 +200,15 @@ def parse_args():
                         help="Set the logging level (default: INFO)")
     parser.add_argument("--log-file", required=False, nargs='?', default=None,
                         help="Optional path to write logs to a file (default: stdout)")
-    parser.add_argument("-v", "--version", action = 'version', version = '%(prog)s {version}'.format(version = importlib.metadata.version("opex_manifest_generator")))
+    parser.add_argument("-v", "--version", action = VersionAction)
 
     args = parser.parse_args()
     return args
 
 def run_cli():
     args = parse_args()
+    # Imported once the arguments are parsed, so --help and --version return without loading the generator.
+    from opex_manifest_generator.opex_manifest import OpexManifestGenerator
 
     # Configure logging early so other modules inherit the settings
     try:
@@ -222,12 +304,24 @@ def run_cli():
     
     if args.fixity:
         logger.info(f'Fixity is activated, using {args.fixity} algorithm')
+    if args.jobs < 1:
+        logger.error('Jobs must be 1 or more.')
+        raise ValueError('Jobs must be 1 or more.')
+    if args.hash_buffer is not None and args.hash_buffer < 0:
+        logger.error('Hash Buffer must be 0 (automatic) or more.')
+        raise ValueError('Hash Buffer must be 0 (automatic) or more.')
+    if args.hash_rate_limit is not None and args.hash_rate_limit <= 0:
+        logger.error('Hash Rate Limit must be more than 0.')
+        raise ValueError('Hash Rate Limit must be more than 0.')
+    if args.processes < 1 or args.partition_depth < 1:
+        logger.error('Processes and Partition Depth must be 1 or more.')
+        raise ValueError('Processes and Partition Depth must be 1 or more.')
 
     sort_key = None
     if args.sort_by:
         if args.sort_by == "folders_first":
             logger.debug('Sorting by folders_first')
-            sort_key = lambda x: (os.path.isfile(x), str.casefold(x))
+            sort_key = sort_folders_first
         elif args.sort_by == "alphabetical":
             logger.debug('Sorting by alphabetical')
             sort_key = str.casefold
@@ -291,6 +385,31 @@ def run_cli():
                           delimiter = args.delimiter,
                           keywords_abbreviation_number = args.keywords_abbreviation_number,
                           sort_key = sort_key,
+                          jobs = args.jobs,
+                          jobs_mode = args.jobs_mode,
+                          hash_buffer = args.hash_buffer,
+                          hash_read_mode = args.hash_read_mode,
+                          hash_io_policy = args.hash_io_policy,
+                          hash_rate_limit = args.hash_rate_limit,
+                          processes = args.processes,
+                          partition_depth = args.partition_depth,
+                          fixity_cache_flag = args.fixity_cache_flag or args.fixity_cache_path is not None,
+                          fixity_cache_path = args.fixity_cache_path,
+                          fixity_cache_max_entries = args.fixity_cache_size,
+                          journal_flag = args.journal_flag,
+                          resume_flag = args.resume_flag,
+                          incremental_flag = args.incremental_flag,
+                          pretty_print = args.pretty_print,
+                          writer_threads = args.writer_threads,
+                          writer_queue = args.writer_queue,
+                          profile_flag = args.profile_flag,
+                          cprofile_flag = args.cprofile_flag,
+                          progress_flag = args.progress_flag,
+                          progress_interval = args.progress_interval,
+                          prescan_flag = args.prescan_flag,
+                          metrics_format = args.metrics_format,
+                          metrics_interval = args.metrics_interval,
+                          input_loader = args.input_loader,
                           ).main()
     logger.info(f"Run Complete! Ran for: {running_time(start_time)}")    
 
@@ -304,6 +423,18 @@ def fixity_helper(x: str):
         x = 'SHA-512'
     return x.upper()
 
+def size_helper(x: str) -> int:
+    x = x.strip().upper()
+    if x.endswith('B'):
+        x = x[:-1]
+    multiplier = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}.get(x[-1:], 1)
+    if multiplier > 1:
+        x = x[:-1]
+    try:
+        return int(float(x) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid size: {x}; use a number of bytes, optionally with a K, M or G suffix')
+
 class EmptyIsTrueFixity(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         if len(values) == 0:
@@ -5,9 +5,9 @@ author: Christopher Prince
 license: Apache License 2.0"
 """
 
-import zipfile, os, sys, stat, shutil, logging, lxml
+import zipfile, os, re, sys, stat, shutil, sqlite3, threading, time, logging, lxml.etree
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +24,21 @@ def zip_opex(file_path,opex_path = None) -> str:
         logger.warning(f'A Zip file already exists for: {zip_file}')
     return zip_file
 
+def enable_wal(conn: sqlite3.Connection, timeout: float = 60) -> None:
+    """
+    Switches an SQLite database to WAL mode. Switching a new database takes a lock which SQLite doesn't wait for,
+    so while another process (a subtree worker) is opening the same database, it is retried until timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
 def remove_tree(path: str, removed_list: list) -> None:
     removed_list.append(path)
     logger.info(f"Removing: {path}")
@@ -50,15 +65,26 @@ def win_256_check(path) -> str:
             path = u"\\\\?\\" + path
     return path
 
-def filter_win_hidden(path: str) -> bool:
+def filter_win_hidden(path: str, entry: Optional[os.DirEntry] = None) -> bool:
     if sys.platform =="win32":
-        if bool(os.stat(path).st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN) is True:
+        # A DirEntry's stat comes from the directory scan on Windows, so no further call is needed.
+        st = entry.stat() if entry is not None else os.stat(path)
+        if bool(st.st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN) is True:
             return True
         else:
             return False
     else:
         return False
-    
+
+def define_output_file(output_path: str, output_name: str, meta_dir_name: str = 'meta', meta_dir_flag: Optional[bool] = True,
+                       output_suffix: Optional[str] = None, output_format: str = "xlsx") -> str:
+    """As auto_reference_generator's, which can't be imported without importing pandas."""
+    if meta_dir_flag:
+        output_path = os.path.join(output_path, meta_dir_name)
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    return os.path.join(output_path, str(os.path.basename(output_name)) + (output_suffix or "") + "." + output_format)
+
 def win_path_delimiter() -> str:
     if sys.platform == "win32":
         return "\\"
@@ -70,22 +96,178 @@ def check_nan(value) -> Optional[str]:
         value = None
     return value
 
+FALSE_FLAGS = {"", "false", "no"}
+
+def check_flag(value) -> bool:
+    """
+    Reads a cell marking a row, such as Ignore, as True or False. Text cells (as streamed loaders
+    keep them) are read as numbers where they can be, so 0, 0.0, False and blanks are False however the cell was loaded.
+    """
+    if isinstance(value, str):
+        value = value.strip()
+        if value.lower() in FALSE_FLAGS:
+            return False
+        try:
+            return float(value) != 0
+        except ValueError:
+            return True
+    return bool(value)
+
+class ScanEntry(str):
+    """
+    A path listed by a directory scan, keeping the os.DirEntry it came from.
+
+    The entry's type comes from the scan and its stat result is cached on first use, so filtering,
+    sorting and sizing don't go back to the file system. opex_exists records whether a matching
+    .opex was listed in the same scan.
+    """
+    def __new__(cls, path: str, entry: os.DirEntry, opex_exists: Optional[bool] = None):
+        self = super().__new__(cls, path)
+        self.entry = entry
+        self.opex_exists = opex_exists
+        return self
+
+    def __reduce__(self):
+        # DirEntry can't be pickled, so scanned paths are sent to worker processes as plain strings.
+        return (str, (str(self),))
+
+    def is_dir(self) -> bool:
+        return self.entry.is_dir()
+
+    def is_file(self) -> bool:
+        return self.entry.is_file()
+
+    @property
+    def size(self) -> int:
+        return self.entry.stat().st_size
+
+OPEX_TMP_SUFFIX = ".opex.tmp"
+# Files SQLite keeps alongside a database while it is open.
+SQLITE_SIDE_SUFFIXES = ("-wal", "-shm", "-journal")
+
 def check_opex(opex_path:str) -> bool:
+    if isinstance(opex_path, ScanEntry) and opex_path.opex_exists is not None:
+        return not opex_path.opex_exists
     opex_path = opex_path + ".opex" 
     if os.path.exists(win_256_check(opex_path)):
         return False
     else: 
         return True
 
-def write_opex(path: str, opexxml: lxml.etree.Element) -> str:
+def opex_bytes(opexxml: lxml.etree.Element, pretty_print: bool = True) -> bytes:
+    """Serialises an Opex exactly as write_opex writes it."""
+    if pretty_print:
+        lxml.etree.indent(opexxml, "  ")
+    return lxml.etree.tostring(opexxml, pretty_print=pretty_print, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def xml_text(value: str) -> str:
+    """Escapes text content as lxml serialises it, rejecting the control characters lxml rejects."""
+    if _XML_INVALID.search(value):
+        raise ValueError('All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters')
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\r", "&#13;")
+
+def xml_attr(value: str) -> str:
+    """Escapes an attribute value as lxml serialises it."""
+    return xml_text(value).replace('"', "&quot;").replace("\n", "&#10;").replace("\t", "&#9;")
+
+XML_DECLARATION = "<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+
+OPEX_STREAM_MARKER = "opex-stream"
+STREAM_BATCH = 1024
+
+def manifest_chunks(opexxml: lxml.etree.Element, folders_xml: lxml.etree.Element, files_xml: lxml.etree.Element,
+                    folders: list, files: list, pretty_print: bool = True) -> Iterator[bytes]:
+    """
+    Serialises a Folder Opex in chunks, rendering its Manifest's Folder and File entries as they are enumerated
+    rather than holding them in the tree and in one serialised document.
+
+    The rest of the Opex is serialised by lxml with a marker where the entries go, so the output is the same as
+    write_opex had the entries been added to folders_xml and files_xml (after any children they already have).
+
+    :param folders: the Folder names
+    :param files: (name, type, size) for each File; size is None for metadata Files
+    """
+    prefix = f"{folders_xml.prefix}:" if folders_xml.prefix else ""
+
+    def render_folder(name: str) -> str:
+        return f"<{prefix}Folder>{xml_text(name)}</{prefix}Folder>"
+
+    def render_file(entry: tuple) -> str:
+        name, file_type, size = entry
+        size = f' size="{size}"' if size is not None else ""
+        return f'<{prefix}File type="{file_type}"{size}>{xml_text(name)}</{prefix}File>'
+
+    sections = []
+    markers = []
+    for element, entries, render in ((folders_xml, folders, render_folder), (files_xml, files, render_file)):
+        if entries:
+            marker = lxml.etree.Comment(OPEX_STREAM_MARKER)
+            element.append(marker)
+            markers.append(marker)
+            sections.append((entries, render))
+    try:
+        skeleton = opex_bytes(opexxml, pretty_print = pretty_print)
+    finally:
+        for marker in markers:
+            marker.getparent().remove(marker)
+    pieces = skeleton.split(f"<!--{OPEX_STREAM_MARKER}-->".encode('UTF-8'))
+    yield pieces[0]
+    for (entries, render), previous, piece in zip(sections, pieces, pieces[1:]):
+        # Each entry takes the marker's place and indentation.
+        separator = "\n" + previous.rsplit(b"\n", 1)[-1].decode('UTF-8') if pretty_print else ""
+        for start in range(0, len(entries), STREAM_BATCH):
+            batch = separator.join(render(entry) for entry in entries[start:start + STREAM_BATCH])
+            yield ((separator if start else "") + batch).encode('UTF-8')
+        yield piece
+
+def write_opex(path: str, opexxml: lxml.etree.Element, chunks: Optional[Iterable[bytes]] = None, pretty_print: bool = True) -> str:
+    """
+    Writes an Opex alongside path, from opexxml or from the chunks manifest_chunks serialised it to.
+    """
     opex_path = win_256_check(str(path) + ".opex")
-    opex = lxml.etree.indent(opexxml, "  ")
-    opex = lxml.etree.tostring(opexxml, pretty_print=True, xml_declaration=True, encoding="UTF-8", standalone=True)
-    with open(f'{opex_path}', 'w', encoding="UTF-8") as writer:
-        writer.write(opex.decode('UTF-8'))
-        logger.info('Saved Opex File to: ' + opex_path)
+    if chunks is None:
+        chunks = [opex_bytes(opexxml, pretty_print = pretty_print)]
+    # Written to a temporary file and renamed into place, so an interrupted run never leaves a partial Opex.
+    # Named per process and thread rather than with mkstemp, so the Opex keeps the usual permissions.
+    tmp_path = win_256_check(os.path.join(os.path.dirname(opex_path), f".{os.path.basename(opex_path)}.{os.getpid()}.{threading.get_ident()}{OPEX_TMP_SUFFIX}"))
+    try:
+        with open(tmp_path, 'wb') as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+        os.replace(tmp_path, opex_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.info('Saved Opex File to: ' + opex_path)
     return opex_path
 
+def sort_folders_first(path: str) -> tuple:
+    """Sort key placing folders before files, then sorting alphabetically (case-insensitive)."""
+    if isinstance(path, ScanEntry):
+        return (path.is_file(), str.casefold(path))
+    return (os.path.isfile(path), str.casefold(path))
+
+def element_locator(root: lxml.etree.Element, elem: Optional[lxml.etree.Element]) -> Optional[tuple]:
+    """Returns the child positions leading from root to elem, or None if elem was not found."""
+    if elem is None:
+        return None
+    locator = []
+    while elem is not root:
+        parent = elem.getparent()
+        locator.append(parent.index(elem))
+        elem = parent
+    return tuple(reversed(locator))
+
+def locate_element(root: lxml.etree.Element, locator: tuple) -> lxml.etree.Element:
+    """Follows a locator from element_locator to the matching element in a copy of the same tree."""
+    elem = root
+    for position in locator:
+        elem = elem[position]
+    return elem
+
 def running_time(start_time) -> timedelta:
     running_time = datetime.now() - start_time 
     return running_time
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+List Export class for writing the Fixity and Removals lists as the run goes.
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import os, shutil, tempfile, time, logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+def part_file(output_file: Optional[str]) -> Optional[str]:
+    """Creates a part file alongside an export, for a subtree worker to write its share of the list to."""
+    if output_file is None:
+        return None
+    fd, part_path = tempfile.mkstemp(prefix = os.path.basename(output_file) + ".", suffix = ".part", dir = os.path.dirname(output_file))
+    os.close(fd)
+    return part_path
+
+class ListExport():
+    """
+    Writes a list export line by line as the run goes, in the same format as export_list_txt.
+
+    Lines are buffered and written in batches, and the file is fsynced at most every sync_interval
+    seconds, so memory stays constant however large the tree and a crash only loses the last batch.
+    Once start_capture is called, lines are also held until take_recent, for the run journal.
+
+    :param output_file: the file to write, or None to only count the lines
+    :param buffer_lines: the number of lines held before they are written
+    :param sync_interval: the minimum number of seconds between fsyncs
+    """
+    def __init__(self, output_file: Optional[str], buffer_lines: int = 1000, sync_interval: float = 10.0):
+        self.output_file = output_file
+        self.buffer_lines = buffer_lines
+        self.sync_interval = sync_interval
+        self.count = 0
+        self.buffer = []
+        self.recent = None
+        self.last_sync = time.monotonic()
+        self.writer = None
+        while output_file is not None:
+            try:
+                self.writer = open(output_file, 'w')
+                break
+            except PermissionError as e:
+                logger.warning(f'File {e} failed to open; waiting 10 seconds to try again...')
+                time.sleep(10)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, line) -> None:
+        if self.recent is not None:
+            self.recent.append(str(line))
+        self.write(line)
+
+    def write(self, line) -> None:
+        self.count += 1
+        if self.writer is None:
+            return
+        self.buffer.append(f"{line}\n")
+        if len(self.buffer) >= self.buffer_lines:
+            self.flush()
+
+    def extend(self, lines) -> None:
+        for line in lines:
+            self.append(line)
+
+    def replay(self, lines: list) -> None:
+        """Writes lines recorded by an earlier run, without capturing them again."""
+        for line in lines:
+            self.write(line)
+
+    def start_capture(self) -> None:
+        self.recent = []
+
+    def take_recent(self) -> list:
+        """Returns the lines added since the last call, when capturing."""
+        recent = self.recent or []
+        if self.recent is not None:
+            self.recent = []
+        return recent
+
+    def flush(self, sync: bool = False) -> None:
+        if self.writer is None:
+            return
+        self.writer.writelines(self.buffer)
+        self.buffer.clear()
+        self.writer.flush()
+        now = time.monotonic()
+        if sync or now - self.last_sync >= self.sync_interval:
+            os.fsync(self.writer.fileno())
+            self.last_sync = now
+
+    def append_part(self, part_path: Optional[str], count: int) -> None:
+        """Appends the lines a subtree worker wrote to a part file, then removes the part file."""
+        self.count += count
+        if part_path is None:
+            return
+        if self.recent is not None:
+            with open(part_path, 'r') as reader:
+                self.recent.extend(line.rstrip('\n') for line in reader)
+        if self.writer is not None:
+            self.flush()
+            with open(part_path, 'r') as reader:
+                shutil.copyfileobj(reader, self.writer)
+        os.remove(part_path)
+
+    def close(self) -> None:
+        if self.writer is None:
+            return
+        try:
+            self.flush(sync = True)
+        finally:
+            self.writer.close()
+            self.writer = None
+        logger.info(f"Saved file to: {self.output_file}")
+
+    def discard(self) -> None:
+        """Closes and removes the file, for part files a failed worker won't hand back."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.output_file is not None and os.path.exists(self.output_file):
+            os.remove(self.output_file)
@@ -0,0 +1,132 @@
+"""
+Fixity Cache class for reusing fixities of unchanged files between runs.
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import os, sqlite3, time, logging
+from typing import Optional
+from opex_manifest_generator.common import win_256_check, enable_wal
+
+logger = logging.getLogger(__name__)
+
+class FixityCache():
+    """
+    An SQLite cache of generated fixities, keyed on file identity.
+
+    An entry is only reused while the file's path, size, mtime_ns, inode and device all match;
+    entries which no longer match are removed when they are looked up. Once the run is complete
+    the least recently used entries beyond max_entries are evicted.
+
+    Changes are held in memory and written in one short transaction every commit_interval changes, so the
+    write lock is never held while the walk goes on; subtree worker processes share the cache.
+
+    :param cache_path: the path of the SQLite database
+    :param max_entries: the maximum number of (path, algorithm) entries to keep
+    :param commit_interval: the number of changes between commits
+    """
+    def __init__(self, cache_path: str, max_entries: int = 1000000, commit_interval: int = 1000):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.commit_interval = commit_interval
+        self.hits = 0
+        self.misses = 0
+        self.pending = []
+        self.pending_count = 0
+        self.pending_stores = {}
+        self.run_stamp = time.time_ns()
+        try:
+            self.conn = sqlite3.connect(cache_path, timeout = 60)
+            enable_wal(self.conn)
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS fixity (
+                                    path TEXT NOT NULL,
+                                    algorithm TEXT NOT NULL,
+                                    size INTEGER NOT NULL,
+                                    mtime_ns INTEGER NOT NULL,
+                                    inode INTEGER NOT NULL,
+                                    device INTEGER NOT NULL,
+                                    hash TEXT NOT NULL,
+                                    last_used INTEGER NOT NULL,
+                                    PRIMARY KEY (path, algorithm))""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS fixity_last_used ON fixity (last_used)")
+            self.conn.commit()
+            logger.debug(f'Fixity cache opened at: {cache_path}')
+        except sqlite3.Error as e:
+            logger.exception(f'Failed to open Fixity cache at {cache_path}: {e}')
+            raise
+
+    @staticmethod
+    def identity(file_path: str, stat_result: Optional[os.stat_result] = None) -> tuple:
+        st = stat_result if stat_result is not None else os.stat(win_256_check(file_path))
+        return (st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev)
+
+    def _changed(self, sql: str, rows: list) -> None:
+        self.pending.append((sql, rows))
+        self.pending_count += len(rows)
+        if self.pending_count >= self.commit_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the held changes in a single transaction."""
+        if not self.pending:
+            return
+        with self.conn:
+            for sql, rows in self.pending:
+                self.conn.executemany(sql, rows)
+        self.pending = []
+        self.pending_count = 0
+        self.pending_stores = {}
+
+    def lookup(self, file_path: str, algorithm: list, identity: tuple) -> Optional[dict]:
+        """
+        Returns {algorithm: HASH} if every algorithm is cached for the file's current identity, otherwise None.
+        """
+        found = {}
+        stored = self.pending_stores.get(file_path)
+        if stored is not None and stored[0] == identity and all(algorithm_type in stored[1] for algorithm_type in algorithm):
+            # Stored by this run, but not yet written.
+            self.hits += 1
+            return {algorithm_type: stored[1][algorithm_type] for algorithm_type in algorithm}
+        rows = self.conn.execute("SELECT algorithm, size, mtime_ns, inode, device, hash FROM fixity WHERE path = ?", (file_path,)).fetchall()
+        for algorithm_type, size, mtime_ns, inode, device, hash_value in rows:
+            if (size, mtime_ns, inode, device) == identity:
+                found[algorithm_type] = hash_value
+            else:
+                # File has changed since it was cached.
+                self._changed("DELETE FROM fixity WHERE path = ? AND algorithm = ?", [(file_path, algorithm_type)])
+        if all(algorithm_type in found for algorithm_type in algorithm):
+            self._changed("UPDATE fixity SET last_used = ? WHERE path = ?", [(self.run_stamp, file_path)])
+            self.hits += 1
+            logger.debug(f'Fixity cache hit for: {file_path}')
+            return {algorithm_type: found[algorithm_type] for algorithm_type in algorithm}
+        self.misses += 1
+        return None
+
+    def store(self, file_path: str, hashes: dict, identity: tuple) -> None:
+        """Stores hashes against the identity of the file taken before it was hashed."""
+        size, mtime_ns, inode, device = identity
+        self.pending_stores[file_path] = (identity, hashes)
+        self._changed("INSERT OR REPLACE INTO fixity VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                      [(file_path, algorithm_type, size, mtime_ns, inode, device, hash_value, self.run_stamp)
+                       for algorithm_type, hash_value in hashes.items()])
+
+    def evict(self) -> int:
+        """Removes the least recently used entries beyond max_entries, returning the number removed."""
+        self.flush()
+        count = self.conn.execute("SELECT COUNT(*) FROM fixity").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        self.conn.execute("DELETE FROM fixity WHERE rowid IN (SELECT rowid FROM fixity ORDER BY last_used ASC LIMIT ?)", (excess,))
+        self.conn.commit()
+        logger.info(f'Evicted {excess} entries from Fixity cache')
+        return excess
+
+    def close(self, evict: bool = True) -> None:
+        try:
+            self.flush()
+            if evict:
+                self.evict()
+        finally:
+            self.conn.close()
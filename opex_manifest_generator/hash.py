@@ -5,37 +5,265 @@ author: Christopher Prince
 license: Apache License 2.0"
 """
 
-import hashlib, logging
-from opex_manifest_generator.common import win_256_check 
+import hashlib, logging, mmap, os, errno, threading, time, struct, zipfile, zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Optional, Union
+from opex_manifest_generator.common import win_256_check
 
 logger = logging.getLogger(__name__)
 
+# Automatic buffers are sized to the file, in whole file system blocks, up to MAX_BUFFER.
+MAX_BUFFER = 1024 * 1024
+# In mmap mode, files smaller than this are still read, as mapping them costs more than it saves.
+MMAP_THRESHOLD = 16 * 1024 * 1024
+READ_MODES = ("readinto", "mmap")
+# In 'fadvise' (and 'direct') policy, pages already hashed are dropped from the page cache every DONTNEED_INTERVAL bytes.
+IO_POLICIES = ("default", "fadvise", "direct")
+DONTNEED_INTERVAL = 8 * 1024 * 1024
+# Mapped files are hashed in slices, so the rate limit applies within a file.
+MMAP_CHUNK = 8 * 1024 * 1024
+DIRECT_ALIGNMENT = 4096
+# Positions of the name and extra field lengths in a zip member's local file header.
+ZIP_NAME_LENGTH = 10
+ZIP_EXTRA_LENGTH = 11
+FADVISE = hasattr(os, 'posix_fadvise')
+DIRECT_IO = hasattr(os, 'O_DIRECT')
+
+def new_hash(algorithm: str):
+    """Return a fresh hashlib object for an algorithm name, defaulting to SHA-1."""
+    if algorithm in ("SHA1","SHA-1"):
+        return hashlib.sha1()
+    elif algorithm == "MD5":
+        return hashlib.md5()
+    elif algorithm in ("SHA256","SHA-256"):
+        return hashlib.sha256()
+    elif algorithm in ("SHA512","SHA-512"):
+        return hashlib.sha512()
+    else:
+        return hashlib.sha1()
+
+class RateLimiter():
+    """
+    A token bucket shared by every thread hashing in a process, capping the bytes read per second.
+
+    Readers take their bytes up front and sleep off any debt outside the lock, so concurrent readers share the rate evenly.
+
+    :param rate: the number of bytes per second
+    :param burst: the number of bytes which can be read at once before the cap applies, defaults to one second's worth
+    """
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def rate_limiter(rate: Optional[float]) -> Optional[RateLimiter]:
+    """Returns the process wide limiter for a rate, so every generator in a process draws from the same bucket."""
+    if not rate:
+        return None
+    with _limiters_lock:
+        if rate not in _limiters:
+            _limiters[rate] = RateLimiter(rate)
+        return _limiters[rate]
+
+class HashStats():
+    """
+    Thread-safe totals of the files and bytes hashed, for the run summary.
+
+    :param progress: a Progress to add each hashed file to, for --progress
+    """
+    def __init__(self, progress = None):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.progress = progress
+
+    def add(self, files: int, nbytes: int, seconds: float) -> None:
+        with self.lock:
+            self.files += files
+            self.bytes += nbytes
+            self.seconds += seconds
+        if self.progress is not None:
+            self.progress.add(hashed_files = files, hashed_bytes = nbytes)
+
+    def as_dict(self) -> dict:
+        return {'files': self.files, 'bytes': self.bytes, 'seconds': self.seconds}
+
+    def merge(self, stats: dict) -> None:
+        # Subtree workers add to the progress counts themselves as they go.
+        with self.lock:
+            self.files += stats.get('files', 0)
+            self.bytes += stats.get('bytes', 0)
+            self.seconds += stats.get('seconds', 0.0)
+
+    def summary(self, wall_seconds: float) -> str:
+        """Effective throughput over the run's wall time, and the read rate while files were being hashed."""
+        megabytes = self.bytes / (1024 * 1024)
+        effective = megabytes / wall_seconds if wall_seconds > 0 else 0.0
+        reading = megabytes / self.seconds if self.seconds > 0 else 0.0
+        return f'Hashed {self.files} files ({megabytes:.1f} MiB) at {effective:.1f} MiB/s effective, {reading:.1f} MiB/s per reader'
+
 class HashGenerator():
-    def __init__(self, algorithm: str = "SHA-1", buffer: int = 4096):
+    """
+    Generates fixities for files and pax zip members.
+
+    Files are read with readinto() into a single reused buffer, so no new bytes object is made per read.
+    In 'mmap' mode, files over MMAP_THRESHOLD are mapped and hashed in place instead.
+
+    The io_policy keeps hashing from filling the page cache: 'fadvise' advises the kernel the file is read once,
+    sequentially, and drops pages once they are hashed; 'direct' reads with O_DIRECT, bypassing the cache entirely,
+    falling back to 'fadvise' where the platform or file system doesn't support it.
+
+    :param algorithm: the algorithm to use, or a list of algorithms for the multi-digest methods
+    :param buffer: the number of bytes read per chunk; None or 0 sizes it from the file and its file system's block size
+    :param read_mode: how to read files {readinto, mmap}
+    :param io_policy: how reads use the page cache {default, fadvise, direct}
+    :param rate_limit: the maximum number of bytes read per second, shared by every generator in the process
+    """
+    def __init__(self, algorithm: Union[str, list] = "SHA-1", buffer: Optional[int] = None, read_mode: str = "readinto",
+                 io_policy: str = "default", rate_limit: Optional[float] = None):
         self.algorithm = algorithm
         self.buffer = buffer
+        self.read_mode = read_mode
+        self.io_policy = io_policy
+        self.limiter = rate_limiter(rate_limit)
+        self.read_buffer = bytearray()
+        self.direct_buffer = None
+        self.last_read = (0, 0.0)
+
+    def _algorithms(self) -> list:
+        if isinstance(self.algorithm, str):
+            return [self.algorithm]
+        return list(dict.fromkeys(self.algorithm or ["SHA-1"]))
+
+    def buffer_size(self, file_size: int, block_size: int = 0) -> int:
+        """The read size for a file: the set buffer, or the file size rounded up to whole blocks, capped at MAX_BUFFER."""
+        if self.buffer:
+            return self.buffer
+        block_size = block_size or 4096
+        size = min(max(file_size, 1), MAX_BUFFER)
+        return -(-size // block_size) * block_size
+
+    def read_hashes(self, file_path: str, hashes: list) -> int:
+        """Reads a file once, updating every hash object in hashes. Returns the number of bytes read."""
+        start = time.perf_counter()
+        if self.io_policy == "direct":
+            nbytes = self.read_direct(file_path, hashes)
+        else:
+            nbytes = None
+        if nbytes is None:
+            with open(file_path, 'rb', buffering = 0) as f:
+                fd = f.fileno()
+                st = os.fstat(fd)
+                advise = FADVISE and self.io_policy in ("fadvise", "direct")
+                if advise:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_NOREUSE)
+                try:
+                    if self.read_mode == "mmap" and st.st_size >= MMAP_THRESHOLD:
+                        nbytes = self.read_mapped(f, hashes, advise)
+                    else:
+                        size = self.buffer_size(st.st_size, getattr(st, 'st_blksize', 0))
+                        if len(self.read_buffer) < size:
+                            self.read_buffer = bytearray(size)
+                        nbytes = self.read_into(f, memoryview(self.read_buffer)[:size], hashes, advise)
+                finally:
+                    if advise:
+                        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        self.last_read = (nbytes, time.perf_counter() - start)
+        return nbytes
+
+    def read_into(self, f, view: memoryview, hashes: list, advise: bool = False) -> int:
+        nbytes = 0
+        dropped = 0
+        try:
+            while True:
+                n = f.readinto(view)
+                if not n:
+                    break
+                if self.limiter is not None:
+                    self.limiter.consume(n)
+                chunk = view[:n]
+                for hash in hashes:
+                    hash.update(chunk)
+                chunk.release()
+                nbytes += n
+                if advise and nbytes - dropped >= DONTNEED_INTERVAL:
+                    os.posix_fadvise(f.fileno(), dropped, nbytes - dropped, os.POSIX_FADV_DONTNEED)
+                    dropped = nbytes
+        finally:
+            view.release()
+        return nbytes
+
+    def read_mapped(self, f, hashes: list, advise: bool = False) -> int:
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(mapped), MMAP_CHUNK):
+                    chunk = view[offset:offset + MMAP_CHUNK]
+                    if self.limiter is not None:
+                        self.limiter.consume(len(chunk))
+                    for hash in hashes:
+                        hash.update(chunk)
+                    chunk.release()
+                    if advise:
+                        os.posix_fadvise(f.fileno(), offset, MMAP_CHUNK, os.POSIX_FADV_DONTNEED)
+            finally:
+                view.release()
+            return len(mapped)
+
+    def read_direct(self, file_path: str, hashes: list) -> Optional[int]:
+        """
+        Reads with O_DIRECT into a page aligned buffer. Returns None where direct reads aren't supported,
+        switching this generator to 'fadvise'.
+        """
+        if not DIRECT_IO:
+            logger.warning('Direct reads are not supported on this platform, using fadvise instead')
+            self.io_policy = "fadvise"
+            return None
+        try:
+            fd = os.open(file_path, os.O_RDONLY | os.O_DIRECT)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            logger.warning(f'Direct reads are not supported for {file_path}, using fadvise instead')
+            self.io_policy = "fadvise"
+            return None
+        with open(fd, 'rb', buffering = 0) as f:
+            st = os.fstat(fd)
+            # O_DIRECT needs reads in whole, aligned blocks; anonymous maps are page aligned.
+            size = self.buffer_size(st.st_size, getattr(st, 'st_blksize', 0))
+            size = -(-size // DIRECT_ALIGNMENT) * DIRECT_ALIGNMENT
+            if self.direct_buffer is None or len(self.direct_buffer) < size:
+                if self.direct_buffer is not None:
+                    self.direct_buffer.close()
+                self.direct_buffer = mmap.mmap(-1, size)
+            return self.read_into(f, memoryview(self.direct_buffer)[:size], hashes)
 
     def hash_generator(self, file_path: str):
         file_path = win_256_check(file_path)
-        if "SHA-1" in self.algorithm:
-            hash = hashlib.sha1()
-        elif "MD5" in self.algorithm:
-            hash = hashlib.md5()
-        elif "SHA-256" in self.algorithm:
-            hash = hashlib.sha256()
-        elif "SHA-512" in self.algorithm:
-            hash = hashlib.sha512()
-        else:
-            hash = hashlib.sha1()
+        hash = new_hash(self._algorithms()[0])
         logger.info(f'Generating Fixity using {self.algorithm} for: {file_path}')
         try:
-            with open(file_path, 'rb', buffering = 0) as f:
-                while True:
-                    buff = f.read(self.buffer)
-                    if not buff:
-                        break
-                    hash.update(buff)
-                f.close()
+            self.read_hashes(file_path, [hash])
             logger.debug(f'Generated Hash: {hash.hexdigest().upper()}')
             return hash.hexdigest().upper()
         except FileNotFoundError as e:
@@ -47,23 +275,39 @@ class HashGenerator():
         except Exception as e:
             logger.exception(f'Error Generating Hash: {e}')
             raise
-        
+
+    def multi_hash_generator(self, file_path: str) -> dict:
+        """
+        Reads a file once, feeding every algorithm from the same buffer.
+
+        Returns a dictionary of {algorithm: HASH} in the order the algorithms were given.
+        """
+        file_path = win_256_check(file_path)
+        algorithms = self._algorithms()
+        hashes = {algorithm: new_hash(algorithm) for algorithm in algorithms}
+        logger.info(f'Generating Fixity using {algorithms} for: {file_path}')
+        try:
+            self.read_hashes(file_path, list(hashes.values()))
+            digests = {algorithm: hash.hexdigest().upper() for algorithm, hash in hashes.items()}
+            logger.debug(f'Generated Hashes: {digests}')
+            return digests
+        except FileNotFoundError as e:
+            logger.exception(f'File Not Found generating Hash: {e}')
+            raise
+        except IOError as e:
+            logger.exception(f'I/O Error generating Hash: {e}')
+            raise
+        except Exception as e:
+            logger.exception(f'Error Generating Hash: {e}')
+            raise
+
     def hash_generator_pax_zip(self, filename: str, z):
-        if self.algorithm in ("SHA1","SHA-1"):
-            hash = hashlib.sha1()
-        elif self.algorithm == "MD5":
-            hash = hashlib.md5()
-        elif self.algorithm in ("SHA256","SHA-256"):
-            hash = hashlib.sha256()
-        elif self.algorithm in ("SHA512","SHA-512"):
-            hash = hashlib.sha512()
-        else:
-            hash = hashlib.sha1()
+        hash = new_hash(self.algorithm)
         logger.info(f'Generating Fixity using {self.algorithm} for: {filename}')
         try:
-            with z.open(filename, 'r') as data:            
+            with z.open(filename, 'r') as data:
                 while True:
-                    buff = data.read(self.buffer)
+                    buff = data.read(self.buffer or MAX_BUFFER)
                     if not buff:
                         break
                     hash.update(buff)
@@ -77,4 +321,277 @@ class HashGenerator():
         except Exception as e:
             logger.exception(f'Error Generating Hash: {e}')
             raise
-        return str(hash.hexdigest().upper())
\ No newline at end of file
+        return str(hash.hexdigest().upper())
+
+    def read_zip_member(self, z: zipfile.ZipFile, info: zipfile.ZipInfo, hashes: list, raw = None) -> int:
+        """
+        Reads a zip member once, updating every hash object in hashes. Returns the number of bytes read.
+
+        Stored (uncompressed) members are read straight from their data offset in raw, an unbuffered handle on the
+        archive, checking the CRC as zipfile would; other members are decompressed through z.
+
+        Stored members follow the read_mode and io_policy as files do, except that 'direct' reads them with 'fadvise',
+        as a member's data isn't aligned for O_DIRECT.
+        """
+        start = time.perf_counter()
+        if raw is not None and info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+            offset = self.member_offset(raw, info)
+            advise = FADVISE and self.io_policy in ("fadvise", "direct")
+            try:
+                if self.read_mode == "mmap" and info.file_size >= MMAP_THRESHOLD:
+                    nbytes = self.read_stored_mapped(raw, info, offset, hashes, advise)
+                else:
+                    size = self.buffer_size(info.file_size)
+                    if len(self.read_buffer) < size:
+                        self.read_buffer = bytearray(size)
+                    nbytes = self.read_stored(raw, info, offset, memoryview(self.read_buffer)[:size], hashes, advise)
+            finally:
+                if advise:
+                    os.posix_fadvise(raw.fileno(), offset, info.file_size, os.POSIX_FADV_DONTNEED)
+        else:
+            nbytes = 0
+            with z.open(info, 'r') as data:
+                while True:
+                    buff = data.read(self.buffer or MAX_BUFFER)
+                    if not buff:
+                        break
+                    if self.limiter is not None:
+                        self.limiter.consume(len(buff))
+                    for hash in hashes:
+                        hash.update(buff)
+                    nbytes += len(buff)
+        self.last_read = (nbytes, time.perf_counter() - start)
+        return nbytes
+
+    def member_offset(self, raw, info: zipfile.ZipInfo) -> int:
+        """The offset of a member's data in the archive, after its local file header."""
+        raw.seek(info.header_offset)
+        header = raw.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"Bad magic number for file header: {info.filename}")
+        header = struct.unpack(zipfile.structFileHeader, header)
+        return info.header_offset + zipfile.sizeFileHeader + header[ZIP_NAME_LENGTH] + header[ZIP_EXTRA_LENGTH]
+
+    def read_stored(self, raw, info: zipfile.ZipInfo, offset: int, view: memoryview, hashes: list, advise: bool = False) -> int:
+        raw.seek(offset)
+        remaining = info.file_size
+        crc = 0
+        dropped = 0
+        try:
+            while remaining:
+                n = raw.readinto(view[:remaining] if remaining < len(view) else view)
+                if not n:
+                    raise EOFError(f"Truncated zip member: {info.filename}")
+                if self.limiter is not None:
+                    self.limiter.consume(n)
+                chunk = view[:n]
+                crc = zlib.crc32(chunk, crc)
+                for hash in hashes:
+                    hash.update(chunk)
+                chunk.release()
+                remaining -= n
+                nbytes = info.file_size - remaining
+                if advise and nbytes - dropped >= DONTNEED_INTERVAL:
+                    os.posix_fadvise(raw.fileno(), offset + dropped, nbytes - dropped, os.POSIX_FADV_DONTNEED)
+                    dropped = nbytes
+        finally:
+            view.release()
+        if crc != info.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+        return info.file_size
+
+    def read_stored_mapped(self, raw, info: zipfile.ZipInfo, offset: int, hashes: list, advise: bool = False) -> int:
+        if offset + info.file_size > os.fstat(raw.fileno()).st_size:
+            raise EOFError(f"Truncated zip member: {info.filename}")
+        crc = 0
+        with mmap.mmap(raw.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            try:
+                for start in range(offset, offset + info.file_size, MMAP_CHUNK):
+                    chunk = view[start:min(start + MMAP_CHUNK, offset + info.file_size)]
+                    if self.limiter is not None:
+                        self.limiter.consume(len(chunk))
+                    crc = zlib.crc32(chunk, crc)
+                    for hash in hashes:
+                        hash.update(chunk)
+                    chunk.release()
+                    if advise:
+                        os.posix_fadvise(raw.fileno(), start, MMAP_CHUNK, os.POSIX_FADV_DONTNEED)
+            finally:
+                view.release()
+        if crc != info.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+        return info.file_size
+
+    def multi_hash_generator_pax_zip(self, filename: Union[str, zipfile.ZipInfo], z: zipfile.ZipFile, raw = None) -> dict:
+        """
+        Reads a zip member once, feeding every algorithm from the same buffer. See read_zip_member for raw.
+
+        Returns a dictionary of {algorithm: HASH} in the order the algorithms were given.
+        """
+        info = filename if isinstance(filename, zipfile.ZipInfo) else z.getinfo(filename)
+        algorithms = self._algorithms()
+        hashes = {algorithm: new_hash(algorithm) for algorithm in algorithms}
+        logger.info(f'Generating Fixity using {algorithms} for: {info.filename}')
+        try:
+            self.read_zip_member(z, info, list(hashes.values()), raw)
+        except FileNotFoundError as e:
+            logger.exception(f'File Not Found generating Hash: {e}')
+            raise
+        except IOError as e:
+            logger.exception(f'I/O Error generating Hash: {e}')
+            raise
+        except Exception as e:
+            logger.exception(f'Error Generating Hash: {e}')
+            raise
+        return {algorithm: str(hash.hexdigest().upper()) for algorithm, hash in hashes.items()}
+
+_local = threading.local()
+
+def hash_file_measured(file_path: str, algorithm: list, buffer: Optional[int] = None, read_mode: str = "readinto",
+                       io_policy: str = "default", rate_limit: Optional[float] = None) -> tuple:
+    """
+    Module level entry point so files can be hashed in worker processes.
+
+    Returns ({algorithm: HASH}, bytes read, seconds reading). Each thread keeps its generator, so its read buffer is reused from file to file.
+    """
+    key = (tuple(algorithm), buffer, read_mode, io_policy, rate_limit)
+    generator = getattr(_local, 'generators', {}).get(key)
+    if generator is None:
+        generator = HashGenerator(algorithm = algorithm, buffer = buffer, read_mode = read_mode, io_policy = io_policy, rate_limit = rate_limit)
+        _local.generators = {key: generator}
+    hashes = generator.multi_hash_generator(file_path)
+    nbytes, seconds = generator.last_read
+    return hashes, nbytes, seconds
+
+def hash_file(file_path: str, algorithm: list, buffer: Optional[int] = None, read_mode: str = "readinto",
+              io_policy: str = "default", rate_limit: Optional[float] = None) -> dict:
+    return hash_file_measured(file_path, algorithm, buffer, read_mode, io_policy, rate_limit)[0]
+
+def hash_pax_zip(zip_path: str, algorithm: list, buffer: Optional[int] = None, jobs: int = 1,
+                 rate_limit: Optional[float] = None, stats: Optional[HashStats] = None,
+                 read_mode: str = "readinto", io_policy: str = "default") -> list:
+    """
+    Hashes every member of a zip, computing all algorithms in one pass over each member.
+
+    The central directory is read once; with jobs above 1, members are shared out to threads which each hash
+    through their own handle on the archive, so reads and decompression don't contend for one file position.
+    Stored members are read with the read_mode and io_policy; see HashGenerator.read_zip_member.
+
+    Returns a list of (filename, {algorithm: HASH}) in archive order.
+    """
+    zip_path = win_256_check(zip_path)
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        members = z.infolist()
+    results = [None] * len(members)
+    queue = iter(enumerate(members))
+    lock = threading.Lock()
+
+    def worker():
+        generator = HashGenerator(algorithm = algorithm, buffer = buffer, read_mode = read_mode, io_policy = io_policy, rate_limit = rate_limit)
+        with open(zip_path, 'rb', buffering = 0) as raw, zipfile.ZipFile(raw, 'r') as z:
+            if FADVISE and io_policy in ("fadvise", "direct"):
+                os.posix_fadvise(raw.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(raw.fileno(), 0, 0, os.POSIX_FADV_NOREUSE)
+            while True:
+                with lock:
+                    item = next(queue, None)
+                if item is None:
+                    break
+                i, info = item
+                results[i] = (info.filename, generator.multi_hash_generator_pax_zip(info, z, raw))
+                if stats is not None:
+                    stats.add(1, *generator.last_read)
+
+    workers = min(jobs or 1, len(members))
+    if workers <= 1:
+        worker()
+    else:
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            for future in [executor.submit(worker) for _ in range(workers)]:
+                future.result()
+    return results
+
+class HashPool():
+    """
+    Hashes files ahead of the walk in a bounded pool of threads or processes.
+
+    Paths are queued with prefetch() and collected with result(); results are always handed back in
+    the order they are asked for, so output does not depend on the number of workers.
+
+    :param algorithm: list of algorithms to generate for each file
+    :param jobs: number of workers
+    :param mode: use a 'thread' or 'process' pool
+    :param buffer: the number of bytes read per chunk; None sizes it from each file
+    :param read_mode: how to read files {readinto, mmap}
+    :param io_policy: how reads use the page cache {default, fadvise, direct}
+    :param rate_limit: the maximum number of bytes read per second across the pool
+    :param stats: a HashStats to add each hashed file to
+    """
+    def __init__(self, algorithm: list, jobs: int = 1, mode: str = "thread", buffer: Optional[int] = None, read_mode: str = "readinto",
+                 io_policy: str = "default", rate_limit: Optional[float] = None, stats: Optional[HashStats] = None):
+        self.algorithm = algorithm
+        self.buffer = buffer
+        self.read_mode = read_mode
+        self.io_policy = io_policy
+        self.rate_limit = rate_limit
+        self.stats = stats
+        self.jobs = max(1, int(jobs))
+        # Keep a small number of files in flight per worker, so memory is bounded however long the run of files is.
+        self.window = self.jobs * 2
+        if mode == "process":
+            self.executor = ProcessPoolExecutor(max_workers = self.jobs)
+            # Worker processes can't share a limiter, so each takes an even share of the rate.
+            self.worker_rate_limit = rate_limit / self.jobs if rate_limit else None
+        else:
+            self.executor = ThreadPoolExecutor(max_workers = self.jobs, thread_name_prefix = "fixity")
+            self.worker_rate_limit = rate_limit
+        self.queue = []
+        self.futures = OrderedDict()
+        logger.debug(f'Hash pool started with {self.jobs} {mode} workers')
+
+    def __contains__(self, file_path: str) -> bool:
+        return file_path in self.futures
+
+    def _fill(self) -> None:
+        while self.queue and len(self.futures) < self.window:
+            file_path = self.queue.pop()
+            if file_path not in self.futures:
+                self.futures[file_path] = self.executor.submit(hash_file_measured, file_path, self.algorithm, self.buffer, self.read_mode,
+                                                               self.io_policy, self.worker_rate_limit)
+
+    def prefetch(self, file_paths: list) -> None:
+        """Replaces any outstanding work with a new run of files, hashed in the order given."""
+        for future in self.futures.values():
+            future.cancel()
+        self.futures.clear()
+        self.queue = list(reversed(file_paths))
+        self._fill()
+
+    def _record(self, measured: tuple) -> dict:
+        hashes, nbytes, seconds = measured
+        if self.stats is not None:
+            self.stats.add(1, nbytes, seconds)
+        return hashes
+
+    def result(self, file_path: str) -> dict:
+        """Returns the hashes for a file; files not queued ahead are hashed in the calling thread."""
+        if file_path not in self.futures:
+            return self._record(hash_file_measured(file_path, self.algorithm, self.buffer, self.read_mode, self.io_policy, self.rate_limit))
+        # Anything queued before this file was skipped by the walk, so drop it.
+        while True:
+            queued_path, future = self.futures.popitem(last = False)
+            if queued_path == file_path:
+                break
+            future.cancel()
+        self._fill()
+        return self._record(future.result())
+
+    def shutdown(self) -> None:
+        for future in self.futures.values():
+            future.cancel()
+        self.futures.clear()
+        self.queue = []
+        self.executor.shutdown(wait = True)
@@ -0,0 +1,188 @@
+"""
+Run Journal class for resuming interrupted runs.
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import os, json, time, logging
+from typing import Optional
+from opex_manifest_generator.common import win_256_check
+
+logger = logging.getLogger(__name__)
+
+class RunJournal():
+    """
+    An append-only journal, one JSON record per line, of the entries a run has completed.
+
+    Each file and folder is recorded once it is complete, with the Fixity and Removals lines it added to the
+    exports, so a resumed run can replay finished entries in walk order rather than scanning or hashing them again.
+    The journal is kept if the run fails and removed once it completes.
+
+    :param journal_path: the path of the journal
+    :param settings: the options affecting the output, which a resumed run must match
+    :param resume: set whether to load the journal of an interrupted run
+    :param sync_interval: the minimum number of seconds between fsyncs
+    """
+    def __init__(self, journal_path: str, settings: dict, resume: bool = False, sync_interval: float = 10.0):
+        self.journal_path = journal_path
+        self.settings = settings
+        self.sync_interval = sync_interval
+        self.last_sync = time.monotonic()
+        self.started = None
+        self.resuming = False
+        self.records = []
+        self.completed = {}
+        self.opened = set()
+        self.created = set()
+        self.valid_length = 0
+        self.writer = None
+        if resume:
+            self.load()
+        elif os.path.exists(journal_path):
+            logger.warning(f'A journal from an interrupted run exists at: {journal_path}; starting a new run. Use --resume to continue it instead.')
+
+    def load(self) -> None:
+        if not os.path.exists(self.journal_path):
+            logger.info(f'No journal found at: {self.journal_path}; starting a new run')
+            return
+        try:
+            with open(self.journal_path, 'rb') as reader:
+                for line in reader:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The last record may be cut short if the run was killed while writing it.
+                        logger.warning(f'Ignoring incomplete journal record at offset {self.valid_length}')
+                        break
+                    self.valid_length += len(line)
+                    if record.get('kind') == 'run':
+                        self.check_settings(record.get('settings', {}))
+                        self.started = record.get('started')
+                        self.resuming = True
+                    else:
+                        self.add_record(record)
+        except OSError as e:
+            logger.exception(f'Failed to read journal at {self.journal_path}: {e}')
+            raise
+        logger.info(f'Resuming from journal: {len(self.completed)} entries completed by the interrupted run')
+
+    def check_settings(self, settings: dict) -> None:
+        changed = sorted(key for key in set(settings) | set(self.settings) if settings.get(key) != self.settings.get(key))
+        if changed:
+            logger.error(f'Cannot resume; options differ from the interrupted run: {changed}')
+            raise ValueError(f'Cannot resume; options differ from the interrupted run: {changed}')
+
+    def add_record(self, record: dict) -> None:
+        self.records.append(record)
+        if record.get('kind') == 'open':
+            self.opened.add(record.get('path'))
+        else:
+            self.completed[record.get('path')] = len(self.records) - 1
+            self.created.update(record.get('created', []))
+
+    def begin(self) -> None:
+        """Opens the journal for writing, continuing the interrupted run's journal when resuming."""
+        try:
+            if self.resuming:
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(self.valid_length)
+                self.writer = open(self.journal_path, 'a', encoding = 'utf-8')
+            else:
+                self.writer = open(self.journal_path, 'w', encoding = 'utf-8')
+                # Taken from the file system rather than the clock, as file times can lag time.time_ns().
+                self.started = os.fstat(self.writer.fileno()).st_mtime_ns
+                self.write({'kind': 'run', 'started': self.started, 'settings': self.settings})
+        except OSError as e:
+            logger.exception(f'Failed to open journal at {self.journal_path}: {e}')
+            raise
+
+    def write(self, record: dict) -> None:
+        self.writer.write(json.dumps(record) + "\n")
+
+    def record(self, kind: str, path: str, fixity: list, removals: list, **fields) -> None:
+        """
+        Records an entry: 'file' or 'folder' once complete, or 'open' for the lines a folder adds before its contents.
+        """
+        if self.writer is None:
+            return
+        if kind == 'open' and path in self.opened:
+            # Reopened on resume: the lines recorded the first time are the ones replayed with the folder.
+            return
+        self.write(dict(fields, kind = kind, path = path, fixity = fixity, removals = removals))
+        # Files removed by the run can't be regenerated, so their records are flushed straight away.
+        if kind == 'folder' or fields.get('removed') or removals:
+            self.flush()
+
+    def flush(self, sync: bool = False) -> None:
+        if self.writer is None:
+            return
+        self.writer.flush()
+        now = time.monotonic()
+        if sync or now - self.last_sync >= self.sync_interval:
+            os.fsync(self.writer.fileno())
+            self.last_sync = now
+
+    def entry(self, path: str) -> Optional[dict]:
+        """Returns the record of a completed file or folder, or None."""
+        position = self.completed.get(path)
+        if position is None:
+            return None
+        return self.records[position]
+
+    def was_created(self, path: str) -> bool:
+        """Returns whether a completed File recorded creating the path (such as its Zip)."""
+        return path in self.created or win_256_check(path) in self.created
+
+    def covers(self, path: str) -> bool:
+        """Returns whether the path, or a folder above it, was completed."""
+        while True:
+            if path in self.completed:
+                return True
+            parent = os.path.dirname(path)
+            if parent == path:
+                return False
+            path = parent
+
+    def replay(self, path: str) -> tuple:
+        """
+        Returns the (fixity, removals) lines of a completed entry and everything below it, in the order they were written.
+
+        A folder's records are the run ending at its own, as folders are recorded once everything below them is complete.
+        """
+        end = self.completed[path]
+        start = end
+        prefix = os.path.join(path, "")
+        while start > 0:
+            previous = self.records[start - 1]
+            if previous is None or not (previous.get('path') == path or previous.get('path', '').startswith(prefix)):
+                break
+            start -= 1
+        fixity, removals = [], []
+        for position in range(start, end + 1):
+            record = self.records[position]
+            fixity.extend(record.get('fixity', []))
+            removals.extend(record.get('removals', []))
+            # Each record is replayed at most once, so release it.
+            self.records[position] = None
+        return fixity, removals
+
+    def close(self, remove: bool = False) -> None:
+        if self.writer is not None:
+            try:
+                self.flush(sync = True)
+            finally:
+                self.writer.close()
+                self.writer = None
+        if remove and os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+            logger.debug(f'Run complete, removed journal: {self.journal_path}')
+
+def written_since(path: str, started: Optional[int]) -> bool:
+    """Returns whether a file was written since started (in ns), so by an interrupted run rather than before it."""
+    if started is None:
+        return False
+    try:
+        return os.stat(win_256_check(path)).st_mtime_ns >= started
+    except OSError:
+        return False
@@ -0,0 +1,269 @@
+"""
+Streaming loaders for --input spreadsheets, building a RecordTable row by row without a Dataframe.
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import os, csv, json, logging
+from datetime import datetime, timedelta
+from lxml import etree as ET
+from typing import Callable, Iterator, Optional
+from opex_manifest_generator.records import RecordTable
+
+logger = logging.getLogger(__name__)
+
+# Cells pandas reads as missing or boolean by default (and NaT, which check_nan clears from a Dataframe's rows);
+# other text is kept as written, rather than converted to numbers.
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+             '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'NaT', 'None', 'n/a', 'nan', 'null'}
+TRUE_VALUES = {'True', 'TRUE', 'true'}
+FALSE_VALUES = {'False', 'FALSE', 'false'}
+TEXT_VALUES = dict({value: None for value in NA_VALUES}, **dict.fromkeys(TRUE_VALUES, True), **dict.fromkeys(FALSE_VALUES, False))
+JSON_CHUNK = 1024 * 1024
+# read_json reads numbers up to a year from the epoch as numbers rather than dates, and tries each unit from seconds to nanoseconds.
+JSON_MIN_STAMP = 31536000
+JSON_EPOCH_UNITS = (1, 1e3, 1e6, 1e9)
+JSON_MAX_SECONDS = 9.2e9
+EPOCH = datetime(1970, 1, 1)
+
+def text_value(value: Optional[str]):
+    """Reads a cell of text as pandas does for missing and boolean values."""
+    return TEXT_VALUES.get(value, value)
+
+def used_positions(columns: list, usecols: Optional[Callable] = None) -> list:
+    """The positions of the columns to load; all of them unless usecols(column) is given, as read_csv's usecols."""
+    return [position for position, column in enumerate(columns) if usecols is None or usecols(column)]
+
+class RowBuilder():
+    """
+    Collects rows whose columns are only known as they're read (XML elements and JSON records),
+    in the order each column is first seen; rows are padded to the final columns once read.
+
+    :param usecols: returns whether to load a column, as read_csv's usecols; None loads every column
+    :param categorical_columns: passed to the RecordTable
+    """
+    def __init__(self, usecols: Optional[Callable] = None, categorical_columns: Optional[list] = None):
+        self.columns = {}
+        self.skipped = set()
+        self.rows = []
+        self.usecols = usecols
+        self.categorical_columns = categorical_columns
+
+    def add(self, values: dict) -> None:
+        row = [None] * len(self.columns)
+        for column, value in values.items():
+            position = self.columns.get(column)
+            if position is None:
+                if column in self.skipped:
+                    continue
+                if self.usecols is not None and not self.usecols(column):
+                    self.skipped.add(column)
+                    continue
+                position = self.columns[column] = len(self.columns)
+                row.append(None)
+            row[position] = value
+        self.rows.append(row)
+
+    def padded_rows(self) -> Iterator[list]:
+        width = len(self.columns)
+        for position, row in enumerate(self.rows):
+            # Released as the table takes each row, so both aren't held at once.
+            self.rows[position] = None
+            if len(row) < width:
+                row.extend([None] * (width - len(row)))
+            yield row
+        self.rows = []
+
+    def table(self, index_field: str, normalised: bool = False) -> RecordTable:
+        return RecordTable(list(self.columns), self.padded_rows(), index_field, normalised = normalised,
+                           categorical_columns = self.categorical_columns)
+
+def load_csv(path: str, index_field: str, usecols: Optional[Callable] = None, categorical_columns: Optional[list] = None) -> RecordTable:
+    with open(path, newline = '', encoding = 'utf-8-sig') as f:
+        reader = csv.reader(f)
+        columns = next(reader, [])
+        width = len(columns)
+        positions = used_positions(columns, usecols)
+
+        def rows() -> Iterator[list]:
+            get = TEXT_VALUES.get
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) < width:
+                    row.extend([''] * (width - len(row)))
+                yield [get(row[position], row[position]) for position in positions]
+
+        return RecordTable([columns[position] for position in positions], rows(), index_field, normalised = True,
+                           categorical_columns = categorical_columns)
+
+def load_xlsx(path: str, index_field: str, usecols: Optional[Callable] = None, categorical_columns: Optional[list] = None) -> RecordTable:
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only = True, data_only = True)
+    try:
+        # The first sheet, as read_excel reads by default.
+        rows = workbook.worksheets[0].iter_rows(values_only = True)
+        header = list(next(rows, ()))
+        while header and header[-1] is None:
+            header.pop()
+        width = len(header)
+        columns = [column if column is not None else f"Unnamed: {position}" for position, column in enumerate(header)]
+        positions = used_positions(columns, usecols)
+        columns = [columns[position] for position in positions]
+        dates = set()
+        not_dates = set()
+
+        def values() -> Iterator[tuple]:
+            for row in rows:
+                if len(row) < width:
+                    row = row + (None,) * (width - len(row))
+                row = tuple(row[position] for position in positions)
+                if all(value is None for value in row):
+                    continue
+                for position, value in enumerate(row):
+                    if isinstance(value, datetime):
+                        dates.add(position)
+                    elif value is not None:
+                        not_dates.add(position)
+                yield row
+
+        table = RecordTable(columns, values(), index_field, normalised = True, categorical_columns = categorical_columns)
+        # As read_excel, a column holding only dates (and blanks) is a datetime column.
+        table.datetime_columns = {columns[position] for position in dates - not_dates}
+        return table
+    finally:
+        workbook.close()
+
+def load_xml(path: str, index_field: str, usecols: Optional[Callable] = None, categorical_columns: Optional[list] = None) -> RecordTable:
+    """Each child of the root element is a row, with a column for each of its attributes and child elements, as read_xml."""
+    builder = RowBuilder(usecols, categorical_columns)
+    for _, elem in ET.iterparse(path, events = ('end',), remove_comments = True, remove_pis = True):
+        parent = elem.getparent()
+        if parent is None or parent.getparent() is not None:
+            continue
+        values = {ET.QName(key).localname: text_value(value) for key, value in elem.attrib.items()}
+        for child in elem:
+            values[ET.QName(child).localname] = text_value(child.text)
+        builder.add(values)
+        # Drop the rows read so far, so the tree doesn't grow with the file.
+        elem.clear()
+        while elem.getprevious() is not None:
+            del parent[0]
+    return builder.table(index_field, normalised = True)
+
+def iter_json_records(f, chunk_size: int = JSON_CHUNK) -> Optional[Iterator[dict]]:
+    """
+    Decodes a JSON list of records one record at a time, reading chunk_size characters at once.
+    Returns None if the document isn't a list, as written by read_json's other orients.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    while not buffer:
+        chunk = f.read(chunk_size)
+        buffer = chunk.lstrip()
+        if not chunk:
+            break
+    if not buffer.startswith('['):
+        return None
+
+    def records(buffer: str) -> Iterator[dict]:
+        pos = 1
+        eof = False
+        expect_record = True
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos >= len(buffer):
+                if eof:
+                    raise ValueError('JSON input ends before its list is closed')
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            if buffer[pos] == ']':
+                return
+            if not expect_record:
+                if buffer[pos] != ',':
+                    raise ValueError(f'Expected , between JSON records, found: {buffer[pos]!r}')
+                pos += 1
+                expect_record = True
+                continue
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The record runs past the buffer; a record is an object, so it can't be decoded early.
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            if not isinstance(record, dict):
+                raise ValueError(f'JSON input must be a list of records, found: {type(record).__name__}')
+            yield record
+            pos = end
+            expect_record = False
+
+    return records(buffer)
+
+def load_json(path: str, index_field: str, usecols: Optional[Callable] = None, categorical_columns: Optional[list] = None) -> Optional[RecordTable]:
+    with open(path, encoding = 'utf-8-sig') as f:
+        records = iter_json_records(f)
+        if records is None:
+            return None
+        builder = RowBuilder(usecols, categorical_columns)
+        for record in records:
+            builder.add(record)
+    datetime_columns = set()
+    for column, position in builder.columns.items():
+        if not json_date_column(column):
+            continue
+        try:
+            dates = [json_date(row[position]) if position < len(row) else None for row in builder.rows]
+        except ValueError:
+            continue
+        for row, date in zip(builder.rows, dates):
+            if position < len(row):
+                row[position] = date
+        datetime_columns.add(column)
+    table = builder.table(index_field)
+    table.datetime_columns = datetime_columns
+    return table
+
+def json_date_column(column) -> bool:
+    """Whether read_json converts a column to dates by default, by its name."""
+    column = str(column).lower()
+    return column.endswith(('_at', '_time')) or column.startswith('timestamp') or column in {'modified', 'date', 'datetime'}
+
+def json_date(value) -> Optional[datetime]:
+    """Reads a date as read_json does; raises ValueError if it isn't one, so the column is kept as it was."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if value > JSON_MIN_STAMP:
+            for unit in JSON_EPOCH_UNITS:
+                if value / unit < JSON_MAX_SECONDS:
+                    return EPOCH + timedelta(seconds = value / unit)
+    elif isinstance(value, str):
+        return datetime.fromisoformat(value)
+    raise ValueError(f'Not a date: {value!r}')
+
+STREAMING_LOADERS = {'.csv': load_csv,
+                     '.xlsx': load_xlsx,
+                     '.xlsm': load_xlsx,
+                     '.xml': load_xml,
+                     '.json': load_json}
+
+def load_records(path: str, index_field: str, usecols: Optional[Callable] = None, categorical_columns: Optional[list] = None) -> Optional[RecordTable]:
+    """
+    Streams an input spreadsheet into a RecordTable. Returns None if it can't be streamed (.xls and .ods files,
+    or JSON which isn't a list of records), so the Dataframe loaders are used instead.
+
+    :param usecols: returns whether to load a column, as read_csv's usecols; None loads every column
+    :param categorical_columns: columns with a few values repeated across rows, held once each
+    """
+    loader = STREAMING_LOADERS.get(os.path.splitext(path)[1].lower())
+    if loader is None:
+        return None
+    return loader(path, index_field, usecols, categorical_columns)
@@ -0,0 +1,124 @@
+"""
+Run Metrics class for the --metrics export.
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import os, json, threading, logging
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+METRICS_FORMATS = {'json': 'json', 'prometheus': 'prom'}
+
+# (name, help, the path of the value in the metrics document, the label of each value when the path holds a dict)
+PROMETHEUS_METRICS = [
+    ('opex_run_complete', 'Whether the run completed (1), or the metrics were written during or after a failed run (0).', ('complete',), None),
+    ('opex_run_wall_seconds', 'Wall time of the run so far.', ('wall_seconds',), None),
+    ('opex_run_cpu_seconds', 'CPU time of the run so far, including subtree workers and hashing processes once they have exited.', ('cpu_seconds',), None),
+    ('opex_run_entries', 'Entries processed, by kind.', ('entries', 'counts'), 'kind'),
+    ('opex_run_walked_bytes', 'Bytes of the Files processed.', ('entries', 'bytes'), None),
+    ('opex_run_hashed_files', 'Files (and pax.zip members) hashed.', ('hashing', 'files'), None),
+    ('opex_run_hashed_bytes', 'Bytes hashed, by algorithm.', ('hashing', 'bytes_by_algorithm'), 'algorithm'),
+    ('opex_run_hashing_seconds', 'Time spent reading and hashing, summed across hashing workers.', ('hashing', 'seconds'), None),
+    ('opex_run_opex_written', 'Opexes written.', ('opexes', 'written'), None),
+    ('opex_run_opex_bytes', 'Bytes of Opexes written.', ('opexes', 'bytes'), None),
+    ('opex_run_zip_written', 'Zips written.', ('zips', 'written'), None),
+    ('opex_run_zip_bytes', 'Bytes of Zips written.', ('zips', 'bytes'), None),
+    ('opex_run_lookups', 'Spreadsheet lookups.', ('lookups',), None),
+    ('opex_run_fixity_cache_hits', 'Fixity cache hits.', ('fixity_cache', 'hits'), None),
+    ('opex_run_fixity_cache_misses', 'Fixity cache misses.', ('fixity_cache', 'misses'), None),
+    ('opex_run_fixity_cache_hit_ratio', 'Fixity cache hits as a fraction of lookups.', ('fixity_cache', 'hit_ratio'), None),
+    ('opex_run_incremental_entries', 'Entries regenerated, skipped as unchanged and orphaned Opexes removed in incremental mode.', ('incremental', 'counts'), 'outcome'),
+    ('opex_run_incremental_skip_ratio', 'Entries skipped as unchanged as a fraction of those compared, in incremental mode.', ('incremental', 'skip_ratio'), None),
+    ('opex_run_stage_entries', 'Entries timed in each stage.', ('stages', 'count'), 'stage'),
+    ('opex_run_stage_wall_seconds', 'Wall time of each stage; stages are nested, so their totals overlap.', ('stages', 'wall_seconds'), 'stage'),
+    ('opex_run_stage_cpu_seconds', 'CPU time of each stage, of the threads running it.', ('stages', 'cpu_seconds'), 'stage'),
+    ('opex_run_last_update_timestamp_seconds', 'When the metrics were written, as a Unix timestamp.', ('timestamp',), None),
+]
+
+def prometheus_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_text(metrics: dict) -> str:
+    """Formats the metrics document in the Prometheus text format, as read by node_exporter's textfile collector."""
+    root = f'root="{prometheus_label(metrics["root"])}"'
+    lines = []
+    for name, help_text, path, label in PROMETHEUS_METRICS:
+        value = metrics
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if label == 'stage':
+            # Stage totals are held by stage, then by measure.
+            value = {stage: totals[path[1]] for stage, totals in metrics['stages'].items()}
+        if value is None or value == {}:
+            continue
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+        if label is None:
+            lines.append(f"{name}{{{root}}} {float(value)!r}")
+        else:
+            for key, item in value.items():
+                lines.append(f'{name}{{{root},{label}="{prometheus_label(key)}"}} {float(item)!r}')
+    return "\n".join(lines) + "\n"
+
+class RunMetrics():
+    """
+    Writes the metrics of a run as a JSON document or a Prometheus textfile, at the end of the run and every
+    interval seconds during it if set, so a scheduler can graph the performance of each run.
+
+    Each write replaces the file in one step, so a collector never reads a partly written file. During the run,
+    the timings of subtree workers are only included once each worker's subtree is complete.
+
+    :param metrics_path: the path of the metrics file
+    :param metrics_format: the format of the metrics file {json, prometheus}
+    :param collect: returns the metrics document, given whether the run is complete
+    :param interval: the number of seconds between writes during the run; None only writes at the end
+    """
+    def __init__(self, metrics_path: str, metrics_format: str, collect: Callable[[bool], dict], interval: Optional[float] = None):
+        self.metrics_path = metrics_path
+        self.metrics_format = metrics_format
+        self.collect = collect
+        self.interval = interval
+        self.stop_event = None
+        self.thread = None
+
+    def write(self, complete: bool = False) -> dict:
+        metrics = self.collect(complete)
+        if self.metrics_format == 'json':
+            content = json.dumps(metrics, indent = 2)
+        else:
+            content = prometheus_text(metrics)
+        tmp_path = f"{self.metrics_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding = 'utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, self.metrics_path)
+        except OSError as e:
+            logger.exception(f'Failed to write Metrics: {e}')
+            raise
+        logger.debug(f'Metrics saved to: {self.metrics_path}')
+        return metrics
+
+    def start(self) -> "RunMetrics":
+        """Starts writing the metrics every interval seconds, if set."""
+        if self.interval:
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target = self.run, name = "opex-metrics", daemon = True)
+            self.thread.start()
+        return self
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                #Logged already; the final write will raise if it still can't be written.
+                pass
+
+    def stop(self) -> None:
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+            self.stop_event = None
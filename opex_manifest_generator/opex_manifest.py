@@ -7,29 +7,47 @@ author: Christopher Prince
 license: Apache License 2.0"
 """
 
+from __future__ import annotations
 from lxml import etree as ET
-import pandas as pd
-import os, configparser, logging, zipfile
-from typing import Optional
-from auto_reference_generator import ReferenceGenerator
-from auto_reference_generator.common import export_list_txt, \
-    export_xl, \
-    export_csv, \
-    export_json, \
-    export_ods, \
-    export_xml, \
-    define_output_file
-from pandas.api.types import is_datetime64_any_dtype
-from opex_manifest_generator.hash import HashGenerator
+import os, sys, time, hashlib, configparser, cProfile, importlib.metadata, logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Iterator, Optional, Union
+from opex_manifest_generator.hash import HashPool, HashStats, READ_MODES, hash_file_measured, hash_pax_zip
+from opex_manifest_generator.fixity_cache import FixityCache
+from opex_manifest_generator.records import RecordTable, EntryRecord
+from opex_manifest_generator.loaders import load_records
+from opex_manifest_generator.export import ListExport, part_file
+from opex_manifest_generator.journal import RunJournal, written_since
+from opex_manifest_generator.snapshot import TreeSnapshot
+from opex_manifest_generator.writer import OpexWriter
+from opex_manifest_generator.profiler import StageProfiler, stage_timer
+from opex_manifest_generator.progress import Progress
+from opex_manifest_generator.metrics import RunMetrics, METRICS_FORMATS
+from opex_manifest_generator.serializer import FileOpex, fixity_lines, add_fixity_elements
 from opex_manifest_generator.common import zip_opex,\
     remove_tree,\
     win_256_check,\
     filter_win_hidden,\
-    check_nan,\
     check_opex,\
-    write_opex
+    check_flag,\
+    define_output_file,\
+    write_opex,\
+    opex_bytes,\
+    manifest_chunks,\
+    OPEX_TMP_SUFFIX,\
+    SQLITE_SIDE_SUFFIXES,\
+    ScanEntry,\
+    sort_folders_first,\
+    element_locator,\
+    locate_element
+from copy import deepcopy
 from datetime import datetime
 
+if TYPE_CHECKING:
+    # pandas and auto_reference_generator (which imports pandas) are slow to import, so they're only imported
+    # where a Dataframe is needed; runs without an input or Auto Reference, and the cli's --version, don't pay for them.
+    import pandas as pd
+
 logger = logging.getLogger(__name__)
 
 class OpexManifestGenerator():
@@ -62,6 +80,34 @@ class OpexManifestGenerator():
     :param keywords_retain_order: set to continue counting reference, if keyword is used, skips numbers if not
     :param keywords_abbreviation: set int for number of characters to abbreviate to for keywords mode
     :param sort_key: set the sort key, can be any valid function for sorted
+    :param jobs: set the number of workers used to generate fixities
+    :param jobs_mode: set whether fixity workers are threads or processes {thread, process}
+    :param hash_buffer: set the number of bytes read at a time when generating fixities; None uses the options file, 0 sizes it to each file
+    :param hash_read_mode: set how files are read when generating fixities {readinto, mmap}; None uses the options file
+    :param hash_io_policy: set how fixity reads use the page cache {default, fadvise, direct}
+    :param hash_rate_limit: set the maximum number of bytes read per second when generating fixities
+    :param processes: set the number of processes to split the tree between
+    :param partition_depth: set the depth below root at which folders are split between processes
+    :param fixity_cache_flag: set whether to reuse fixities of unchanged files from the fixity cache, an SQLite database kept between runs; off by default
+    :param fixity_cache_path: set the path of the fixity cache, defaults to the meta directory; setting it enables the cache
+    :param fixity_cache_max_entries: set the maximum number of entries kept in the fixity cache
+    :param keep_path_list: set whether to keep the list of fixity paths (list_path) in memory; off by default
+    :param journal_flag: set whether to journal completed entries in the meta directory, so an interrupted run can be resumed;
+        only runs generating fixities or removing entries are journaled, as other runs skip entries which already have an Opex
+    :param resume_flag: set whether to resume an interrupted run from its journal
+    :param incremental_flag: set whether to only regenerate Opexes for what changed since the last run, using a snapshot in the meta directory
+    :param pretty_print: set whether to indent generated Opexes
+    :param writer_threads: set the number of threads writing File Opexes (and Zips) in the background; 0 writes them during the walk
+    :param writer_queue: set the number of File Opexes which may wait to be written before the walk waits for the writer threads
+    :param profile_flag: set whether to time each stage of the run, writing a report to the meta directory
+    :param cprofile_flag: set whether to write a cProfile dump of the run to the meta directory
+    :param progress_flag: set whether to log progress lines, with the rate of each stage, as the run goes
+    :param progress_interval: set the number of seconds between progress lines
+    :param prescan_flag: set whether to count the tree alongside the run, so progress lines give the percentage done and an estimate of the time remaining
+    :param metrics_format: set to write the run's metrics to the meta directory, as a Prometheus textfile or JSON document {prometheus, json}
+    :param metrics_interval: set the number of seconds between writes of the metrics during the run; None only writes them at the end
+    :param input_loader: set how the input is read; dataframe reads it into a Dataframe, stream reads .csv, .xlsx, .xml and .json row by row without one,
+        falling back to a Dataframe for other files {dataframe, stream}
     """
     def __init__(self,
                  root: str,
@@ -96,16 +142,46 @@ class OpexManifestGenerator():
                  keywords_retain_order: bool = False,
                  keywords_case_sensitivity: bool = False,
                  keywords_abbreviation_number: int = 3,
-                 sort_key = lambda x: (os.path.isfile(x), str.casefold(x)),
+                 sort_key = sort_folders_first,
                  delimiter = "/",
-                 autoref_options: Optional[str] = None) -> None:
+                 autoref_options: Optional[str] = None,
+                 jobs: int = 1,
+                 jobs_mode: str = "thread",
+                 hash_buffer: Optional[int] = None,
+                 hash_read_mode: Optional[str] = None,
+                 hash_io_policy: str = "default",
+                 hash_rate_limit: Optional[float] = None,
+                 processes: int = 1,
+                 partition_depth: int = 1,
+                 fixity_cache_flag: bool = False,
+                 fixity_cache_path: Optional[str] = None,
+                 fixity_cache_max_entries: int = 1000000,
+                 keep_path_list: bool = False,
+                 journal_flag: bool = True,
+                 resume_flag: bool = False,
+                 incremental_flag: bool = False,
+                 pretty_print: bool = True,
+                 writer_threads: int = 0,
+                 writer_queue: int = 1000,
+                 profile_flag: bool = False,
+                 cprofile_flag: bool = False,
+                 progress_flag: bool = False,
+                 progress_interval: float = 30.0,
+                 prescan_flag: bool = True,
+                 metrics_format: Optional[str] = None,
+                 metrics_interval: Optional[float] = None,
+                 input_loader: str = "dataframe") -> None:
         
         self.root = os.path.abspath(root)
         # Base Parameters
         self.opexns = "http://www.openpreservationexchange.org/opex/v1.2"      
         self.start_time = datetime.now()
+        # Fixity and Removals lists are written as the run goes, see open_exports.
+        self.keep_path_list = keep_path_list
         self.list_path = []
-        self.list_fixity = []
+        self.list_fixity = ListExport(None)
+        self.fixity_export_file = None
+        self.removal_export_file = None
 
         # Parameters for Opex Generation
         self.algorithm = algorithm
@@ -117,15 +193,66 @@ class OpexManifestGenerator():
         self.hidden_flag = hidden_flag
         self.zip_flag = zip_flag
         self.zip_file_removal = zip_file_removal
+        self.jobs = jobs
+        self.jobs_mode = jobs_mode
+        self.hash_io_policy = hash_io_policy
+        self.hash_rate_limit = hash_rate_limit
+        # Metrics use the progress counts and stage timings, without reporting them.
+        self.progress = Progress(progress_interval, processes) if progress_flag or metrics_format else None
+        self.hash_stats = HashStats(progress = self.progress)
+        self.hash_pool = None
+        self.processes = processes
+        self.partition_depth = partition_depth
+        self.subtree_futures = {}
+        # The processes sharing hash_rate_limit: the parent and each worker with a subtree to generate.
+        self.rate_participants = 1
+        # The files the run writes as it walks (exports, the journal, caches), by folder, so they aren't walked as content.
+        self.run_files = {}
+        self.fixity_cache_flag = fixity_cache_flag or fixity_cache_path is not None
+        self.fixity_cache_path = fixity_cache_path
+        self.fixity_cache_max_entries = fixity_cache_max_entries
+        self.fixity_cache = None
+        self.fixity_cache_hits = 0
+        self.fixity_cache_misses = 0
+        self.cached_fixity = {}
+        self.cache_identities = {}
+        self.walk_hooks = []
+        self.journal_flag = journal_flag
+        self.resume_flag = resume_flag
+        self.journal = None
+        self.journal_dir_created = False
+        self.resume_started = None
+        self.incremental_flag = incremental_flag
+        self.snapshot_path = None
+        self.snapshot_stamp = None
+        self.snapshot = None
+        self.incremental_counts = {'regenerated': 0, 'skipped': 0, 'orphans': 0}
+        self.pretty_print = pretty_print
+        self.writer_threads = writer_threads
+        self.writer_queue = writer_queue
+        self.opex_writer = None
+        self.pending_checkpoints = []
+        self.profile_flag = profile_flag
+        self.cprofile_flag = cprofile_flag
+        self.profiler = StageProfiler(detail = profile_flag) if profile_flag or metrics_format else None
+        self.progress_flag = progress_flag
+        self.progress_interval = progress_interval
+        self.prescan_flag = prescan_flag
+        self.metrics_format = metrics_format
+        self.metrics_interval = metrics_interval
+        self.metrics = None
 
         self.empty_flag = empty_flag
         self.empty_export_flag = empty_export_flag
 
         # Parameters for Input Option
         self.input = input
+        self.input_loader = input_loader
+        self.records = None
+        self.used_columns = None
         self.removal_flag = removal_flag
         if self.removal_flag:
-            self.removal_list = []
+            self.removal_list = ListExport(None)
         self.removal_export_flag = removal_export_flag
         self.export_flag = export_flag
         self.metadata_flag = metadata_flag
@@ -158,6 +285,9 @@ class OpexManifestGenerator():
         self.hash_from_spread = False
 
         self.parse_config(options_file=os.path.abspath(options_file))
+        # Arguments take precedence over the options file.
+        self.hash_buffer = hash_buffer if hash_buffer is not None else self.HASH_BUFFER
+        self.hash_read_mode = hash_read_mode if hash_read_mode is not None else self.HASH_READ_MODE
     
     def parse_config(self, options_file: str = os.path.join('options','options.properties')) -> None:
         config = configparser.ConfigParser()
@@ -185,8 +315,406 @@ class OpexManifestGenerator():
         self.REMOVALS_SUFFIX = section.get('REMOVALS_SUFFIX', "_Removals")
         self.METAFOLDER = section.get('METAFOLDER', "meta")
         self.GENERIC_DEFAULT_SECURITY = section.get('GENERIC_DEFAULT_SECURITY', "open")
+        try:
+            self.HASH_BUFFER = int(section.get('HASH_BUFFER', 0) or 0)
+        except ValueError as e:
+            logger.exception(f'HASH_BUFFER must be a number of bytes: {e}')
+            raise
+        self.HASH_READ_MODE = section.get('HASH_READ_MODE', "readinto") or "readinto"
+        if self.HASH_READ_MODE not in READ_MODES:
+            logger.error(f'HASH_READ_MODE must be one of {READ_MODES}, got: {self.HASH_READ_MODE}')
+            raise ValueError(f'HASH_READ_MODE must be one of {READ_MODES}, got: {self.HASH_READ_MODE}')
         logger.debug(f'Configuration set to: {[{k,v} for k,v in (section.items())]}')
 
+    def __getstate__(self) -> dict:
+        # Pools can't be sent to subtree worker processes; each worker starts its own.
+        state = self.__dict__.copy()
+        state['hash_pool'] = None
+        state['hash_stats'] = None
+        state['subtree_futures'] = {}
+        state['fixity_cache'] = None
+        state['cached_fixity'] = {}
+        state['cache_identities'] = {}
+        state['walk_hooks'] = []
+        state['journal'] = None
+        state['snapshot'] = None
+        state['opex_writer'] = None
+        state['pending_checkpoints'] = []
+        state['profiler'] = None
+        state['metrics'] = None
+        state['list_fixity'] = None
+        state['removal_list'] = None
+        state['list_path'] = []
+        # Parsed templates aren't picklable, so send them as bytes.
+        if getattr(self, 'xml_files', None):
+            state['xml_files'] = [dict(xml_file, template = ET.tostring(xml_file['template'])) for xml_file in self.xml_files]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        if state.get('xml_files'):
+            state['xml_files'] = [dict(xml_file, template = ET.fromstring(xml_file['template'])) for xml_file in state['xml_files']]
+        self.__dict__.update(state)
+
+    def add_run_file(self, path: str) -> str:
+        """Registers a file the run writes while walking, so it's skipped if written inside the tree (when meta_dir_flag is off)."""
+        folder, name = os.path.split(os.path.abspath(path.replace(u'\\\\?\\', "")))
+        self.run_files.setdefault(folder, set()).add(name)
+        return path
+
+    @staticmethod
+    def run_file_name(name: str, run_names: set) -> bool:
+        """Whether a name is one of run_names, a subtree worker's part file of one, or one of an SQLite database's side files."""
+        if name in run_names:
+            return True
+        for run_name in run_names:
+            if name.startswith(run_name) and (name[len(run_name):] in SQLITE_SIDE_SUFFIXES or
+                                              (name.startswith(run_name + ".") and name.endswith(".part"))):
+                return True
+        return False
+
+    def list_directory(self, directory: str, sort_key = str.casefold) -> list:
+        """
+        Lists a directory with a single scan, returning ScanEntry paths which keep each entry's type and stat data.
+        """
+        try:
+            with os.scandir(directory) as scan:
+                entries = list(scan)
+            run_names = self.run_files.get(os.path.abspath(directory.replace(u'\\\\?\\', ""))) if self.run_files else None
+            # Case-insensitive file systems find an opex regardless of case, as os.path.exists would.
+            fold = str.casefold if sys.platform in ("win32", "darwin") else str
+            names = {fold(f.name) for f in entries}
+            list_directories = []
+            for f in entries:
+                if f.name == self.METAFOLDER \
+                or f.name in ('opex_generate.exe','opex_generate.bin') \
+                or f.name == os.path.basename(__file__) \
+                or f.name.endswith(OPEX_TMP_SUFFIX) \
+                or (run_names and self.run_file_name(f.name, run_names)):
+                    continue
+                f_path = win_256_check(os.path.join(directory, f.name))
+                if self.hidden_flag is False and (f.name.startswith('.') or filter_win_hidden(f_path, f) is True):
+                    continue
+                list_directories.append(ScanEntry(f_path, f, opex_exists = fold(f"{f.name}.opex") in names))
+            return sorted(list_directories, key=sort_key)
+        except Exception as e:
+            logger.exception(f'Failed to Filter Directories: {e}')
+            raise
+
+    def partition_subtrees(self) -> list:
+        """
+        Lists the folders at partition_depth below root, in walk order, which can be generated independently.
+
+        Folders the walk would not descend into (removals, PAX folders when using PAX fixity) are not split.
+        """
+        level = [self.root]
+        for _ in range(self.partition_depth):
+            next_level = []
+            for folder_path in level:
+                if self.algorithm and self.pax_fixity_flag is True and folder_path.endswith(".pax"):
+                    continue
+                for f_path in self.list_directory(folder_path):
+                    if f_path.endswith('.opex') or not f_path.is_dir():
+                        continue
+                    next_level.append(f_path)
+            if self.removal_flag and _ < self.partition_depth - 1:
+                next_level = [f_path for f_path in next_level if not self.removal_df_lookup(self.record_lookup(f_path.replace(u'\\\\?\\', "")))]
+            level = next_level
+        return level
+
+    def merge_subtree(self, result: dict) -> None:
+        """Merges the lists written by a subtree worker, in the order the serial walk would have written them."""
+        self.list_fixity.append_part(result.get('fixity_part'), result.get('fixity_count', 0))
+        if self.keep_path_list:
+            self.list_path.extend(result.get('list_path', []))
+        if self.removal_flag:
+            self.removal_list.append_part(result.get('removal_part'), result.get('removal_count', 0))
+        self.fixity_cache_hits += result.get('fixity_cache_hits', 0)
+        self.fixity_cache_misses += result.get('fixity_cache_misses', 0)
+        self.hash_stats.merge(result.get('hash_stats', {}))
+        for key, count in result.get('incremental_counts', {}).items():
+            self.incremental_counts[key] += count
+        if self.profiler is not None:
+            self.profiler.merge(result.get('profile', {}))
+
+    def define_exports(self) -> None:
+        """Sets the Fixity and Removals export files, before any subtree workers are started so they can write parts alongside them."""
+        if self.algorithm:
+            output_path = self.add_run_file(define_output_file(self.output_path, self.root, self.METAFOLDER, self.meta_dir_flag, output_suffix = self.FIXITY_SUFFIX, output_format = "txt"))
+            if self.fixity_export_flag:
+                self.fixity_export_file = output_path
+        if self.removal_flag:
+            output_path = self.add_run_file(define_output_file(self.output_path, self.root, self.METAFOLDER, self.meta_dir_flag, output_suffix = self.REMOVALS_SUFFIX, output_format = "txt"))
+            if self.removal_export_flag:
+                self.removal_export_file = output_path
+
+    def open_exports(self) -> None:
+        """
+        Opens the Fixity and Removals exports, which are then written to as the walk goes rather than held in memory.
+        """
+        self.list_fixity = ListExport(self.fixity_export_file)
+        if self.removal_flag:
+            self.removal_list = ListExport(self.removal_export_file)
+
+    def open_part_exports(self) -> None:
+        """Opens part files for a subtree worker's share of the exports, which the parent appends in walk order."""
+        self.list_fixity = ListExport(part_file(self.fixity_export_file))
+        if self.removal_flag:
+            self.removal_list = ListExport(part_file(self.removal_export_file))
+
+    def close_exports(self, discard: bool = False) -> None:
+        for export in (self.list_fixity, getattr(self, 'removal_list', None) if self.removal_flag else None):
+            if export is None:
+                continue
+            if discard:
+                export.discard()
+            else:
+                export.close()
+
+    def journal_settings(self) -> dict:
+        """The options which change the output, so must match for a run to be resumed."""
+        return {'root': self.root,
+                'algorithm': self.algorithm,
+                'pax_fixity': self.pax_fixity_flag,
+                'zip': self.zip_flag,
+                'zip_file_removal': self.zip_file_removal,
+                'hidden': self.hidden_flag,
+                'removal': self.removal_flag,
+                'autoref': self.autoref_flag,
+                'input': self.input,
+                'metadata': self.metadata_flag,
+                'pretty_print': self.pretty_print}
+
+    def open_journal(self) -> None:
+        """
+        Loads the journal of an interrupted run when resuming. Writing starts with begin_journal.
+
+        Only runs generating fixities or removing entries are journaled: other runs skip entries which already have an Opex,
+        so can simply be run again, and they leave nothing in the meta directory.
+        """
+        if not self.journal_flag or not (self.algorithm or self.removal_flag):
+            return
+        journal_dir = os.path.join(self.output_path, self.METAFOLDER) if self.meta_dir_flag else self.output_path
+        self.journal_dir_created = not os.path.exists(journal_dir)
+        journal_path = self.add_run_file(define_output_file(self.output_path, self.root, self.METAFOLDER, self.meta_dir_flag, output_suffix = "_Journal", output_format = "jsonl"))
+        self.journal = RunJournal(journal_path, self.journal_settings(), resume = self.resume_flag)
+        if self.journal.resuming:
+            self.resume_started = self.journal.started
+
+    def begin_journal(self) -> None:
+        """
+        Starts journaling, once any subtree workers have started so they never inherit the open journal.
+
+        Export lines are captured for checkpoint whenever journaling or in incremental mode.
+        """
+        if self.journal is not None:
+            self.journal.begin()
+        elif self.snapshot is None:
+            return
+        self.list_fixity.start_capture()
+        if self.removal_flag:
+            self.removal_list.start_capture()
+
+    def close_journal(self, remove: bool = False) -> None:
+        if self.journal is not None:
+            self.journal.close(remove = remove)
+            if remove and self.journal_dir_created:
+                #The meta directory was made for the journal; removed with it unless the run wrote anything else there.
+                try:
+                    os.rmdir(os.path.dirname(self.journal.journal_path))
+                except OSError:
+                    pass
+            self.journal = None
+
+    def checkpoint(self, kind: str, path: str, identity: Optional[tuple] = None, digest: Optional[str] = None, **fields) -> None:
+        """
+        Journals an entry with the export lines added since the last checkpoint, see RunJournal.record.
+        In incremental mode, a File's Fixity lines are also stored in the snapshot under its identity, and a Folder's digest.
+
+        While Opexes are written in the background, checkpoints are held until the writes before them are done, see writer_barrier.
+        """
+        if self.journal is None and self.snapshot is None:
+            return
+        fixity = self.list_fixity.take_recent()
+        removals = self.removal_list.take_recent() if self.removal_flag else []
+        entry = (kind, path, identity, digest, fixity, removals, fields)
+        if self.opex_writer is None:
+            self.record_checkpoint(*entry)
+            return
+        self.pending_checkpoints.append(entry)
+        if removals or fields.get('removed'):
+            #Removed Files can't be regenerated, so are recorded as soon as they're gone.
+            self.writer_barrier()
+
+    def record_checkpoint(self, kind: str, path: str, identity: Optional[tuple], digest: Optional[str], fixity: list, removals: list, fields: dict) -> None:
+        if self.snapshot is not None:
+            if kind == 'file' and identity is not None:
+                self.snapshot.store_file(str(path), identity, fixity)
+            elif kind == 'folder' and digest is not None:
+                self.snapshot.store_folder(str(path), digest)
+        if self.journal is None:
+            return
+        if kind == 'open' and not fixity and not removals:
+            return
+        self.journal.record(kind, path, fixity, removals, **fields)
+
+    def start_opex_writer(self) -> None:
+        if self.writer_threads and self.writer_threads > 0:
+            self.opex_writer = OpexWriter(threads = self.writer_threads, max_pending = self.writer_queue)
+
+    def stop_opex_writer(self) -> None:
+        """Waits for the outstanding writes, then records the checkpoints held for them; raises the first error a write raised."""
+        if self.opex_writer is None:
+            return
+        opex_writer = self.opex_writer
+        self.opex_writer = None
+        try:
+            opex_writer.close()
+            for entry in self.pending_checkpoints:
+                self.record_checkpoint(*entry)
+        finally:
+            #If a write failed, there's no telling which of the held checkpoints were written, so none are recorded.
+            self.pending_checkpoints = []
+
+    def submit_write(self, func, *args) -> None:
+        """Runs a write on the Opex writer threads if started, otherwise straight away."""
+        if self.opex_writer is not None:
+            self.opex_writer.submit(func, *args)
+        else:
+            func(*args)
+
+    def writer_barrier(self) -> None:
+        """
+        Waits for the Opexes queued so far to be written, then records the checkpoints held for them.
+
+        Called before each Folder's Manifest is written, so a Folder's Opex is never written before those below it.
+        """
+        if self.opex_writer is None:
+            return
+        self.opex_writer.wait()
+        pending, self.pending_checkpoints = self.pending_checkpoints, []
+        for entry in pending:
+            self.record_checkpoint(*entry)
+        if self.journal is not None:
+            self.journal.flush()
+
+    def resume_entry(self, path: str) -> Optional[dict]:
+        """
+        If the interrupted run completed an entry, writes its export lines (and those of everything below it) and returns its record.
+        """
+        if self.journal is None:
+            return None
+        record = self.journal.entry(path)
+        if record is None:
+            return None
+        fixity, removals = self.journal.replay(path)
+        self.list_fixity.replay(fixity)
+        if self.removal_flag:
+            self.removal_list.replay(removals)
+        logger.debug(f'Completed by the interrupted run: {path}')
+        return record
+
+    def opex_pending(self, path: str) -> bool:
+        """
+        As check_opex; but when resuming, an Opex written by the interrupted run after its last checkpoint is generated again.
+        In incremental mode, an Opex is generated for any File which is new or changed since the snapshot.
+        """
+        if self.snapshot is not None:
+            return self.unchanged_fixity(path, self.snapshot_identity(path)) is None
+        return check_opex(path) or written_since(path + ".opex", self.resume_started)
+
+    def created_by_interrupted_run(self, path: str) -> bool:
+        """
+        When resuming, whether a path was written by the interrupted run rather than being content: an Opex written since
+        it started, or a file (such as a Zip) its journal records a completed File creating. Other files are content,
+        even if changed or added since the interruption.
+        """
+        if self.journal is None or self.resume_started is None:
+            return False
+        if path.endswith('.opex'):
+            return written_since(path, self.resume_started)
+        return self.journal.was_created(path)
+
+    def define_snapshot(self) -> None:
+        """Sets the snapshot for incremental mode, before any subtree workers are started so they share its path and run stamp."""
+        if not self.incremental_flag:
+            return
+        if self.zip_flag:
+            logger.error('Incremental mode cannot be used with zip, as zipped Files are no longer in the tree to compare.')
+            raise ValueError('Incremental mode cannot be used with zip, as zipped Files are no longer in the tree to compare.')
+        self.snapshot_path = self.add_run_file(define_output_file(self.output_path, self.root, self.METAFOLDER, self.meta_dir_flag, output_suffix = "_Snapshot", output_format = "sqlite"))
+        self.snapshot_stamp = time.time_ns()
+
+    def open_snapshot(self) -> None:
+        if self.snapshot_path is None:
+            return
+        self.snapshot = TreeSnapshot(self.snapshot_path, self.journal_settings(), run_stamp = self.snapshot_stamp)
+
+    def close_snapshot(self, forget_stale: bool = False) -> None:
+        if self.snapshot is not None:
+            self.snapshot.close(forget_stale = forget_stale)
+            self.snapshot = None
+
+    def snapshot_identity(self, path: str) -> Optional[tuple]:
+        if self.snapshot is None:
+            return None
+        try:
+            return TreeSnapshot.identity(path)
+        except OSError:
+            return None
+
+    def unchanged_fixity(self, path: str, identity: Optional[tuple]) -> Optional[list]:
+        """
+        In incremental mode, returns the Fixity lines of a File unchanged since the snapshot whose Opex still exists; otherwise None.
+        """
+        if self.snapshot is None or identity is None or check_opex(path):
+            return None
+        return self.snapshot.unchanged_file(str(path), identity)
+
+    def remove_orphans(self, folder_path: str, list_directories: list) -> list:
+        """
+        In incremental mode, removes Opexes generated by an earlier run for Files or Folders no longer in the tree, returning the rest of the listing.
+        """
+        listed = {str(f_path) for f_path in list_directories}
+        kept = []
+        for f_path in list_directories:
+            source = f_path[:-len('.opex')]
+            #A Folder's own Opex is inside it, so has no source alongside it.
+            if f_path.endswith('.opex') and source not in listed and os.path.basename(source) != os.path.basename(folder_path) \
+            and self.snapshot.known(source):
+                os.remove(f_path)
+                self.incremental_counts['orphans'] += 1
+                logger.info(f'Removed orphaned Opex: {f_path}')
+                continue
+            kept.append(f_path)
+        return kept
+
+    def start_hash_pool(self) -> None:
+        if self.algorithm and self.jobs and self.jobs > 1:
+            self.hash_pool = HashPool(self.algorithm, jobs = self.jobs, mode = self.jobs_mode, buffer = self.hash_buffer, read_mode = self.hash_read_mode,
+                                      io_policy = self.hash_io_policy, rate_limit = self.hash_rate_limit, stats = self.hash_stats)
+
+    def stop_hash_pool(self) -> None:
+        if self.hash_pool is not None:
+            self.hash_pool.shutdown()
+            self.hash_pool = None
+
+    def open_fixity_cache(self) -> None:
+        if not self.algorithm or not self.fixity_cache_flag or self.hash_from_spread:
+            return
+        if self.fixity_cache_path is None:
+            self.fixity_cache_path = define_output_file(self.output_path, self.root, self.METAFOLDER, self.meta_dir_flag, output_suffix = "_FixityCache", output_format = "sqlite")
+        self.add_run_file(self.fixity_cache_path)
+        self.fixity_cache = FixityCache(self.fixity_cache_path, max_entries = self.fixity_cache_max_entries)
+
+    def close_fixity_cache(self, evict: bool = True) -> None:
+        if self.fixity_cache is not None:
+            self.fixity_cache_hits += self.fixity_cache.hits
+            self.fixity_cache_misses += self.fixity_cache.misses
+            self.fixity_cache.close(evict = evict)
+            self.fixity_cache = None
+        self.cached_fixity = {}
+        self.cache_identities = {}
+
     def print_descriptive_xmls(self) -> None:
         try:
             for file in os.scandir(self.metadata_dir):
@@ -223,6 +751,8 @@ class OpexManifestGenerator():
                         elem = ET.QName(elem)
                         elem_lnpath = elem_path.replace(f"{{{elem.namespace}}}", root_element_ln + ":")
                         column_list.append(elem_lnpath)
+                import pandas as pd
+                from auto_reference_generator.common import export_xl, export_csv, export_json, export_ods
                 df = pd.DataFrame(columns=column_list,index=None)
                 if self.output_format == 'xlsx':
                     export_xl(df,file.name.replace('.xml','.xlsx'))
@@ -256,7 +786,10 @@ class OpexManifestGenerator():
 
     def init_df(self) -> None:
         try:
+            self.used_columns = None
             if self.autoref_flag:
+                from auto_reference_generator import ReferenceGenerator
+                from auto_reference_generator.common import export_xl, export_csv, export_json, export_ods, export_xml
                 ar = ReferenceGenerator(self.root,
                                                 output_path = self.output_path,
                                                 prefix = self.prefix,
@@ -276,8 +809,6 @@ class OpexManifestGenerator():
                 self.df = ar.init_dataframe()
                 if self.autoref_flag in {"accession", "a", "accession-generic", "ag"}:
                     self.df = self.df.drop(self.ARCREF_FIELD, axis=1)
-                self.column_headers = self.df.columns.values.tolist()
-                self.set_input_flags()
                 if self.export_flag:
                     output_path = define_output_file(self.output_path, self.root, self.METAFOLDER, meta_dir_flag = self.meta_dir_flag, output_format = self.output_format)                
                     if self.output_format == "xlsx":
@@ -290,26 +821,46 @@ class OpexManifestGenerator():
                         export_ods(self.df, output_path)
                     elif self.output_format == "xml":
                         export_xml(self.df, output_path)
+                # Projected once exported, so the export keeps every column.
+                self.project_df()
+                self.column_headers = self.df.columns.values.tolist()
+                self.build_records()
+                self.set_input_flags()
                 logger.debug(f'Auto Reference Dataframe initialised with columns: {self.column_headers}')
                 return True
             elif self.input:
+                if self.input_loader == "stream":
+                    self.df = None
+                    self.records = load_records(self.input, self.INDEX_FIELD, usecols = self.column_used,
+                                                categorical_columns = self.categorical_columns())
+                    if self.records is not None:
+                        self.records_source = None
+                        self.column_headers = list(self.records.columns)
+                        self.set_input_flags()
+                        logger.debug(f'Input records loaded without a Dataframe, with columns: {self.column_headers}')
+                        return True
+                    logger.debug(f'Input {self.input} can\'t be streamed, so reading it into a Dataframe')
+                import pandas as pd
                 if self.input.endswith(('.xlsx','.xls','.xlsm')):
-                    self.df = pd.read_excel(self.input)
+                    self.df = pd.read_excel(self.input, usecols = self.column_used)
                 elif self.input.endswith('.csv'):
-                    self.df = pd.read_csv(self.input)
+                    self.df = pd.read_csv(self.input, usecols = self.column_used)
                 elif self.input.endswith('.json'):
                     self.df = pd.read_json(self.input)
                 elif self.input.endswith('.ods'):
-                    self.df = pd.read_excel(self.input, engine='odf')
+                    self.df = pd.read_excel(self.input, engine='odf', usecols = self.column_used)
                 elif self.input.endswith('.xml'):
                     self.df = pd.read_xml(self.input)
+                self.project_df()
                 self.column_headers = self.df.columns.values.tolist()
+                self.build_records()
                 self.set_input_flags()
                 logger.debug(f'Input Dataframe initialised with columns: {self.column_headers}')
                 return True
             else:
                 logger.warning('No Auto Reference or Input file specified, proceeding without Dataframe')
                 self.df = None
+                self.records = None
                 self.column_headers = None
                 return False
         except Exception as e:
@@ -329,43 +880,71 @@ class OpexManifestGenerator():
             logger.exception(f'Error looking up Clearing Opex: {e}')
             raise
     
-    def index_df_lookup(self, path: str) -> pd.Index:
-        if getattr(self, 'df', None) is None:
+    def build_records(self) -> None:
+        """
+        Materialises the Dataframe rows once as records, with an index of paths to rows, so lookups
+        don't scan the INDEX_FIELD column or index into the Dataframe per entry.
+        """
+        self.records = RecordTable.from_dataframe(self.df, self.INDEX_FIELD)
+        self.records_source = self.df
+
+    def records_loaded(self) -> bool:
+        """Whether there are input rows to look up, in a Dataframe or loaded as records without one."""
+        return getattr(self, 'df', None) is not None or getattr(self, 'records', None) is not None
+
+    def entry_record(self, idx: Union[EntryRecord, pd.Index]) -> EntryRecord:
+        """Accepts a record from record_lookup, or an Index from index_df_lookup."""
+        if getattr(self, 'records_source', None) is not self.df:
+            self.build_records()
+        if isinstance(idx, EntryRecord):
+            return idx
+        return self.records.from_positions(self.df.index.get_indexer(idx))
+
+    def record_lookup(self, path: str) -> EntryRecord:
+        if not self.records_loaded():
             logger.error('Dataframe not initialised, cannot perform lookup')
             raise RuntimeError('Dataframe not initialised, cannot perform lookup')
         try:
-            idx = self.df.loc[self.df[self.INDEX_FIELD] == path, self.INDEX_FIELD].index
-            return idx
+            with self.timed('lookup', path):
+                if getattr(self, 'records_source', None) is not self.df:
+                    self.build_records()
+                if self.INDEX_FIELD not in self.records.columns:
+                    raise KeyError(self.INDEX_FIELD)
+                # Duplicate paths match every row, as the column comparison did.
+                return self.records.lookup(path)
         except KeyError as e:
             logger.exception(f'Key Error in Index Lookup: {e}' \
             '\n Please ensure column header\'s are an exact match.')
             raise
-        except IndexError as e:
-            logger.warning(f'Index Error in Index Lookup: {e}. Proceeding...' \
-            '\nIt is likely you have removed or added a file/folder to the directory' \
-            '\nafter generating your input spreadsheet. An opex will still be generated but information may be missing.' \
-            '\nTo ensure metadata match up please regenerate the spreadsheet.')
         except Exception as e:
             logger.exception(f'Error looking up Index from Dataframe: {e}')
             raise
 
-    def xip_df_lookup(self, idx: pd.Index) -> tuple:
-        if getattr(self, 'df', None) is None:
+    def index_df_lookup(self, path: str) -> pd.Index:
+        """Returns the Dataframe Index of the rows matching a path; or their record, when loaded without a Dataframe."""
+        record = self.record_lookup(path)
+        if self.df is None:
+            return record
+        return self.df.index[record.positions]
+
+    def xip_df_lookup(self, idx: Union[EntryRecord, pd.Index]) -> tuple:
+        if not self.records_loaded():
             logger.error('Dataframe not initialised, cannot perform lookup')
             raise RuntimeError('Dataframe not initialised, cannot perform lookup')
         try:
             title = None
             description = None
             security = None
-            if idx.empty:
+            record = self.entry_record(idx)
+            if record.empty:
                 pass
             else:
                 if self.title_flag:
-                    title = check_nan(self.df.loc[idx,self.TITLE_FIELD].item())
+                    title = record.get(self.TITLE_FIELD)
                 if self.description_flag:
-                    description = check_nan(self.df.loc[idx,self.DESCRIPTION_FIELD].item())
+                    description = record.get(self.DESCRIPTION_FIELD)
                 if self.security_flag:
-                    security = check_nan(self.df.loc[idx,self.SECURITY_FIELD].item())
+                    security = record.get(self.SECURITY_FIELD)
             return title,description,security
         except KeyError as e:
             logger.exception(f'Key Error in Removal Lookup: {e}'
@@ -380,15 +959,16 @@ class OpexManifestGenerator():
             logger.exception(f'Error looking up XIP from Dataframe: {e}')
             raise
     
-    def removal_df_lookup(self, idx: pd.Index) -> bool:
-        if getattr(self, 'df', None) is None:
+    def removal_df_lookup(self, idx: Union[EntryRecord, pd.Index]) -> bool:
+        if not self.records_loaded():
             logger.error('Dataframe not initialised, cannot perform lookup')
             raise RuntimeError('Dataframe not initialised, cannot perform lookup')        
         try:
-            if idx.empty:
+            record = self.entry_record(idx)
+            if record.empty:
                 return False
             else:
-                remove = check_nan(self.df.loc[idx,self.REMOVAL_FIELD].item())
+                remove = record.get(self.REMOVAL_FIELD)
                 if remove is not None:
                     return True
                 else:
@@ -406,16 +986,17 @@ class OpexManifestGenerator():
             logger.exception(f'Error looking up Removals from Dataframe: {e}')
             raise
 
-    def ignore_df_lookup(self, idx: pd.Index) -> bool:
-        if getattr(self, 'df', None) is None:
+    def ignore_df_lookup(self, idx: Union[EntryRecord, pd.Index]) -> bool:
+        if not self.records_loaded():
             logger.error('Dataframe not initialised, cannot perform lookup')
             raise RuntimeError('Dataframe not initialised, cannot perform lookup')        
         try:
-            if idx.empty:
+            record = self.entry_record(idx)
+            if record.empty:
                 return False
             else:
-                ignore = check_nan(self.df.loc[idx,self.IGNORE_FIELD].item())
-            return bool(ignore)
+                ignore = record.get(self.IGNORE_FIELD)
+            return check_flag(ignore)
         except KeyError as e:
             logger.exception(f'Key Error in Ignore Lookup: {e}'
             '\n Please ensure column header\'s are an exact match.')
@@ -429,18 +1010,24 @@ class OpexManifestGenerator():
             logger.exception(f'Error looking up Ignore from Dataframe: {e}')
             return False
 
-    def sourceid_df_lookup(self, xml_element: ET.SubElement, idx: pd.Index) -> None:
-        if getattr(self, 'df', None) is None:
+    def sourceid_df_lookup(self, xml_element: ET.SubElement, idx: Union[EntryRecord, pd.Index]) -> None:
+        sourceid = self.sourceid_value(idx)
+        if sourceid is not None:
+            source_xml = ET.SubElement(xml_element,f"{{{self.opexns}}}SourceID")
+            source_xml.text = sourceid
+
+    def sourceid_value(self, idx: Union[EntryRecord, pd.Index]) -> Optional[str]:
+        if not self.records_loaded():
             logger.error('Dataframe not initialised, cannot perform lookup')
             raise RuntimeError('Dataframe not initialised, cannot perform lookup')        
         try:
-            if idx.empty:
+            record = self.entry_record(idx)
+            if record.empty:
                 pass
             else:
-                sourceid = check_nan(self.df.loc[idx,self.SOURCEID_FIELD].item())
+                sourceid = record.get(self.SOURCEID_FIELD)
                 if sourceid:
-                    source_xml = ET.SubElement(xml_element,f"{{{self.opexns}}}SourceID")
-                    source_xml.text = str(sourceid)
+                    return str(sourceid)
         except KeyError as e:
             logger.exception(f'Key Error in SourceID Lookup: {e}'
             '\n Please ensure column header\'s are an exact match.')
@@ -453,40 +1040,49 @@ class OpexManifestGenerator():
         except Exception as e:
             logger.exception(f'Error looking up SourceID from Dataframe: {e}')
             raise
+        return None
+
+    def hash_df_lookup(self, xml_fixities: ET.SubElement, idx: Union[EntryRecord, pd.Index]) -> None:
+        fixities, list_fixity = self.hash_df_fixities(idx)
+        add_fixity_elements(xml_fixities, self.opexns, fixities)
+        self.list_fixity.extend(list_fixity)
 
-    def hash_df_lookup(self, xml_fixities: ET.SubElement, idx: pd.Index) -> None:
-        if getattr(self, 'df', None) is None:
+    def hash_df_fixities(self, idx: Union[EntryRecord, pd.Index]) -> tuple:
+        """
+        Returns the (algorithm, hash, member) Fixities for an entry from the spreadsheet, generating them if it has no Algorithm;
+        and the Fixity export lines for those generated.
+        """
+        if not self.records_loaded():
             logger.error('Dataframe not initialised, cannot perform lookup')
             raise RuntimeError('Dataframe not initialised, cannot perform lookup')        
         try:
             hash_value = None
             algo_value = None
             file_path = None
-            
-            if idx.empty:
-                return
+            record = self.entry_record(idx)
+            if record.empty:
+                return [], []
             else:
                 # prefer the algorithm specified in the spreadsheet for this row
                 if not self.column_headers or (self.HASH_FIELD not in self.column_headers and self.ALGORITHM_FIELD not in self.column_headers):
-                   return
-                hash_value = check_nan(self.df.loc[idx, self.HASH_FIELD].item())
-                algo_value = check_nan(self.df.loc[idx, self.ALGORITHM_FIELD].item())
-                file_path = check_nan(self.df.loc[idx, self.INDEX_FIELD].item()) if self.INDEX_FIELD in self.column_headers else None
+                   return [], []
+                hash_value = record.get(self.HASH_FIELD)
+                algo_value = record.get(self.ALGORITHM_FIELD)
+                file_path = record.get(self.INDEX_FIELD) if self.INDEX_FIELD in self.column_headers else None
 
             if algo_value is not None:
-                self.fixity = ET.SubElement(xml_fixities, f"{{{self.opexns}}}Fixity")
-                self.fixity.set('type', algo_value)
-                self.fixity.set('value', str(hash_value))
                 logger.debug(f'Using Algorithm from Spreadsheet: {algo_value} with Hash: {hash_value}')
+                return [(algo_value, str(hash_value), None)], []
 
             else:
                 if file_path is not None:
                     # fallback to configured algorithms
                     logger.debug('No Algorithm specified in Spreadsheet for this entry; ')
                     if file_path.endswith('.pax.zip') or file_path.endswith('.pax'):
-                        self.generate_pax_zip_opex_fixity(file_path, self.algorithm, self.list_fixity)
+                        fixities = self.pax_zip_fixities(file_path, self.algorithm)
                     else:
-                        self.generate_opex_fixity(file_path, self.algorithm, self.list_fixity)
+                        fixities = self.file_fixities(file_path, self.algorithm)
+                    return fixities, fixity_lines(file_path, fixities)
         except KeyError as e:
             logger.exception(f'Key Error in Hash Lookup: {e}'
             '\n Please ensure column header\'s are an exact match.')
@@ -499,13 +1095,23 @@ class OpexManifestGenerator():
         except Exception as e:
             logger.exception(f'Error looking up Hash from Dataframe: {e}')
             raise
+        return [], []
+
+    def ident_df_lookup(self, idx: Union[EntryRecord, pd.Index], default_key: str = None) -> None:
+        for key_name, ident in self.identifier_values(idx):
+            self.identifier = ET.SubElement(self.identifiers, f"{{{self.opexns}}}Identifier") 
+            self.identifier.set("type", key_name)
+            self.identifier.text = ident
 
-    def ident_df_lookup(self, idx: pd.Index, default_key: str = None) -> None:
-        if getattr(self, 'df', None) is None:
+    def identifier_values(self, idx: Union[EntryRecord, pd.Index]) -> list:
+        """Returns the (type, value) Identifiers for an entry."""
+        if not self.records_loaded():
             logger.error('Dataframe not initialised, cannot perform lookup')
             raise RuntimeError('Dataframe not initialised, cannot perform lookup')        
+        identifiers = []
         try:
-            if idx.empty:
+            record = self.entry_record(idx)
+            if record.empty:
                 pass
             else:
                 for header in self.column_headers:
@@ -521,11 +1127,9 @@ class OpexManifestGenerator():
                             key_name = self.ACCREF_CODE
                         else:
                             key_name = self.IDENTIFIER_DEFAULT
-                        ident = check_nan(self.df.loc[idx,header].item())                    
+                        ident = record.get(header)
                         if ident:
-                            self.identifier = ET.SubElement(self.identifiers, f"{{{self.opexns}}}Identifier") 
-                            self.identifier.set("type", key_name)
-                            self.identifier.text = str(ident)
+                            identifiers.append((key_name, str(ident)))
                         logger.debug(f'Adding Identifer: {header}: {ident}')
         except KeyError as e:
             logger.exception(f'Key Error in Identifer Lookup: {e}' \
@@ -539,6 +1143,70 @@ class OpexManifestGenerator():
         except Exception as e:
             logger.exception(f'Error looking up Identifiers: {e}')    
             raise
+        return identifiers
+
+    @staticmethod
+    def template_elements(xml_file: ET.ElementTree) -> tuple:
+        """Returns the localname of a metadata template's root, and the Name, Namespace and Path of each of its elements."""
+        root_element_ln = ET.QName(xml_file.find('.')).localname
+        elements_list = []
+        for elem in xml_file.findall('.//'):
+            elem_path = xml_file.getelementpath(elem)
+            elem = ET.QName(elem)
+            elem_ln = elem.localname
+            elem_ns = elem.namespace
+            elem_lnpath = elem_path.replace(f"{{{elem_ns}}}", root_element_ln + ":")
+            elements_list.append({"Name": root_element_ln + ":" + elem_ln, "Namespace": elem_ns, "Path": elem_lnpath})
+        return root_element_ln, elements_list
+
+    def template_columns(self) -> set:
+        """The column headers the metadata templates would match, by Name (flat) or Path (exact)."""
+        columns = set()
+        try:
+            files = [file.name for file in os.scandir(self.metadata_dir) if file.name.endswith('xml')]
+        except FileNotFoundError:
+            #Raised with its own message by init_generate_descriptive_metadata.
+            return columns
+        for name in files:
+            try:
+                xml_file = ET.parse(os.path.join(self.metadata_dir, name))
+            except ET.XMLSyntaxError as e:
+                logger.exception(f'XML Syntax Error parsing file {name}: {e}')
+                raise
+            _, elements_list = self.template_elements(xml_file)
+            for elem_dict in elements_list:
+                columns.update((elem_dict.get('Name'), elem_dict.get('Path')))
+        return columns
+
+    def column_used(self, column) -> bool:
+        """
+        Whether a spreadsheet column is used by the run, so only those columns are loaded: the fields named in the
+        options file, Identifier and reference columns, Removals with --remove, and the template columns with -m.
+        """
+        if self.used_columns is None:
+            self.used_columns = {self.INDEX_FIELD, self.TITLE_FIELD, self.DESCRIPTION_FIELD, self.SECURITY_FIELD,
+                                 self.SOURCEID_FIELD, self.IGNORE_FIELD, self.HASH_FIELD, self.ALGORITHM_FIELD}
+            if self.removal_flag:
+                self.used_columns.add(self.REMOVAL_FIELD)
+            if self.metadata_flag is not None:
+                self.used_columns.update(self.template_columns())
+        if column in self.used_columns:
+            return True
+        return isinstance(column, str) and any(field in column for field in (self.IDENTIFIER_FIELD, self.ARCREF_FIELD, self.ACCREF_FIELD))
+
+    def categorical_columns(self) -> list:
+        """Columns with a few values repeated across rows, held once each rather than once per row."""
+        return [self.SECURITY_FIELD, self.ALGORITHM_FIELD]
+
+    def project_df(self) -> None:
+        """Drops the Dataframe's unused columns, and holds repeated values (such as Security) as categoricals."""
+        columns = [column for column in self.df.columns if self.column_used(column)]
+        if len(columns) < len(self.df.columns):
+            logger.debug(f'Dropping {len(self.df.columns) - len(columns)} unused columns from the Dataframe')
+            self.df = self.df[columns]
+        for column in self.categorical_columns():
+            if column in self.df.columns and self.df[column].dtype != 'category':
+                self.df = self.df.astype({column: 'category'})
 
     def init_generate_descriptive_metadata(self) -> None:
         try:
@@ -559,30 +1227,29 @@ class OpexManifestGenerator():
                     except FileNotFoundError as e:
                         logger.exception(f'XML file not found {file.name}: {e}')
                         raise
-                    root_element = ET.QName(xml_file.find('.'))
-                    root_element_ln = root_element.localname
-                    #root_element_ns = root_element.namespace
-                    elements_list = []
-                    for elem in xml_file.findall('.//'):
-                        elem_path = xml_file.getelementpath(elem)
-                        elem = ET.QName(elem)
-                        elem_ln = elem.localname
-                        elem_ns = elem.namespace
-                        elem_lnpath = elem_path.replace(f"{{{elem_ns}}}", root_element_ln + ":")
-                        elements_list.append({"Name": root_element_ln + ":" + elem_ln, "Namespace": elem_ns, "Path": elem_lnpath})
+                    template = xml_file.find('.')
+                    root_element_ln, elements_list = self.template_elements(xml_file)
 
                     """
                     Compares the column headers in the Spreadsheet against the headers. Filters out non-matching data.
+                    Matching elements are located once here, so each entry only needs to follow the locator in a copy of the template.
                     """
                     try:
                         for elem_dict in elements_list:
                             if elem_dict.get('Name') in self.column_headers or elem_dict.get('Path') in self.column_headers:
-                                list_xml.append({"Name": elem_dict.get('Name'), "Namespace": elem_dict.get('Namespace'), "Path": elem_dict.get('Path')})
+                                name = elem_dict.get('Name')
+                                lnpath = elem_dict.get('Path')
+                                ns = elem_dict.get('Namespace')
+                                exact_path = lnpath.replace(root_element_ln + ":", f"{{{ns}}}")
+                                exact_locator = element_locator(template, xml_file.find(f'./{exact_path}'))
+                                flat_locator = element_locator(template, xml_file.find(f'.//{{{ns}}}{name.split(":")[-1]}'))
+                                list_xml.append({"Name": name, "Namespace": ns, "Path": lnpath,
+                                                 "ExactLocator": exact_locator, "FlatLocator": flat_locator})
                     except Exception as e:
                         logger.exception(f'Failed comparing Column headers in XML: {e}')
                         raise
                 if len(list_xml) != 0:
-                    self.xml_files.append({'data': list_xml, 'localname': root_element_ln, 'xmlfile': path})
+                    self.xml_files.append({'data': list_xml, 'localname': root_element_ln, 'xmlfile': path, 'template': template})
                     logger.debug(f'XML file: {file.name} with matching columns added for descriptive metadata.')
                 else:
                     logger.warning(f'No matching columns found in XML file: {file.name}, skipping.')
@@ -593,48 +1260,50 @@ class OpexManifestGenerator():
         except Exception as e:
             logger.exception(f'Failed to intialise XML Metadata: {e}')
             raise
-    def generate_descriptive_metadata(self, xml_desc_elem: ET.Element, idx: pd.Index) -> None:
+    def generate_descriptive_metadata(self, xml_desc_elem: ET.Element, idx: Union[EntryRecord, pd.Index]) -> None:
         """
         Composes the data into an xml file.
         """
         try:
+            record = self.entry_record(idx)
             for xml_file in self.xml_files:
                 list_xml = xml_file.get('data')
                 localname = xml_file.get('localname')
-                if len(list_xml) == 0 or idx.empty:
+                if len(list_xml) == 0 or record.empty:
                     pass
                 else:
-                    xml_new = ET.parse(xml_file.get('xmlfile'))
+                    xml_new = deepcopy(xml_file.get('template'))
                     for elem_dict in list_xml:
                         name = elem_dict.get('Name')
                         path = elem_dict.get('Path')
                         ns = elem_dict.get('Namespace')
                         if self.metadata_flag in {'e', 'exact'}:
-                            val_series = self.df.loc[idx,path]
-                            val = check_nan(val_series.item())
+                            column = path
                         elif self.metadata_flag in {'f', 'flat'}:
-                            val_series = self.df.loc[idx,name]
-                            val = check_nan(val_series.item())
+                            column = name
+                        val = record.get(column)
                         if val is None:
                             continue
                         else:
-                            if is_datetime64_any_dtype(val_series):
-                                val = pd.to_datetime(val)
+                            if column in record.table.datetime_columns:
+                                if not isinstance(val, datetime):
+                                    import pandas as pd
+                                    val = pd.to_datetime(val)
                                 val = datetime.strftime(val, "%Y-%m-%dT%H:%M:%S.000Z")
                         if self.metadata_flag in {'e','exact'}:
-                            n = path.replace(localname + ":", f"{{{ns}}}")
-                            elem = xml_new.find(f'./{n}')
-                            if elem is None:
+                            locator = elem_dict.get('ExactLocator')
+                            if locator is None:
+                                n = path.replace(localname + ":", f"{{{ns}}}")
                                 logger.warning(f'XML element not found for path: {n} in {xml_file.get("xmlfile")}')
                                 continue
                         elif self.metadata_flag in {'f', 'flat'}:
-                            n = name.split(':')[-1]
-                            elem = xml_new.find(f'.//{{{ns}}}{n}')
-                            if elem is None:
+                            locator = elem_dict.get('FlatLocator')
+                            if locator is None:
                                 logger.warning(f'XML element not found for name: {name} in {xml_file.get("xmlfile")}')
                                 continue
+                        elem = locate_element(xml_new, locator)
                         elem.text = str(val)
-                    xml_desc_elem.append(xml_new.find('.'))
+                    xml_desc_elem.append(xml_new)
         except KeyError as e:
             logger.exception(f'Key Error in XML Lookup: {e}' \
             '\n please ensure column header\'s are an exact match.')            
@@ -648,7 +1317,7 @@ class OpexManifestGenerator():
             logger.exception(f'General Error in XML Lookup: {e}')
             raise
 
-    def generate_opex_properties(self, xmlroot: ET.Element, idx: int, title: str = None,
+    def generate_opex_properties(self, xmlroot: ET.Element, idx: Union[EntryRecord, pd.Index], title: str = None,
                                   description: str = None, security: str = None) -> None:
         self.properties = ET.SubElement(xmlroot, f"{{{self.opexns}}}Properties")
         if title:
@@ -660,39 +1329,49 @@ class OpexManifestGenerator():
         if security:
             self.securityxml = ET.SubElement(self.properties, f"{{{self.opexns}}}SecurityDescriptor")
             self.securityxml.text = str(security)
-        if self.autoref_flag not in {"generic", "g"} or self.input:
+        if self.has_identifiers():
             self.identifiers = ET.SubElement(self.properties, f"{{{self.opexns}}}Identifiers")
             self.ident_df_lookup(idx)
         # remove Properties element if no children were added
         if len(self.properties) == 0:
             xmlroot.remove(self.properties)
 
+    def has_identifiers(self) -> bool:
+        return self.autoref_flag not in {"generic", "g"} or bool(self.input)
+
     def generate_opex_fixity(self, file_path: str, algorithm: Optional[list] = None) -> list:
         """Generate fixities for a file. If algorithm is None, defaults to ['SHA-1']."""
+        fixities = self.file_fixities(file_path, algorithm)
+        add_fixity_elements(self.fixities, self.opexns, fixities)
+        return fixity_lines(file_path, fixities)
+
+    def file_fixities(self, file_path: str, algorithm: Optional[list] = None) -> list:
+        """Returns (algorithm, hash, None) for each algorithm. If algorithm is None, defaults to ['SHA-1']."""
         algorithm = algorithm or ['SHA-1']
-        list_fixity = []
-        for algorithm_type in algorithm:
-            self.fixity = ET.SubElement(self.fixities, f"{{{self.opexns}}}Fixity")
-            hash_value = HashGenerator(algorithm = algorithm_type).hash_generator(file_path)
-            self.fixity.set("type", algorithm_type)
-            self.fixity.set("value", hash_value)
-            list_fixity.append([algorithm_type, hash_value, file_path])
-        return list_fixity
+        with self.timed('hash', file_path):
+            hash_values = self.hash_fixity(file_path, algorithm)
+        return [(algorithm_type, hash_values[algorithm_type], None) for algorithm_type in algorithm]
     
     def generate_pax_folder_opex_fixity(self, folder_path: str, fixitiesxml: ET._Element, filesxml: ET._Element, algorithm: Optional[list] = None) -> list:
         """Generate fixities for files inside a pax folder. If algorithm is None, defaults to ['SHA-1']."""
         algorithm = algorithm or ['SHA-1']
         list_fixity = []
         list_path = []
-        for dir,_,files in os.walk(folder_path):
-                for filename in files:
+        OMG = getattr(self, 'OMG', self)
+        #When resuming, files the interrupted run wrote into the PAX weren't there to begin with.
+        pax_files = [(dir, filename) for dir,_,files in os.walk(folder_path) for filename in files
+                     if not OMG.created_by_interrupted_run(os.path.join(dir, filename))]
+        self.queue_fixity([os.path.abspath(os.path.join(dir,filename)) for dir, filename in pax_files])
+        for dir, filename in pax_files:
                     rel_path = os.path.relpath(dir,folder_path)
                     rel_file = os.path.join(rel_path, filename).replace('\\','/')
                     abs_file = os.path.abspath(os.path.join(dir,filename))
                     list_path.append(abs_file)
+                    with OMG.timed('hash', abs_file):
+                        hash_values = self.hash_fixity(abs_file, algorithm)
                     for algorithm_type in algorithm:
                         self.fixity = ET.SubElement(fixitiesxml, f"{{{self.opexns}}}Fixity")
-                        hash_value = HashGenerator(algorithm = algorithm_type).hash_generator(abs_file)
+                        hash_value = hash_values[algorithm_type]
                         self.fixity.set("type", algorithm_type)
                         self.fixity.set("value", hash_value)
                         self.fixity.set("path", rel_file)
@@ -704,24 +1383,265 @@ class OpexManifestGenerator():
         return list_fixity, list_path
 
 
+    def hash_fixity(self, file_path: str, algorithm: list) -> dict:
+        """
+        Returns {algorithm: HASH} for a file; taken from the fixity cache if unchanged, from the hash pool
+        if the walk queued it ahead, otherwise hashed here.
+        """
+        OMG = getattr(self, 'OMG', self)
+        if file_path in OMG.cached_fixity:
+            return OMG.cached_fixity.pop(file_path)
+        identity = OMG.cache_identities.pop(file_path, None)
+        if OMG.fixity_cache is not None and identity is None:
+            try:
+                identity = FixityCache.identity(file_path)
+            except OSError:
+                identity = None
+            if identity is not None:
+                cached = OMG.fixity_cache.lookup(file_path, algorithm, identity)
+                if cached is not None:
+                    return cached
+        if OMG.hash_pool is not None and list(algorithm) == list(OMG.hash_pool.algorithm):
+            hash_values = OMG.hash_pool.result(file_path)
+        else:
+            hash_values, nbytes, seconds = hash_file_measured(file_path, algorithm, OMG.hash_buffer, OMG.hash_read_mode,
+                                                              OMG.hash_io_policy, OMG.hash_rate_limit)
+            OMG.hash_stats.add(1, nbytes, seconds)
+        if OMG.fixity_cache is not None and identity is not None:
+            OMG.fixity_cache.store(file_path, hash_values, identity)
+        return hash_values
+
+    def queue_fixity(self, file_paths: list) -> None:
+        """
+        Queues files for the hash pool, in the order they will be asked for. Files found in the fixity cache are set aside instead.
+        """
+        if self.hash_pool is None:
+            return
+        self.cached_fixity = {}
+        self.cache_identities = {}
+        run = []
+        for file_path in file_paths:
+            if self.fixity_cache is not None:
+                try:
+                    identity = FixityCache.identity(file_path)
+                except OSError:
+                    run.append(file_path)
+                    continue
+                cached = self.fixity_cache.lookup(file_path, self.hash_pool.algorithm, identity)
+                if cached is not None:
+                    self.cached_fixity[file_path] = cached
+                    continue
+                self.cache_identities[file_path] = identity
+            run.append(file_path)
+        self.hash_pool.prefetch(run)
+
+    def prefetch_fixity(self, paths: list) -> None:
+        """
+        Queues the run of files at the start of paths for hashing ahead of the walk, stopping at the first folder.
+        """
+        if self.hash_pool is None or self.hash_from_spread:
+            return
+        run = []
+        for path in paths:
+            if path.is_dir():
+                break
+            if self.journal is not None and self.journal.entry(path) is not None:
+                continue
+            if self.created_by_interrupted_run(path):
+                #Written by the interrupted run (a Zip), not content to hash.
+                continue
+            opex_absent = self.opex_pending(path)
+            if path.startswith(u'\\\\?\\'):
+                path = path.replace(u'\\\\?\\', "")
+            if path.endswith('.opex') or not opex_absent:
+                continue
+            if self.pax_fixity_flag is True and (path.endswith("pax.zip") or path.endswith(".pax")):
+                continue
+            run.append(path)
+        self.queue_fixity(run)
+
+    def add_walk_hook(self, hook) -> None:
+        """
+        Registers hook(event, folder_path, paths) to be called as the walk progresses, so other stages can pull work from it.
+
+        'scan': a folder has been listed; paths is its listing in walk order.
+        'files': a run of files is about to be processed; paths is the remainder of the listing from the first file.
+        'folder': a folder is complete and its Opex written; paths holds the Opex path, or is empty if none was written.
+
+        Hooks are called in the process doing the walk, and are not sent to subtree worker processes.
+        """
+        self.walk_hooks.append(hook)
+
+    def walk_event(self, event: str, folder_path: str, paths: list) -> None:
+        if event == 'files':
+            #Queues this run of files for hashing ahead of the walk, if using --jobs.
+            self.prefetch_fixity(paths)
+        for hook in self.walk_hooks:
+            hook(event, folder_path, paths)
+
+    def start_progress(self) -> None:
+        """Starts logging progress lines, and the pre-scan if set. Called once any subtree workers have started, as it starts threads."""
+        if self.progress is None or not self.progress_flag:
+            return
+        self.progress.by_bytes = bool(self.algorithm) and not self.hash_from_spread
+        self.progress.start(self.prescan if self.prescan_flag else None)
+
+    def stop_progress(self) -> None:
+        if self.progress is not None:
+            self.progress.stop()
+
+    def open_metrics(self) -> None:
+        if self.metrics_format is None:
+            return
+        if self.metrics_format not in METRICS_FORMATS:
+            logger.error(f'metrics_format must be one of {list(METRICS_FORMATS)}, got: {self.metrics_format}')
+            raise ValueError(f'metrics_format must be one of {list(METRICS_FORMATS)}, got: {self.metrics_format}')
+        metrics_path = define_output_file(self.output_path, self.root, self.METAFOLDER, self.meta_dir_flag, output_suffix = "_Metrics",
+                                          output_format = METRICS_FORMATS[self.metrics_format])
+        self.metrics_start = (time.perf_counter(), self.cpu_times())
+        self.metrics = RunMetrics(metrics_path, self.metrics_format, self.collect_metrics, interval = self.metrics_interval)
+
+    @staticmethod
+    def cpu_times() -> float:
+        """CPU time of this process and its children which have exited (subtree workers and hashing processes)."""
+        times = os.times()
+        return times.user + times.system + times.children_user + times.children_system
+
+    def collect_metrics(self, complete: bool = False) -> dict:
+        """The metrics document for --metrics, see RunMetrics. Can be called from the metrics thread during the run."""
+        wall_start, cpu_start = self.metrics_start
+        counts = self.progress.totals_so_far()
+        stages = self.profiler.as_dict()
+        fixity_cache = self.fixity_cache
+        cache_hits = self.fixity_cache_hits + (fixity_cache.hits if fixity_cache is not None else 0)
+        cache_misses = self.fixity_cache_misses + (fixity_cache.misses if fixity_cache is not None else 0)
+        incremental = dict(self.incremental_counts)
+        compared = incremental['regenerated'] + incremental['skipped']
+        try:
+            version = importlib.metadata.version("opex_manifest_generator")
+        except importlib.metadata.PackageNotFoundError:
+            version = None
+        return {'root': self.root,
+                'version': version,
+                'started': self.start_time.isoformat(timespec = 'seconds'),
+                'timestamp': time.time(),
+                'complete': complete,
+                'wall_seconds': time.perf_counter() - wall_start,
+                'cpu_seconds': self.cpu_times() - cpu_start,
+                'entries': {'counts': {'folder': counts['folders'], 'file': counts['files']}, 'bytes': counts['bytes']},
+                #Each File is read once for every algorithm, so each algorithm hashes the same bytes.
+                'hashing': {'files': counts['hashed_files'],
+                            'bytes_by_algorithm': {algorithm_type: counts['hashed_bytes'] for algorithm_type in self.algorithm or []},
+                            'seconds': self.hash_stats.seconds},
+                'opexes': {'written': counts['written'], 'bytes': counts['opex_bytes']},
+                'zips': {'written': counts['zips'], 'bytes': counts['zip_bytes']},
+                'lookups': stages.get('lookup', {}).get('count', 0),
+                'fixity_cache': {'hits': cache_hits, 'misses': cache_misses,
+                                 'hit_ratio': cache_hits / (cache_hits + cache_misses) if cache_hits + cache_misses else None},
+                'incremental': {'counts': incremental, 'skip_ratio': incremental['skipped'] / compared if compared else None} if self.incremental_flag else None,
+                'stages': {stage: {'count': totals['count'], 'wall_seconds': totals['seconds'], 'cpu_seconds': totals['cpu_seconds']}
+                           for stage, totals in stages.items()}}
+
+    def add_written(self, opex_path: str) -> None:
+        """Counts a Folder Opex written during the walk, for --progress and --metrics."""
+        if self.progress is not None:
+            self.progress.add(written = 1, opex_bytes = os.path.getsize(opex_path))
+
+    def add_progress(self, **counts: int) -> None:
+        """Adds to the --progress counts; does nothing when not reporting progress."""
+        progress = getattr(self, 'OMG', self).progress
+        if progress is not None:
+            progress.add(**counts)
+
+    def prescan(self, stop_event = None) -> Optional[dict]:
+        """
+        Counts the Folders, Files and bytes the walk will visit, listing each folder as the walk does. Returns None if stop_event is set first.
+        """
+        totals = {'folders': 0, 'files': 0, 'bytes': 0}
+        stack = [self.root]
+        while stack:
+            if stop_event is not None and stop_event.is_set():
+                return None
+            folder_path = stack.pop()
+            totals['folders'] += 1
+            #The walk doesn't descend below a PAX Folder when using PAX Fixity.
+            descend = not (self.algorithm and self.pax_fixity_flag is True and folder_path.endswith(".pax"))
+            for f_path in self.list_directory(folder_path, sort_key = str):
+                if f_path.endswith('.opex'):
+                    continue
+                if f_path.is_dir():
+                    if descend:
+                        stack.append(f_path)
+                elif f_path.is_file():
+                    totals['files'] += 1
+                    totals['bytes'] += f_path.size
+        return totals
+
+    def timed(self, stage: str, entry: Optional[str] = None):
+        """Times a stage of the run for the --profile report, see StageProfiler; does nothing when not profiling."""
+        return stage_timer(getattr(self, 'OMG', self).profiler, stage, entry)
+
     def generate_pax_zip_opex_fixity(self, file_path: str, algorithm: Optional[list] = None) -> list:
         """Generate fixities for files inside a pax/zip. If algorithm is None, defaults to ['SHA-1']."""
+        fixities = self.pax_zip_fixities(file_path, algorithm)
+        add_fixity_elements(self.fixities, self.opexns, fixities)
+        return fixity_lines(file_path, fixities)
+
+    def pax_zip_fixities(self, file_path: str, algorithm: Optional[list] = None) -> list:
+        """Returns (algorithm, hash, member) for each file inside a pax/zip. If algorithm is None, defaults to ['SHA-1']."""
         algorithm = algorithm or ['SHA-1']
-        list_fixity = []
-        for algorithm_type in algorithm:
-            with zipfile.ZipFile(file_path, 'r') as z:
-                for file in z.filelist:
-                    self.fixity = ET.SubElement(self.fixities, f"{{{self.opexns}}}Fixity")
-                    hash_value = HashGenerator(algorithm = algorithm_type).hash_generator_pax_zip(file.filename, z)
-                    file_replace = file.filename.replace('\\', '/')
-                    self.fixity.set("path", file_replace)
-                    self.fixity.set("type", algorithm_type)
-                    self.fixity.set("value", hash_value)
-                    list_fixity.append([algorithm_type, hash_value, f"{file_path}/{file.filename}"])
-        return list_fixity
+        OMG = getattr(self, 'OMG', self)
+        # Read each member once for all algorithms, then emit algorithm by algorithm as before.
+        with OMG.timed('hash', file_path):
+            member_hashes = hash_pax_zip(file_path, algorithm, buffer = OMG.hash_buffer, jobs = OMG.jobs,
+                                         rate_limit = OMG.hash_rate_limit, stats = OMG.hash_stats,
+                                         read_mode = OMG.hash_read_mode, io_policy = OMG.hash_io_policy)
+        return [(algorithm_type, hash_values[algorithm_type], filename)
+                for algorithm_type in algorithm for filename, hash_values in member_hashes]
     
     def main(self) -> None:
-        if self.clear_opex_flag:
+        """
+        Runs the generator. Profiling reports (--profile, --cprofile) and metrics (--metrics) are written to the meta directory, even if the run fails.
+        """
+        self.open_metrics()
+        profile = cProfile.Profile() if self.cprofile_flag else None
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        completed = False
+        try:
+            self.generate()
+            completed = True
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.write_cprofile(profile)
+            if self.profile_flag:
+                self.write_profile(time.perf_counter() - start)
+            if self.metrics is not None:
+                self.metrics.stop()
+                self.metrics.write(complete = completed)
+
+    def write_profile(self, wall_seconds: float) -> dict:
+        json_path = define_output_file(self.output_path, self.root, self.METAFOLDER, self.meta_dir_flag, output_suffix = "_Profile", output_format = "json")
+        text_path = define_output_file(self.output_path, self.root, self.METAFOLDER, self.meta_dir_flag, output_suffix = "_Profile", output_format = "txt")
+        return self.profiler.write(json_path, text_path, wall_seconds, self.hash_stats.as_dict() if self.algorithm else None)
+
+    def write_cprofile(self, profile: cProfile.Profile) -> None:
+        """Dumps the cProfile stats of the main process, for pstats or snakeviz; subtree workers and writer threads aren't included."""
+        cprofile_path = define_output_file(self.output_path, self.root, self.METAFOLDER, self.meta_dir_flag, output_suffix = "_Profile", output_format = "prof")
+        try:
+            profile.dump_stats(cprofile_path)
+        except OSError as e:
+            logger.exception(f'Failed to write cProfile dump: {e}')
+            raise
+        logger.info(f'cProfile dump saved to: {cprofile_path}')
+
+    def generate(self) -> None:
+        self.open_journal()
+        if self.clear_opex_flag and self.resume_started is not None:
+            logger.info('Resuming an interrupted run, so keeping its Opexes rather than clearing them.')
+        elif self.clear_opex_flag:
             self.clear_opex()
             if self.autoref_flag or self.algorithm or self.input or self.zip_flag or self.export_flag or self.empty_flag or self.removal_flag:
                 pass
@@ -730,26 +1650,78 @@ class OpexManifestGenerator():
                 raise SystemExit()
         if self.empty_flag:
             logger.debug('Removing empty directories as per empty flag.')
+            from auto_reference_generator import ReferenceGenerator
             ReferenceGenerator(self.root, self.output_path, meta_dir_flag = self.meta_dir_flag).remove_empty_directories(self.empty_export_flag)
         df_flag = False
         if not self.autoref_flag in {"g", "generic"}:
             logger.debug('Auto Reference flag not set to generic, checking for Dataframe requirement.')
-            df_flag = self.init_df()
+            with self.timed('dataframe'):
+                df_flag = self.init_df()
         self.count = 1
         if self.metadata_flag is not None:
             if not df_flag:
                 logger.error('Metadata generation requires Auto Reference or Input file to be specified.')
                 raise ValueError('Metadata generation requires Auto Reference or Input file to be specified.')
             self.init_generate_descriptive_metadata()
-        OpexDir(self, self.root).generate_opex_dirs(self.root)
+        self.define_exports()
+        self.define_snapshot()
+        subtree_pool = None
+        if self.processes and self.processes > 1:
+            subtrees = [f_path for f_path in self.partition_subtrees() if self.journal is None or not self.journal.covers(f_path)]
+            # Workers without a subtree don't hash, so the rate is only shared with as many workers as there are subtrees.
+            self.rate_participants = min(self.processes, len(subtrees)) + 1 if subtrees else 1
+            subtree_pool = ProcessPoolExecutor(max_workers = self.processes, initializer = init_subtree_worker, initargs = (self,))
+            self.subtree_futures = {f_path: subtree_pool.submit(generate_subtree, f_path) for f_path in subtrees}
+            logger.info(f'Split root into {len(self.subtree_futures)} sub-folders across {self.processes} processes')
+            # The parent hashes the root's own files alongside the workers, so takes its share of the rate too;
+            # only once the workers have started, as they take their share from the full rate.
+            if self.hash_rate_limit:
+                self.hash_rate_limit = self.hash_rate_limit / self.rate_participants
+        # Exports are opened once any subtree workers have started, so workers never inherit open export files.
+        self.open_exports()
+        self.open_snapshot()
+        self.begin_journal()
+        self.open_fixity_cache()
+        self.start_hash_pool()
+        self.start_opex_writer()
+        self.start_progress()
+        if self.metrics is not None:
+            self.metrics.start()
+        walk_start = time.perf_counter()
+        completed = False
+        try:
+            OpexDir(self, self.root).generate_opex_dirs(self.root)
+            completed = True
+        finally:
+            try:
+                self.stop_opex_writer()
+            except Exception:
+                #Raised already if it stopped the walk; otherwise the walk's own error is the one to raise.
+                if completed:
+                    raise
+            self.stop_hash_pool()
+            self.close_fixity_cache()
+            if subtree_pool is not None:
+                subtree_pool.shutdown(wait = True, cancel_futures = True)
+                self.subtree_futures = {}
+            self.stop_progress()
+            # Closed even if the walk fails, keeping everything written so far; the journal is only kept if it failed.
+            self.close_exports()
+            self.close_journal(remove = completed)
+            # Entries no longer in the tree are only forgotten once the whole tree has been compared.
+            self.close_snapshot(forget_stale = completed)
+        if self.incremental_flag:
+            counts = self.incremental_counts
+            logger.info(f'Incremental: {counts["regenerated"]} entries regenerated, {counts["skipped"]} unchanged entries skipped, '
+                        f'{counts["orphans"]} orphaned Opexes removed')
         if self.algorithm:
-            output_path = define_output_file(self.output_path, self.root, self.METAFOLDER, self.meta_dir_flag, output_suffix = self.FIXITY_SUFFIX, output_format = "txt")
-            if self.fixity_export_flag:
-                export_list_txt(self.list_fixity, output_path)
+            logger.info(f'Fixities generated for {len(self.list_fixity)} entries')
+            if self.fixity_cache_flag and not self.hash_from_spread:
+                logger.info(f'Fixity cache: {self.fixity_cache_hits} hits, {self.fixity_cache_misses} misses')
+            if not self.hash_from_spread:
+                logger.info(self.hash_stats.summary(time.perf_counter() - walk_start))
         if self.removal_flag:
-            output_path = define_output_file(self.output_path, self.root, self.METAFOLDER, self.meta_dir_flag, output_suffix = self.REMOVALS_SUFFIX, output_format = "txt")
-            if self.removal_export_flag:
-                export_list_txt(self.removal_list, output_path)
+            logger.info(f'Removed {len(self.removal_list)} files and folders')
 
 class OpexDir(OpexManifestGenerator):
     def __init__(self, OMG: OpexManifestGenerator, folder_path: str, title: str = None, description: str = None, security: str = None) -> None:
@@ -768,7 +1740,7 @@ class OpexDir(OpexManifestGenerator):
                 self.OMG.title_flag,
                 self.OMG.description_flag,
                 self.OMG.security_flag]):
-                index = self.OMG.index_df_lookup(self.folder_path)
+                index = self.OMG.record_lookup(self.folder_path)
         elif self.OMG.autoref_flag in {None, "g","generic"}:
             index = None
         else:
@@ -817,7 +1789,8 @@ class OpexDir(OpexManifestGenerator):
             self.fixities = ET.SubElement(self.transfer, f"{{{self.opexns}}}Fixities")
             tmp_list_fixity,tmp_list_path = self.OMG.generate_pax_folder_opex_fixity(self.folder_path, self.fixities, self.files, self.OMG.algorithm)
             self.OMG.list_fixity.extend(tmp_list_fixity)
-            self.OMG.list_path.extend(tmp_list_path)
+            if self.OMG.keep_path_list:
+                self.OMG.list_path.extend(tmp_list_path)
         if self.OMG.autoref_flag or self.OMG.input:
             self.OMG.generate_opex_properties(self.xmlroot, index, 
                                               title = self.title,
@@ -825,103 +1798,248 @@ class OpexDir(OpexManifestGenerator):
                                               security = self.security)
             if self.OMG.metadata_flag is not None:
                 self.xml_descmeta = ET.SubElement(self.xmlroot,f"{{{self.opexns}}}DescriptiveMetadata")
-                self.OMG.generate_descriptive_metadata(self.xml_descmeta, idx = index)
+                with self.OMG.timed('metadata', self.folder_path):
+                    self.OMG.generate_descriptive_metadata(self.xml_descmeta, idx = index)
 
     def filter_directories(self, directory: str, sort_key: str = str.casefold) -> list:
-        try:
-            if self.OMG.hidden_flag is False:
-                list_directories = sorted([win_256_check(os.path.join(directory, f.name)) for f in os.scandir(directory)
-                                        if not f.name.startswith('.')
-                                        and filter_win_hidden(win_256_check(os.path.join(directory, f.name))) is False
-                                        and not f.name in ('opex_generate.exe','opex_generate.bin') 
-                                        and f.name != self.OMG.METAFOLDER
-                                        and f.name != os.path.basename(__file__)],
-                                        key=sort_key)
-            elif self.OMG.hidden_flag is True:
-                list_directories = sorted([win_256_check(os.path.join(directory, f.name)) for f in os.scandir(directory) \
-                                        if f.name != self.OMG.METAFOLDER
-                                        and not f.name in ('opex_generate.exe','opex_generate.bin') 
-                                        and f.name != os.path.basename(__file__)],
-                                        key=sort_key)
-            return list_directories
-        except Exception as e:
-            logger.exception(f'Failed to Filter Directories: {e}')
-            raise
-        
-    def generate_opex_dirs(self, path: str) -> None:
+        with self.OMG.timed('scan', directory):
+            listing = self.OMG.list_directory(directory, sort_key = sort_key)
+        self.OMG.add_progress(folders = 1)
+        return listing
+
+    def generate_opex_dirs(self, path: str) -> Optional[str]:
         """"
-        This function loops recursively through a given directory.
-        
+        This function loops through a given directory, depth first.
+
         There are two loops to first generate Opexes for Files; Then Generate the Folder Opex Manifests.
-        """    
-        current = OpexDir(self.OMG, path)
-        if current.OMG.algorithm and current.OMG.pax_fixity_flag is True and current.folder_path.endswith(".pax"):
-            opex_path = os.path.abspath(current.folder_path)
+        Folders are held on an explicit stack rather than by recursion, so deep trees can't exhaust the call stack,
+        and each folder's Opex is written, and its tree released, as soon as everything below it is complete.
+
+        Returns the path of the folder's Opex, if one was written.
+        """
+        record = self.OMG.resume_entry(path)
+        if record is not None:
+            #Completed by an interrupted run: nothing below it needs scanning again.
+            return record.get('opex')
+        stack = [self.open_folder(path)]
+        folder_opex = None
+        while stack:
+            current = stack[-1]
+            f_path = current.next_folder()
+            if f_path is not None:
+                #Descend into the next Folder.
+                stack.append(current.open_folder(f_path))
+                continue
+            with current.OMG.timed('folder', current.scan_path):
+                folder_opex = current.write_manifest()
+            current.OMG.checkpoint('folder', current.scan_path, digest = current.snapshot_digest, opex = folder_opex)
+            stack.pop()
+            if stack:
+                stack[-1].add_folder_opex(current.scan_path, folder_opex)
+        return folder_opex
+
+    def open_folder(self, path: str) -> "OpexDir":
+        folder = OpexDir(self.OMG, path)
+        #Journals anything the Folder added to the exports itself (PAX Fixities, Removals), ahead of its contents.
+        self.OMG.checkpoint('open', path)
+        return folder.scan_folder(path)
+
+    def scan_folder(self, path: str) -> "OpexDir":
+        """
+        Lists the folder once: the second loop reuses the first listing, updated with the files the first loop created or removed.
+        """
+        self.scan_path = path
+        self.position = 0
+        self.prefetched = False
+        self.list_directories = []
+        self.manifest_files = {}
+        self.created_by_run = set()
+        self.changed = False
+        self.snapshot_digest = None
+        self.folder_names = []
+        if self.OMG.algorithm and self.OMG.pax_fixity_flag is True and self.folder_path.endswith(".pax"):
+            self.opex_path = os.path.abspath(self.folder_path)
         else:
-            opex_path = os.path.join(os.path.abspath(current.folder_path), os.path.basename(current.folder_path))
-        #First Loop to Generate Folder Manifest Opexes & Individual File Opexes.
-        if current.removal is True:
+            self.opex_path = os.path.join(os.path.abspath(self.folder_path), os.path.basename(self.folder_path))
+        if self.removal is True:
             #If removal is True for Folder, then it will be removed - Does not need to descend.
-            pass
-        else:
-            for f_path in current.filter_directories(path):
-                if f_path.endswith('.opex'):
-                    #Ignores OPEX files / directories...
+            return self
+        self.list_directories = self.filter_directories(path)
+        if self.OMG.snapshot is not None:
+            self.list_directories = self.OMG.remove_orphans(path, self.list_directories)
+        self.manifest_files = {f_path: f_path for f_path in self.list_directories if f_path.is_file()}
+        self.OMG.walk_event('scan', self.folder_path, self.list_directories)
+        return self
+
+    def next_folder(self) -> Optional[str]:
+        """
+        First Loop to Generate Folder Manifest Opexes & Individual File Opexes.
+
+        Processes the listing up to the next folder to descend into and returns it, or returns None once the listing is complete.
+        """
+        while self.position < len(self.list_directories):
+            i = self.position
+            f_path = self.list_directories[i]
+            self.position += 1
+            if f_path.endswith('.opex'):
+                #Ignores OPEX files / directories...
+                pass
+            elif f_path.is_dir():
+                self.prefetched = False
+                if self.ignore is True or \
+                (self.OMG.removal_flag is True and \
+                 self.OMG.removal_df_lookup(self.OMG.record_lookup(f_path)) is True):
+                    #If Ignore is True, or the Folder below is marked for Removal: Don't add to Opex 
                     pass
-                elif os.path.isdir(f_path):
-                    if current.ignore is True or \
-                    (current.OMG.removal_flag is True and \
-                     current.OMG.removal_df_lookup(current.OMG.index_df_lookup(f_path)) is True):
-                        #If Ignore is True, or the Folder below is marked for Removal: Don't add to Opex 
-                        pass
-                    else:
-                        #Add Folder to OPEX Manifest (doesn't get written yet...)
-                        current.folder = ET.SubElement(self.folders, f"{{{self.opexns}}}Folder")
-                        current.folder.text = str(os.path.basename(f_path))
-                    if current.OMG.algorithm and current.OMG.pax_fixity_flag is True and current.folder_path.endswith(".pax"):
-                        #If using fixity, but the current folder is a PAX & using PAX Fixity: End descent. 
-                        pass
-                    else:
-                        #Recurse Descent.
-                        current.generate_opex_dirs(f_path)
-                elif os.path.isfile(f_path):
-                    #Processes OPEXes for individual Files: this gets written.
-                    OpexFile(current.OMG, f_path)
                 else:
-                    logger.warning(f'Unknown File Type at: {f_path}')
+                    #Add Folder to OPEX Manifest (doesn't get written yet...)
+                    self.folder_names.append(str(os.path.basename(f_path)))
+                if self.OMG.algorithm and self.OMG.pax_fixity_flag is True and self.folder_path.endswith(".pax"):
+                    #If using fixity, but the current folder is a PAX & using PAX Fixity: End descent. 
                     pass
-        #Second Loop to add previously generated Opexes to Folder Manifest.
-        if current.removal is True or current.ignore is True:
-            logger.debug(f'Skipping Opex generation for: {current.folder_path}')
+                elif f_path in self.OMG.subtree_futures:
+                    #Generated by a subtree worker process: wait for it, then merge its lists in walk order.
+                    result = self.OMG.subtree_futures.pop(f_path).result()
+                    self.OMG.merge_subtree(result)
+                    self.OMG.checkpoint('folder', f_path, opex = result.get('opex_path'))
+                    self.add_folder_opex(f_path, result.get('opex_path'))
+                else:
+                    record = self.OMG.resume_entry(f_path)
+                    if record is None:
+                        return f_path
+                    #Completed by an interrupted run: replayed rather than descended into.
+                    self.add_folder_opex(f_path, record.get('opex'))
+            elif f_path in self.created_by_run:
+                #Created alongside an earlier File by the interrupted run (e.g. its Zip), so already in the Manifest.
+                pass
+            elif f_path.is_file():
+                if self.OMG.progress is not None:
+                    #Sized before it's processed, as zipping can remove it.
+                    self.OMG.progress.add(files = 1, bytes = f_path.size)
+                if not self.prefetched:
+                    self.OMG.walk_event('files', self.folder_path, self.list_directories[i:])
+                    self.prefetched = True
+                record = self.OMG.resume_entry(f_path)
+                if record is None and self.OMG.zip_file_removal and f_path.endswith('.zip'):
+                    #The interrupted run zipped then removed the File, so it's replayed in the Zip's place.
+                    record = self.OMG.resume_entry(f_path[:-len('.zip')])
+                if record is not None:
+                    created_paths, removed_paths = record.get('created', []), record.get('removed', [])
+                else:
+                    identity = self.OMG.snapshot_identity(f_path)
+                    unchanged_fixity = self.OMG.unchanged_fixity(f_path, identity)
+                    if unchanged_fixity is not None:
+                        #Unchanged since the last incremental run: its Opex is kept and its Fixities taken from the snapshot.
+                        self.OMG.list_fixity.extend(unchanged_fixity)
+                        if self.OMG.keep_path_list and unchanged_fixity:
+                            self.OMG.list_path.append(f_path.replace(u'\\\\?\\', ""))
+                        self.OMG.incremental_counts['skipped'] += 1
+                        created_paths, removed_paths = [], []
+                    else:
+                        #Processes OPEXes for individual Files: this gets written.
+                        with self.OMG.timed('file', f_path):
+                            opex_file = OpexFile(self.OMG, f_path)
+                        created_paths, removed_paths = opex_file.created_paths, opex_file.removed_paths
+                        if self.OMG.snapshot is not None:
+                            self.OMG.incremental_counts['regenerated'] += 1
+                    self.OMG.checkpoint('file', f_path, identity = identity, created = created_paths, removed = removed_paths)
+                for created_path in created_paths:
+                    created_path = win_256_check(os.path.join(self.scan_path, os.path.basename(created_path)))
+                    self.manifest_files.setdefault(created_path, None)
+                    if record is not None or written_since(created_path, self.OMG.resume_started):
+                        self.created_by_run.add(created_path)
+                for removed_path in removed_paths:
+                    self.manifest_files.pop(win_256_check(os.path.join(self.scan_path, os.path.basename(removed_path))), None)
+            else:
+                logger.warning(f'Unknown File Type at: {f_path}')
+                pass
+        return None
+
+    def add_folder_opex(self, f_path: str, folder_opex: Optional[str]) -> None:
+        """Called once a folder below is complete."""
+        if folder_opex is not None:
+            #In incremental mode, a Folder is rewritten whenever a Folder below it was.
+            self.changed = True
+        if folder_opex is not None and self.OMG.algorithm and self.OMG.pax_fixity_flag is True and f_path.endswith(".pax"):
+            #PAX Folder Opexes are written alongside the folder, so belong in this Manifest.
+            self.manifest_files.setdefault(win_256_check(os.path.join(self.scan_path, os.path.basename(folder_opex))), None)
+
+    def write_manifest(self) -> Optional[str]:
+        """
+        Second Loop to add previously generated Opexes to Folder Manifest, then write the Folder's Opex.
+
+        Returns the path of the Opex, if one was written.
+        """
+        opex_path = None
+        #Everything below the Folder is written before its own Opex.
+        self.OMG.writer_barrier()
+        if self.removal is True or self.ignore is True:
+            logger.debug(f'Skipping Opex generation for: {self.folder_path}')
             pass
         else:
-            if check_opex(opex_path):
-                #Only processing Opexes.
-                for f_path in current.filter_directories(path):
-                    if os.path.isfile(f_path):
-                        file = ET.SubElement(current.files, f"{{{current.opexns}}}File")
-                        if f_path.endswith('.opex'):
-                            file.set("type", "metadata")
-                        else:
-                            file.set("type", "content")
-                            file.set("size", str(os.path.getsize(f_path)))
-                        file.text = str(os.path.basename(f_path))
-                        logger.debug(f'Adding File to Opex Manifest: {f_path}')
-                #Writes Folder OPEX 
-                write_opex(opex_path, current.xmlroot)
+            own_opex = win_256_check(os.path.join(self.scan_path, os.path.basename(self.opex_path) + ".opex"))
+            #When resuming, an Opex left by the interrupted run is replaced, unless it belongs to a File of the same name.
+            #In incremental mode, the Manifest is always built, to compare with the snapshot.
+            if self.OMG.snapshot is not None or check_opex(self.opex_path) \
+            or (own_opex not in self.created_by_run and written_since(own_opex, self.OMG.resume_started)):
+                self.manifest_files.pop(own_opex, None)
+                #Only processing Opexes. Entries are streamed into the Manifest as it's written, rather than added to the tree.
+                file_entries = []
+                for f_path in sorted(self.manifest_files, key=str.casefold):
+                    if f_path.endswith('.opex'):
+                        file_entries.append((str(os.path.basename(f_path)), "metadata", None))
+                    else:
+                        scanned = self.manifest_files[f_path]
+                        file_entries.append((str(os.path.basename(f_path)), "content", scanned.size if scanned is not None else os.path.getsize(f_path)))
+                    logger.debug(f'Adding File to Opex Manifest: {f_path}')
+                if self.OMG.snapshot is None:
+                    #Writes Folder OPEX 
+                    with self.OMG.timed('write', self.opex_path):
+                        opex_path = write_opex(self.opex_path, self.xmlroot, self.manifest_chunks(file_entries))
+                    self.OMG.add_written(opex_path)
+                else:
+                    #Only rewritten if its Manifest (or anything else in it) changed, or a Folder below was rewritten.
+                    digest = hashlib.sha1()
+                    for chunk in self.manifest_chunks(file_entries):
+                        digest.update(chunk)
+                    digest = digest.hexdigest()
+                    if self.changed or check_opex(self.opex_path) or self.OMG.snapshot.folder_digest(str(self.scan_path)) != digest:
+                        with self.OMG.timed('write', self.opex_path):
+                            opex_path = write_opex(self.opex_path, self.xmlroot, self.manifest_chunks(file_entries))
+                        self.OMG.add_written(opex_path)
+                        self.OMG.incremental_counts['regenerated'] += 1
+                    else:
+                        logger.debug(f'Unchanged since the last incremental run: {self.opex_path}')
+                        self.OMG.incremental_counts['skipped'] += 1
+                    self.snapshot_digest = digest
             else:
                 #Avoids Override if exists, lets you continue where left off. 
-                logger.info(f"Avoiding override, Opex exists at: {opex_path}")
+                logger.info(f"Avoiding override, Opex exists at: {self.opex_path}")
+        #Release the Folder's tree and listing now it's written; any element left referenced would keep the whole tree alive.
+        for attr in ('xmlroot', 'transfer', 'manifest', 'folders', 'files', 'fixities', 'xml_descmeta'):
+            self.__dict__.pop(attr, None)
+        self.list_directories = []
+        self.folder_names = []
+        self.manifest_files = {}
+        self.OMG.walk_event('folder', self.folder_path, [opex_path] if opex_path is not None else [])
+        return opex_path
+
+    def manifest_chunks(self, file_entries: list) -> Iterator[bytes]:
+        """Serialises the Folder Opex in chunks, streaming the Manifest entries. See common.manifest_chunks."""
+        return manifest_chunks(self.xmlroot, self.folders, self.files, self.folder_names, file_entries, pretty_print = self.OMG.pretty_print)
 
 class OpexFile(OpexManifestGenerator):
     def __init__(self, OMG: OpexManifestGenerator, file_path: str, title: str = None, description: str = None, security: str = None) -> None:
         self.OMG = OMG
-        self.opexns = self.OMG.opexns  
+        self.opexns = self.OMG.opexns
         if file_path.startswith(u'\\\\?\\'):
             self.file_path = file_path.replace(u'\\\\?\\', "")
         else:
             self.file_path = file_path
-        if check_opex(self.file_path):
+        # Files written or deleted alongside this one, so the folder manifest can be updated without rescanning.
+        self.created_paths = []
+        self.removed_paths = []
+        if self.OMG.opex_pending(file_path):
             index = None
             if any([self.OMG.input,
                     self.OMG.autoref_flag in {"c","catalog","a","accession","b","both","cg","catalog-generic","ag","accession-generic","bg","both-generic"},
@@ -931,7 +2049,7 @@ class OpexFile(OpexManifestGenerator):
                     self.OMG.title_flag,
                     self.OMG.description_flag,
                     self.OMG.security_flag]):
-                    index = self.OMG.index_df_lookup(self.file_path)
+                    index = self.OMG.record_lookup(self.file_path)
             elif self.OMG.autoref_flag is None or self.OMG.autoref_flag in {"g","generic"}:
                 index = None
             self.ignore = False
@@ -963,42 +2081,134 @@ class OpexFile(OpexManifestGenerator):
                 self.title = title
                 self.description = description
                 self.security = security
-            opex_path = None
+            chunks = None
             if self.OMG.algorithm or self.OMG.autoref_flag or self.OMG.input:
-                self.xmlroot = ET.Element(f"{{{self.opexns}}}OPEXMetadata", nsmap={"opex":self.opexns})
-                self.transfer = ET.SubElement(self.xmlroot, f"{{{self.opexns}}}Transfer")
+                #Common Opex contents are rendered straight to bytes, without building a tree.
+                opex = FileOpex(self.opexns)
                 if self.OMG.sourceid_flag:
-                    self.OMG.sourceid_df_lookup(self.transfer, index)
+                    opex.source_id = self.OMG.sourceid_value(index)
                 if self.OMG.algorithm:
-                    self.fixities = ET.SubElement(self.transfer, f"{{{self.opexns}}}Fixities")
                     if self.OMG.hash_from_spread:
-                        self.OMG.hash_df_lookup(self.fixities, index)  
+                        opex.fixities, tmp_list_fixity = self.OMG.hash_df_fixities(index)
                     else:
-                        self.OMG.list_path.append(self.file_path)
+                        if self.OMG.keep_path_list:
+                            self.OMG.list_path.append(self.file_path)
                         if self.OMG.pax_fixity_flag is True and (self.file_path.endswith("pax.zip") or self.file_path.endswith(".pax")):
-                            tmp_list_fixity = self.generate_pax_zip_opex_fixity(self.file_path, self.OMG.algorithm)
+                            opex.fixities = self.OMG.pax_zip_fixities(self.file_path, self.OMG.algorithm)
                         else:
-                            tmp_list_fixity = self.generate_opex_fixity(self.file_path, self.OMG.algorithm)
-                        self.OMG.list_fixity.extend(tmp_list_fixity)
-                if self.transfer is None:
-                    self.xmlroot.remove(self.transfer)
+                            opex.fixities = self.OMG.file_fixities(self.file_path, self.OMG.algorithm)
+                        tmp_list_fixity = fixity_lines(self.file_path, opex.fixities)
+                    self.OMG.list_fixity.extend(tmp_list_fixity)
                 if self.OMG.autoref_flag or self.OMG.input:
-                    self.OMG.generate_opex_properties(self.xmlroot, index,
-                                                      title = self.title,
-                                                      description = self.description,
-                                                      security = self.security)
-                    if self.OMG.metadata_flag is not None:
-                        self.xml_descmeta = ET.SubElement(self.xmlroot, f"{{{self.opexns}}}DescriptiveMetadata")
+                    opex.set_properties(title = self.title,
+                                        description = self.description,
+                                        security = self.security,
+                                        identifiers = self.OMG.identifier_values(index) if self.OMG.has_identifiers() else None)
+                if (self.OMG.autoref_flag or self.OMG.input) and self.OMG.metadata_flag is not None:
+                    #Descriptive Metadata is added to the tree, which is written as before.
+                    self.xmlroot = opex.to_element()
+                    self.xml_descmeta = ET.SubElement(self.xmlroot, f"{{{self.opexns}}}DescriptiveMetadata")
+                    with self.OMG.timed('metadata', self.file_path):
                         self.OMG.generate_descriptive_metadata(self.xml_descmeta, index)
-                opex_path = write_opex(self.file_path, self.xmlroot)
+                    with self.OMG.timed('serialize', self.file_path):
+                        chunks = [opex_bytes(self.xmlroot, pretty_print = self.OMG.pretty_print)]
+                else:
+                    with self.OMG.timed('serialize', self.file_path):
+                        chunks = [opex.render(pretty_print = self.OMG.pretty_print)]
+                self.created_paths.append(win_256_check(self.file_path + ".opex"))
                 # Zip cannot be activated unless another flag - which 
             if self.OMG.zip_flag:
-                zip_opex(self.file_path, opex_path)
+                self.created_paths.append(f"{self.file_path}.zip")
                 if self.OMG.zip_file_removal:
-                    os.remove(self.file_path)
-                    if os.path.exists(opex_path):
-                        os.remove(opex_path)
-                        logger.debug(f'Removed file: {opex_path}')
-                    logger.debug(f'Removed file: {self.file_path}')
+                    self.removed_paths.append(self.file_path)
+                    if chunks is not None:
+                        self.removed_paths.append(win_256_check(self.file_path + ".opex"))
+            #The Opex is serialised here; writing it (and zipping) can be left to the writer threads.
+            self.OMG.submit_write(write_file_opex, self.file_path, chunks, self.OMG.zip_flag, self.OMG.zip_file_removal,
+                                  self.OMG.profiler, self.OMG.progress)
         else:
-            logger.info(f"Avoiding override, Opex exists at: {self.file_path}: ")
\ No newline at end of file
+            logger.info(f"Avoiding override, Opex exists at: {self.file_path}: ")
+
+def write_file_opex(file_path: str, chunks: Optional[list], zip_flag: bool = False, zip_file_removal: bool = False,
+                    profiler: Optional[StageProfiler] = None, progress: Optional[Progress] = None) -> None:
+    """Writes a File's Opex from its serialised chunks, then zips the File and Opex together if set, removing them if set."""
+    opex_path = None
+    if chunks is not None:
+        with stage_timer(profiler, 'write', file_path):
+            opex_path = write_opex(file_path, None, chunks)
+        if progress is not None:
+            progress.add(written = 1, opex_bytes = sum(len(chunk) for chunk in chunks))
+    if zip_flag:
+        with stage_timer(profiler, 'zip', file_path):
+            zip_path = zip_opex(file_path, opex_path)
+        if progress is not None:
+            progress.add(zips = 1, zip_bytes = os.path.getsize(zip_path))
+        if zip_file_removal:
+            os.remove(file_path)
+            if opex_path is not None and os.path.exists(opex_path):
+                os.remove(opex_path)
+                logger.debug(f'Removed file: {opex_path}')
+            logger.debug(f'Removed file: {file_path}')
+
+_subtree_omg = None
+
+def init_subtree_worker(OMG: OpexManifestGenerator) -> None:
+    """Receives the generator (including its dataframe) once per worker process."""
+    global _subtree_omg
+    _subtree_omg = OMG
+    _subtree_omg.processes = 1
+    # Each worker process has its own limiter, so takes an even share of the rate with the other active workers and the parent.
+    if _subtree_omg.hash_rate_limit:
+        _subtree_omg.hash_rate_limit = _subtree_omg.hash_rate_limit / _subtree_omg.rate_participants
+    if _subtree_omg.jobs_mode == "process":
+        _subtree_omg.jobs_mode = "thread"
+    if _subtree_omg.progress is not None:
+        _subtree_omg.progress.claim_row()
+
+def generate_subtree(folder_path: str) -> dict:
+    """
+    Generates the opexes for one subtree in a worker process.
+
+    Returns the part files holding the subtree's fixity and removal lists for the parent to merge, and the path of the subtree's Opex.
+    """
+    OMG = _subtree_omg
+    OMG.list_path = []
+    OMG.fixity_cache_hits = 0
+    OMG.fixity_cache_misses = 0
+    OMG.hash_stats = HashStats(progress = OMG.progress)
+    OMG.incremental_counts = {key: 0 for key in OMG.incremental_counts}
+    OMG.profiler = StageProfiler(detail = OMG.profile_flag) if OMG.profile_flag or OMG.metrics_format else None
+    OMG.open_part_exports()
+    OMG.open_snapshot()
+    if OMG.snapshot is not None:
+        #The parent journals the subtree from its part files, so the worker only captures lines for the snapshot.
+        OMG.list_fixity.start_capture()
+    OMG.open_fixity_cache()
+    OMG.start_hash_pool()
+    OMG.start_opex_writer()
+    try:
+        opex_path = OpexDir(OMG, OMG.root).generate_opex_dirs(folder_path)
+        OMG.stop_opex_writer()
+    except BaseException:
+        try:
+            OMG.stop_opex_writer()
+        except Exception:
+            pass
+        OMG.close_exports(discard = True)
+        raise
+    finally:
+        OMG.stop_hash_pool()
+        OMG.close_fixity_cache(evict = False)
+        OMG.close_snapshot()
+    OMG.close_exports()
+    return {'fixity_part': OMG.list_fixity.output_file,
+            'fixity_count': len(OMG.list_fixity),
+            'removal_part': OMG.removal_list.output_file if OMG.removal_flag else None,
+            'removal_count': len(OMG.removal_list) if OMG.removal_flag else 0,
+            'list_path': OMG.list_path,
+            'fixity_cache_hits': OMG.fixity_cache_hits,
+            'fixity_cache_misses': OMG.fixity_cache_misses,
+            'hash_stats': OMG.hash_stats.as_dict(),
+            'incremental_counts': OMG.incremental_counts,
+            'profile': OMG.profiler.as_dict() if OMG.profiler is not None else {},
+            'opex_path': opex_path}
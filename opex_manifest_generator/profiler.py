@@ -0,0 +1,170 @@
+"""
+Stage Profiler class for the --profile report.
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import math, heapq, json, threading, time, logging
+from contextlib import nullcontext
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Durations are counted in buckets an eighth of a power of two wide, from 1 microsecond, so percentiles are within about 9%.
+BUCKETS_PER_DOUBLING = 8
+SLOWEST_ENTRIES = 10
+
+STAGES = {'dataframe': 'building the Auto Reference Dataframe, or loading the input',
+          'scan': 'listing folders',
+          'lookup': 'spreadsheet lookups',
+          'hash': 'waiting for fixities (cache, hash pool or hashing in the walk)',
+          'metadata': 'descriptive metadata',
+          'serialize': 'serialising File Opexes',
+          'write': 'writing Opexes (Folder Opexes include serialising their Manifest)',
+          'zip': 'zipping Files and their Opexes',
+          'file': 'each File, in total',
+          'folder': 'each Folder\'s Manifest, in total (including waiting for the writer threads)'}
+
+class StageTimer():
+    """Times one entry of a stage, in wall and CPU time (of the thread running it), as a context manager."""
+    __slots__ = ('profiler', 'stage', 'entry', 'start', 'cpu_start')
+
+    def __init__(self, profiler: "StageProfiler", stage: str, entry: Optional[str] = None):
+        self.profiler = profiler
+        self.stage = stage
+        self.entry = entry
+
+    def __enter__(self) -> "StageTimer":
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.profiler.add(self.stage, time.perf_counter() - self.start, self.entry, time.thread_time() - self.cpu_start)
+
+NULL_TIMER = nullcontext()
+
+def stage_timer(profiler: Optional["StageProfiler"], stage: str, entry: Optional[str] = None):
+    """Returns a timer for the stage, or a context manager which does nothing when not profiling."""
+    if profiler is None:
+        return NULL_TIMER
+    return StageTimer(profiler, stage, entry)
+
+class StageProfiler():
+    """
+    Thread-safe timings of each stage of a run, for the --profile report and --metrics.
+
+    Each stage keeps a count, a wall and CPU total, a histogram of durations (for percentiles) and its slowest entries,
+    so memory doesn't grow with the number of entries and the timings of subtree workers can be merged.
+    Stages are nested (a File's total includes its hashing and writing), so totals overlap.
+
+    :param detail: set whether to keep the histogram and slowest entries, for the report; --metrics only needs the totals
+    """
+    def __init__(self, detail: bool = True):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.detail = detail
+
+    def _stage(self, stage: str) -> dict:
+        if stage not in self.stages:
+            self.stages[stage] = {'count': 0, 'seconds': 0.0, 'cpu_seconds': 0.0, 'max': 0.0, 'buckets': {}, 'slowest': []}
+        return self.stages[stage]
+
+    def add(self, stage: str, seconds: float, entry: Optional[str] = None, cpu_seconds: float = 0.0) -> None:
+        with self.lock:
+            totals = self._stage(stage)
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['cpu_seconds'] += cpu_seconds
+            totals['max'] = max(totals['max'], seconds)
+            if not self.detail:
+                return
+            bucket = max(0, int(math.log2(seconds * 1e6) * BUCKETS_PER_DOUBLING)) if seconds > 1e-6 else 0
+            totals['buckets'][bucket] = totals['buckets'].get(bucket, 0) + 1
+            if entry is not None:
+                if len(totals['slowest']) < SLOWEST_ENTRIES:
+                    heapq.heappush(totals['slowest'], (seconds, str(entry)))
+                elif seconds > totals['slowest'][0][0]:
+                    heapq.heapreplace(totals['slowest'], (seconds, str(entry)))
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {stage: dict(totals, buckets = dict(totals['buckets']), slowest = list(totals['slowest']))
+                    for stage, totals in self.stages.items()}
+
+    def merge(self, stages: dict) -> None:
+        """Adds the timings of a subtree worker, from its as_dict()."""
+        with self.lock:
+            for stage, other in stages.items():
+                totals = self._stage(stage)
+                totals['count'] += other['count']
+                totals['seconds'] += other['seconds']
+                totals['cpu_seconds'] += other.get('cpu_seconds', 0.0)
+                totals['max'] = max(totals['max'], other['max'])
+                for bucket, count in other['buckets'].items():
+                    totals['buckets'][int(bucket)] = totals['buckets'].get(int(bucket), 0) + count
+                for seconds, entry in other['slowest']:
+                    heapq.heappush(totals['slowest'], (seconds, entry))
+                    if len(totals['slowest']) > SLOWEST_ENTRIES:
+                        heapq.heappop(totals['slowest'])
+
+    @staticmethod
+    def percentile(buckets: dict, count: int, fraction: float) -> float:
+        """Returns the upper bound, in seconds, of the bucket holding the given fraction of durations."""
+        target = max(1, math.ceil(count * fraction))
+        seen = 0
+        for bucket in sorted(buckets):
+            seen += buckets[bucket]
+            if seen >= target:
+                return 2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING) / 1e6
+        return 0.0
+
+    def report(self, wall_seconds: float, hash_stats: Optional[dict] = None) -> dict:
+        stages = {}
+        order = list(STAGES)
+        timings = self.as_dict()
+        for stage in sorted(timings, key = lambda stage: order.index(stage) if stage in order else len(order)):
+            totals = timings[stage]
+            count = totals['count']
+            stages[stage] = {'description': STAGES.get(stage, stage),
+                             'count': count,
+                             'total_seconds': totals['seconds'],
+                             'cpu_seconds': totals['cpu_seconds'],
+                             'share_of_run': totals['seconds'] / wall_seconds if wall_seconds > 0 else None,
+                             'mean_ms': totals['seconds'] / count * 1000 if count else 0.0,
+                             'p50_ms': min(self.percentile(totals['buckets'], count, 0.5), totals['max']) * 1000,
+                             'p90_ms': min(self.percentile(totals['buckets'], count, 0.9), totals['max']) * 1000,
+                             'p99_ms': min(self.percentile(totals['buckets'], count, 0.99), totals['max']) * 1000,
+                             'max_ms': totals['max'] * 1000,
+                             'slowest': [{'entry': entry, 'ms': seconds * 1000} for seconds, entry in sorted(totals['slowest'], reverse = True)]}
+        return {'wall_seconds': wall_seconds, 'stages': stages, 'hashing': hash_stats}
+
+    def text_report(self, report: dict) -> str:
+        lines = [f"Run took {report['wall_seconds']:.3f}s. Stages are nested, so their totals overlap.", "",
+                 f"{'stage':<10} {'count':>9} {'total s':>10} {'cpu s':>10} {'% run':>7} {'mean ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for stage, row in report['stages'].items():
+            share = f"{row['share_of_run'] * 100:.1f}" if row['share_of_run'] is not None else "-"
+            lines.append(f"{stage:<10} {row['count']:>9} {row['total_seconds']:>10.3f} {row['cpu_seconds']:>10.3f} {share:>7} {row['mean_ms']:>9.3f} "
+                         f"{row['p50_ms']:>9.3f} {row['p90_ms']:>9.3f} {row['p99_ms']:>9.3f} {row['max_ms']:>9.3f}")
+        for stage, row in report['stages'].items():
+            if row['slowest']:
+                lines.extend(["", f"Slowest {stage} ({row['description']}):"])
+                lines.extend(f"  {slow['ms']:>10.3f} ms  {slow['entry']}" for slow in row['slowest'])
+        if report.get('hashing'):
+            hashing = report['hashing']
+            lines.extend(["", f"Hashing: {hashing['files']} files, {hashing['bytes']} bytes, {hashing['seconds']:.3f}s across all hashing workers"])
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: str, text_path: str, wall_seconds: float, hash_stats: Optional[dict] = None) -> dict:
+        report = self.report(wall_seconds, hash_stats)
+        try:
+            with open(json_path, 'w', encoding = 'utf-8') as f:
+                json.dump(report, f, indent = 2)
+            with open(text_path, 'w', encoding = 'utf-8') as f:
+                f.write(self.text_report(report))
+        except OSError as e:
+            logger.exception(f'Failed to write Profile report: {e}')
+            raise
+        logger.info(f'Profile report saved to: {json_path} and {text_path}')
+        return report
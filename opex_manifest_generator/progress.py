@@ -0,0 +1,166 @@
+"""
+Progress class for --progress reporting.
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import multiprocessing, threading, time, logging
+from datetime import timedelta
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('folders', 'files', 'bytes', 'hashed_files', 'hashed_bytes', 'written', 'opex_bytes', 'zips', 'zip_bytes')
+COUNTER_INDEX = {name: i for i, name in enumerate(COUNTERS)}
+
+class Progress():
+    """
+    Live counts of the work done, logged every interval seconds with the rate of each stage: Folders scanned,
+    Files hashed and Opexes written. Once a pre-scan has counted the tree, lines also give the percentage done
+    and an estimate of the time remaining, from the bytes walked when hashing, otherwise from the Files walked.
+
+    Counts are held in shared memory, with a row for each process so subtree worker processes add to them
+    without taking a lock shared between processes; the main process sums the rows when it reports.
+    The pre-scan runs on its own thread alongside the walk, so it doesn't hold up the start of the run.
+    The counts are also kept for --metrics, without reporting, see RunMetrics.
+
+    :param interval: the number of seconds between progress lines
+    :param processes: the number of subtree worker processes which will add to the counts
+    :param by_bytes: set whether the estimate is based on bytes rather than Files
+    """
+    def __init__(self, interval: float = 30.0, processes: int = 1, by_bytes: bool = False):
+        self.interval = interval
+        self.by_bytes = by_bytes
+        self.rows = max(1, processes or 1) + 1
+        self.counts = multiprocessing.RawArray('q', len(COUNTERS) * self.rows)
+        self.next_row = multiprocessing.Value('i', 1)
+        self.row = 0
+        self.lock = threading.Lock()
+        self.totals = None
+        self.start_time = time.perf_counter()
+        self.last = (self.start_time, dict.fromkeys(COUNTERS, 0))
+        self.stop_event = None
+        self.threads = []
+
+    def __getstate__(self) -> dict:
+        # Only the counts are sent to subtree worker processes; the main process does the reporting.
+        state = self.__dict__.copy()
+        state['lock'] = None
+        state['stop_event'] = None
+        state['threads'] = []
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def claim_row(self) -> None:
+        """Called once in each subtree worker process, before it adds to the counts."""
+        with self.next_row.get_lock():
+            self.row = self.next_row.value
+            self.next_row.value += 1
+        if self.row >= self.rows:
+            logger.error(f'Progress has no row left for subtree worker {self.row}')
+            raise ValueError(f'Progress has no row left for subtree worker {self.row}')
+        self.lock = threading.Lock()
+
+    def add(self, **counts: int) -> None:
+        base = self.row * len(COUNTERS)
+        with self.lock:
+            for name, count in counts.items():
+                self.counts[base + COUNTER_INDEX[name]] += count
+
+    def totals_so_far(self) -> dict:
+        """The counts summed across every process."""
+        values = self.counts[:]
+        return {name: sum(values[row * len(COUNTERS) + i] for row in range(self.rows)) for i, name in enumerate(COUNTERS)}
+
+    def status(self) -> dict:
+        """
+        Returns the counts so far, with the rate of each since the last progress line, the percentage done and the
+        estimated seconds remaining (None until the pre-scan is complete).
+        """
+        now = time.perf_counter()
+        counts = self.totals_so_far()
+        last_time, last_counts = self.last
+        window = max(now - last_time, 1e-9)
+        elapsed = now - self.start_time
+        status = dict(counts, elapsed_seconds = elapsed, totals = self.totals, percent = None, eta_seconds = None,
+                      rates = {name: (counts[name] - last_counts[name]) / window for name in COUNTERS})
+        if self.totals is not None:
+            if self.by_bytes and self.totals['bytes']:
+                fraction = counts['bytes'] / self.totals['bytes']
+            else:
+                fraction = counts['files'] / self.totals['files'] if self.totals['files'] else 1.0
+            fraction = min(fraction, 1.0)
+            status['percent'] = fraction * 100
+            if fraction > 0:
+                # From the average rate of the whole run, which is steadier than the rate of the last interval.
+                status['eta_seconds'] = elapsed * (1 - fraction) / fraction
+        return status
+
+    def line(self, final: bool = False) -> str:
+        status = self.status()
+        self.last = (time.perf_counter(), {name: status[name] for name in COUNTERS})
+        rates = status['rates']
+        if final:
+            elapsed = max(status['elapsed_seconds'], 1e-9)
+            rates = {name: status[name] / elapsed for name in COUNTERS}
+        mib = 1024 * 1024
+        totals = status['totals']
+        if totals is not None:
+            done = f"{status['files']:,} of {totals['files']:,} Files ({status['percent']:.1f}%), " \
+                   f"{status['bytes'] / mib:,.1f} of {totals['bytes'] / mib:,.1f} MiB"
+        else:
+            done = f"{status['files']:,} Files, {status['bytes'] / mib:,.1f} MiB"
+        stages = f"scan {rates['folders']:,.1f} Folders/s, hash {rates['hashed_files']:,.1f} Files/s " \
+                 f"{rates['hashed_bytes'] / mib:,.1f} MiB/s, write {rates['written']:,.1f} Opexes/s"
+        timing = f"elapsed {timedelta(seconds = int(status['elapsed_seconds']))}"
+        if final:
+            return f"Progress complete: {done}; {stages} on average; {timing}"
+        if status['eta_seconds'] is not None:
+            timing += f", ETA {timedelta(seconds = int(status['eta_seconds']))}"
+        return f"Progress: {done}; {stages}; {timing}"
+
+    def start(self, prescan = None) -> None:
+        """
+        Starts logging progress lines. prescan(stop_event) should return {'folders', 'files', 'bytes'} for the tree, or None if stopped.
+        """
+        self.start_time = time.perf_counter()
+        self.last = (self.start_time, self.totals_so_far())
+        self.stop_event = threading.Event()
+        self.threads = [threading.Thread(target = self.run, name = "opex-progress", daemon = True)]
+        if prescan is not None:
+            self.threads.append(threading.Thread(target = self.run_prescan, args = (prescan,), name = "opex-prescan", daemon = True))
+        for thread in self.threads:
+            thread.start()
+
+    def run_prescan(self, prescan) -> None:
+        start = time.perf_counter()
+        try:
+            totals = prescan(self.stop_event)
+        except Exception as e:
+            logger.warning(f'Pre-scan failed, so progress is reported without an estimate: {e}')
+            return
+        if totals is not None:
+            self.totals = totals
+            logger.info(f"Pre-scan found {totals['files']:,} Files ({totals['bytes'] / (1024 * 1024):,.1f} MiB) "
+                        f"in {totals['folders']:,} Folders, in {time.perf_counter() - start:.1f}s")
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            logger.info(self.line())
+
+    def stop(self) -> Optional[str]:
+        """Stops the threads and logs a final line, returning it."""
+        if self.stop_event is None:
+            return None
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.stop_event = None
+        self.threads = []
+        final = self.line(final = True)
+        logger.info(final)
+        return final
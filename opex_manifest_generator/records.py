@@ -0,0 +1,89 @@
+"""
+Record classes for holding spreadsheet rows as lightweight per-entry records.
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import logging
+from typing import Optional
+from opex_manifest_generator.common import check_nan
+
+logger = logging.getLogger(__name__)
+
+class EntryRecord():
+    """
+    A view of the spreadsheet row(s) matching one path.
+
+    More than one row means the path is duplicated in the spreadsheet; reading a value then raises
+    a ValueError, as reading a single value from several Dataframe rows does.
+    """
+    __slots__ = ('table', 'positions')
+
+    def __init__(self, table: "RecordTable", positions: list):
+        self.table = table
+        self.positions = positions
+
+    @property
+    def empty(self) -> bool:
+        return len(self.positions) == 0
+
+    def get(self, column: str):
+        position = self.table.columns[column]
+        if len(self.positions) != 1:
+            raise ValueError(f'{len(self.positions)} rows found for path, can only read a value from a single row')
+        return self.table.rows[self.positions[0]][position]
+
+class RecordTable():
+    """
+    Spreadsheet rows materialised once as tuples, with NaN / NaT normalised to None, and an index of paths to rows.
+
+    :param columns: the column headers, in row order
+    :param rows: an iterable of row tuples
+    :param index_field: the column holding the path of each entry
+    :param datetime_columns: columns holding dates, for formatting in descriptive metadata
+    :param normalised: set when missing values are already None, as the streaming loaders give them
+    :param categorical_columns: columns with a few values repeated across rows, which are held once each rather than once per row
+    """
+    def __init__(self, columns: list, rows, index_field: str, datetime_columns: Optional[set] = None, normalised: bool = False,
+                 categorical_columns: Optional[list] = None):
+        self.columns = {column: position for position, column in enumerate(columns)}
+        self.index_field = index_field
+        self.datetime_columns = set(datetime_columns or ())
+        categories = {self.columns[column]: {} for column in categorical_columns or () if column in self.columns}
+        if categories:
+            rows = (self.categorise(row, categories) for row in rows)
+        if normalised:
+            self.rows = [tuple(row) for row in rows]
+        else:
+            self.rows = [tuple(check_nan(value) for value in row) for row in rows]
+        self.index = {}
+        if index_field in self.columns:
+            index_position = self.columns[index_field]
+            for position, row in enumerate(self.rows):
+                self.index.setdefault(row[index_position], []).append(position)
+        logger.debug(f'Record table built with {len(self.rows)} rows and {len(self.index)} paths')
+
+    @staticmethod
+    def categorise(row, categories: dict) -> list:
+        row = list(row)
+        for position, values in categories.items():
+            row[position] = values.setdefault(row[position], row[position])
+        return row
+
+    @classmethod
+    def from_dataframe(cls, df, index_field: str) -> "RecordTable":
+        from pandas.api.types import is_datetime64_any_dtype
+        columns = df.columns.values.tolist()
+        datetime_columns = {column for column in columns if is_datetime64_any_dtype(df[column])}
+        # tolist() converts numpy scalars to python values, as .item() did per lookup.
+        return cls(columns, zip(*[df[column].tolist() for column in columns]), index_field, datetime_columns)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def lookup(self, path: str) -> EntryRecord:
+        return EntryRecord(self, self.index.get(path, []))
+
+    def from_positions(self, positions: list) -> EntryRecord:
+        return EntryRecord(self, list(positions))
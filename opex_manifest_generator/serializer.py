@@ -0,0 +1,116 @@
+"""
+File Opex class for rendering per-file Opexes without building an lxml tree.
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+from lxml import etree as ET
+from typing import Optional
+from opex_manifest_generator.common import xml_text, xml_attr, XML_DECLARATION
+
+def fixity_lines(file_path: str, fixities: list) -> list:
+    """The Fixity export lines for a File's (algorithm, hash, member) Fixities."""
+    return [[algorithm_type, hash_value, file_path if member is None else f"{file_path}/{member}"]
+            for algorithm_type, hash_value, member in fixities]
+
+def add_fixity_elements(fixitiesxml: ET._Element, opexns: str, fixities: list) -> None:
+    """Adds Fixity elements for (algorithm, hash, member) Fixities; member is the path of a file inside a PAX zip, or None."""
+    for algorithm_type, hash_value, member in fixities:
+        fixity = ET.SubElement(fixitiesxml, f"{{{opexns}}}Fixity")
+        if member is not None:
+            fixity.set("path", member.replace('\\', '/'))
+        fixity.set("type", algorithm_type)
+        fixity.set("value", hash_value)
+
+def wrap_lines(depth: int, tag: str, children: list) -> list:
+    """Lines for an element holding children, or its empty form."""
+    if not children:
+        return [(depth, f"<{tag}/>")]
+    return [(depth, f"<{tag}>")] + children + [(depth, f"</{tag}>")]
+
+class FileOpex():
+    """
+    The contents of a File's Opex: Transfer (SourceID, Fixities), then Properties (Title, Description,
+    SecurityDescriptor, Identifiers).
+
+    render writes these straight to bytes, the same as building the tree with to_element and writing it with
+    write_opex. Anything else, such as DescriptiveMetadata, is added to the tree from to_element instead.
+
+    :param opexns: the Opex namespace
+    """
+    __slots__ = ('opexns', 'source_id', 'fixities', 'properties', 'title', 'description', 'security', 'identifiers')
+
+    def __init__(self, opexns: str):
+        self.opexns = opexns
+        self.source_id = None
+        # None leaves out the Fixities element, as do properties and identifiers for their elements.
+        self.fixities = None
+        self.properties = False
+        self.title = None
+        self.description = None
+        self.security = None
+        self.identifiers = None
+
+    def set_properties(self, title: Optional[str] = None, description: Optional[str] = None, security: Optional[str] = None,
+                       identifiers: Optional[list] = None) -> None:
+        """As generate_opex_properties: Properties are left out if there's nothing in them. identifiers are (type, value)."""
+        self.title = str(title) if title else None
+        self.description = str(description) if description else None
+        self.security = str(security) if security else None
+        self.identifiers = identifiers
+        self.properties = any((self.title, self.description, self.security, identifiers is not None))
+
+    def property_values(self) -> list:
+        return [(name, value) for name, value in (("Title", self.title), ("Description", self.description), ("SecurityDescriptor", self.security))
+                if value is not None]
+
+    def to_element(self) -> ET._Element:
+        opexns = self.opexns
+        xmlroot = ET.Element(f"{{{opexns}}}OPEXMetadata", nsmap={"opex": opexns})
+        transfer = ET.SubElement(xmlroot, f"{{{opexns}}}Transfer")
+        if self.source_id is not None:
+            ET.SubElement(transfer, f"{{{opexns}}}SourceID").text = self.source_id
+        if self.fixities is not None:
+            add_fixity_elements(ET.SubElement(transfer, f"{{{opexns}}}Fixities"), opexns, self.fixities)
+        if self.properties:
+            properties = ET.SubElement(xmlroot, f"{{{opexns}}}Properties")
+            for name, value in self.property_values():
+                ET.SubElement(properties, f"{{{opexns}}}{name}").text = value
+            if self.identifiers is not None:
+                identifiers = ET.SubElement(properties, f"{{{opexns}}}Identifiers")
+                for key_name, value in self.identifiers:
+                    identifier = ET.SubElement(identifiers, f"{{{opexns}}}Identifier")
+                    identifier.set("type", key_name)
+                    identifier.text = value
+        return xmlroot
+
+    def render(self, pretty_print: bool = True) -> bytes:
+        """Serialises the Opex as write_opex would serialise to_element, escaping as lxml does."""
+        # Each line is (depth, markup); pretty printing puts each on its own line, indented two spaces per level.
+        lines = [(0, f'<opex:OPEXMetadata xmlns:opex="{xml_attr(self.opexns)}">')]
+        transfer = []
+        if self.source_id is not None:
+            transfer.append((2, f"<opex:SourceID>{xml_text(self.source_id)}</opex:SourceID>"))
+        if self.fixities is not None:
+            fixities = []
+            for algorithm_type, hash_value, member in self.fixities:
+                path = ""
+                if member is not None:
+                    path = 'path="' + xml_attr(member.replace('\\', '/')) + '" '
+                fixities.append((3, f'<opex:Fixity {path}type="{xml_attr(algorithm_type)}" value="{xml_attr(hash_value)}"/>'))
+            transfer.extend(wrap_lines(2, "opex:Fixities", fixities))
+        lines.extend(wrap_lines(1, "opex:Transfer", transfer))
+        if self.properties:
+            properties = [(2, f"<opex:{name}>{xml_text(value)}</opex:{name}>") for name, value in self.property_values()]
+            if self.identifiers is not None:
+                identifiers = [(3, f'<opex:Identifier type="{xml_attr(key_name)}">{xml_text(value)}</opex:Identifier>')
+                               for key_name, value in self.identifiers]
+                properties.extend(wrap_lines(2, "opex:Identifiers", identifiers))
+            lines.extend(wrap_lines(1, "opex:Properties", properties))
+        lines.append((0, "</opex:OPEXMetadata>"))
+        if pretty_print:
+            body = "\n".join("  " * depth + markup for depth, markup in lines) + "\n"
+        else:
+            body = "".join(markup for _, markup in lines)
+        return (XML_DECLARATION + body).encode('UTF-8')
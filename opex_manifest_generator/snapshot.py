@@ -0,0 +1,119 @@
+"""
+Tree Snapshot class for incremental runs.
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import os, json, sqlite3, time, logging
+from typing import Optional
+from opex_manifest_generator.common import win_256_check, enable_wal
+
+logger = logging.getLogger(__name__)
+
+class TreeSnapshot():
+    """
+    An SQLite snapshot of the tree as the previous run left it, so an incremental run only regenerates what changed.
+
+    Files are stored with their size, mtime_ns and the Fixity lines they added to the export; folders with a
+    digest of their Opex. Every entry seen by a run is stamped with run_stamp, and entries a run didn't see are
+    removed at the end of it. If the options which change the output differ from the previous run's, the
+    snapshot is discarded and everything is regenerated.
+
+    :param snapshot_path: the path of the SQLite database
+    :param settings: the options affecting the output
+    :param run_stamp: the stamp of this run, shared with any subtree worker processes
+    :param commit_interval: the number of changes between commits
+
+    Stored entries are held in memory and written in one short transaction every commit_interval changes, so
+    subtree worker processes sharing the snapshot never wait on each other's write lock. Lookups only read what
+    the previous run left, so they don't need to see the entries held back.
+    """
+    def __init__(self, snapshot_path: str, settings: dict, run_stamp: Optional[int] = None, commit_interval: int = 1000):
+        self.snapshot_path = snapshot_path
+        self.run_stamp = run_stamp or time.time_ns()
+        self.commit_interval = commit_interval
+        self.pending = []
+        try:
+            self.conn = sqlite3.connect(snapshot_path, timeout = 60)
+            enable_wal(self.conn)
+            # Subtree worker processes open the snapshot too, so only one of them checks and resets it.
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS entry (
+                                    path TEXT PRIMARY KEY,
+                                    kind TEXT NOT NULL,
+                                    size INTEGER,
+                                    mtime_ns INTEGER,
+                                    digest TEXT,
+                                    fixity TEXT,
+                                    last_seen INTEGER NOT NULL)""")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS settings (settings TEXT NOT NULL)")
+            row = self.conn.execute("SELECT settings FROM settings").fetchone()
+            settings_json = json.dumps(settings, sort_keys = True)
+            if row is not None and row[0] != settings_json:
+                logger.warning('Options have changed since the snapshot was taken; regenerating everything.')
+                self.conn.execute("DELETE FROM entry")
+            if row is None or row[0] != settings_json:
+                self.conn.execute("DELETE FROM settings")
+                self.conn.execute("INSERT INTO settings VALUES (?)", (settings_json,))
+            self.conn.commit()
+            logger.debug(f'Snapshot opened at: {snapshot_path}')
+        except sqlite3.Error as e:
+            logger.exception(f'Failed to open Snapshot at {snapshot_path}: {e}')
+            raise
+
+    @staticmethod
+    def identity(file_path: str) -> tuple:
+        """Returns (size, mtime_ns), from the scan when given a ScanEntry."""
+        entry = getattr(file_path, 'entry', None)
+        st = entry.stat() if entry is not None else os.stat(win_256_check(file_path))
+        return (st.st_size, st.st_mtime_ns)
+
+    def _changed(self, row: tuple) -> None:
+        self.pending.append(row)
+        if len(self.pending) >= self.commit_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the held entries in a single transaction."""
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?, ?, ?, ?)", self.pending)
+        self.pending = []
+
+    def unchanged_file(self, path: str, identity: tuple) -> Optional[list]:
+        """Returns the file's Fixity lines if its (size, mtime_ns) match the snapshot, otherwise None."""
+        row = self.conn.execute("SELECT size, mtime_ns, fixity FROM entry WHERE path = ? AND kind = 'file'", (path,)).fetchone()
+        if row is None or (row[0], row[1]) != identity:
+            return None
+        return json.loads(row[2])
+
+    def folder_digest(self, path: str) -> Optional[str]:
+        row = self.conn.execute("SELECT digest FROM entry WHERE path = ? AND kind = 'folder'", (path,)).fetchone()
+        return row[0] if row is not None else None
+
+    def known(self, path: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM entry WHERE path = ?", (path,)).fetchone() is not None
+
+    def store_file(self, path: str, identity: tuple, fixity: list) -> None:
+        size, mtime_ns = identity
+        self._changed((path, 'file', size, mtime_ns, None, json.dumps(fixity), self.run_stamp))
+
+    def store_folder(self, path: str, digest: Optional[str]) -> None:
+        self._changed((path, 'folder', None, None, digest, None, self.run_stamp))
+
+    def forget_stale(self) -> int:
+        """Removes the entries this run didn't see, returning the number removed."""
+        self.flush()
+        removed = self.conn.execute("DELETE FROM entry WHERE last_seen != ?", (self.run_stamp,)).rowcount
+        self.conn.commit()
+        return removed
+
+    def close(self, forget_stale: bool = False) -> None:
+        try:
+            self.flush()
+            if forget_stale:
+                self.forget_stale()
+        finally:
+            self.conn.close()
@@ -0,0 +1,75 @@
+"""
+Opex Writer class for writing Opexes in the background.
+
+author: Christopher Prince
+license: Apache License 2.0"
+"""
+
+import queue, threading, logging
+
+logger = logging.getLogger(__name__)
+
+class OpexWriter():
+    """
+    Writes Opexes (and their Zips) on background threads, so the walk doesn't wait on each small write.
+
+    Jobs are held in a bounded queue: once max_pending are waiting, submit() blocks until a thread takes one.
+    wait() returns once every job submitted so far has finished. The first error raised by a job is raised
+    again by the next submit(), wait() or close(), and the jobs queued after it are skipped.
+
+    :param threads: the number of writer threads
+    :param max_pending: the number of jobs which may be queued before submit() blocks
+    """
+    def __init__(self, threads: int = 1, max_pending: int = 1000):
+        self.queue = queue.Queue(maxsize = max(1, int(max_pending)))
+        self.error = None
+        self.threads = [threading.Thread(target = self.run, name = f"opex-writer-{i}", daemon = True) for i in range(max(1, int(threads)))]
+        for thread in self.threads:
+            thread.start()
+        logger.debug(f'Opex writer started with {len(self.threads)} threads')
+
+    def run(self) -> None:
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                if self.error is None:
+                    func, args, kwargs = job
+                    func(*args, **kwargs)
+            except BaseException as e:
+                if self.error is None:
+                    self.error = e
+                    logger.exception(f'Failed to write Opex: {e}')
+            finally:
+                self.queue.task_done()
+
+    def check(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, func, *args, **kwargs) -> None:
+        """Queues func(*args, **kwargs), blocking while the queue is full."""
+        self.check()
+        self.queue.put((func, args, kwargs))
+
+    def wait(self) -> None:
+        """Returns once every job submitted so far has finished."""
+        self.queue.join()
+        self.check()
+
+    def close(self, wait: bool = True) -> None:
+        """Stops the threads, once the queued jobs have finished; or discarding them if not wait."""
+        if not wait:
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.queue.task_done()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if wait:
+            self.check()
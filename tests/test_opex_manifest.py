@@ -1,10 +1,17 @@
 import os
+import sys
+import inspect
+import pickle
+import shutil
 import zipfile
 from lxml import etree as ET
 import pytest
 import pandas as pd
 
+from opex_manifest_generator import opex_manifest
 from opex_manifest_generator.opex_manifest import OpexManifestGenerator, OpexDir
+from opex_manifest_generator.export import ListExport
+from opex_manifest_generator.snapshot import TreeSnapshot
 
 
 def test_init_generate_descriptive_metadata(tmp_path):
@@ -233,7 +240,8 @@ def test_generate_opex_dirs_creates_opex(tmp_path):
     assert len(opex_files) >= 1
 
 
-def test_input_option_with_excel_file(tmp_path):
+@pytest.mark.parametrize("input_loader", ["stream", "dataframe"])
+def test_input_option_with_excel_file(tmp_path, input_loader):
     # Create a test directory with a file
     base = tmp_path / "data"
     base.mkdir()
@@ -244,25 +252,26 @@ def test_input_option_with_excel_file(tmp_path):
     input_file = tmp_path / "input.xlsx"
     df_input = pd.DataFrame([
         {
-            "index": str(test_file),
-            "title": "Test Document",
-            "description": "A test document for opex generation"
+            "FullName": str(test_file),
+            "Title": "Test Document",
+            "Description": "A test document for opex generation"
         }
     ])
     df_input.to_excel(input_file, index=False)
 
     # Initialize OpexManifestGenerator with input option
-    omg = OpexManifestGenerator(root=str(tmp_path), input=str(input_file))
+    omg = OpexManifestGenerator(root=str(tmp_path), input=str(input_file), input_loader=input_loader)
     # Call init_df to load the input file
     omg.init_df()
 
-    # Verify that the dataframe was loaded from the input file
-    assert omg.df is not None
-    assert len(omg.df) >= 1
-    assert "index" in omg.column_headers
+    # Verify that the input was loaded, into a dataframe only when asked for
+    assert (omg.df is not None) == (input_loader == "dataframe")
+    assert len(omg.records) >= 1
+    assert "FullName" in omg.column_headers
 
 
-def test_input_option_with_csv_file(tmp_path):
+@pytest.mark.parametrize("input_loader", ["stream", "dataframe"])
+def test_input_option_with_csv_file(tmp_path, input_loader):
     # Create a test directory with a file
     base = tmp_path / "data"
     base.mkdir()
@@ -273,21 +282,118 @@ def test_input_option_with_csv_file(tmp_path):
     input_file = tmp_path / "input.csv"
     df_input = pd.DataFrame([
         {
-            "index": str(test_file),
-            "title": "CSV Test"
+            "FullName": str(test_file),
+            "Title": "CSV Test"
         }
     ])
     df_input.to_csv(input_file, index=False)
 
     # Initialize with CSV input
-    omg = OpexManifestGenerator(root=str(tmp_path), input=str(input_file))
+    omg = OpexManifestGenerator(root=str(tmp_path), input=str(input_file), input_loader=input_loader)
     # Call init_df to load the input file
     omg.init_df()
 
-    # Verify dataframe was loaded
+    # Verify the input was loaded, into a dataframe only when asked for
+    assert (omg.df is not None) == (input_loader == "dataframe")
+    assert len(omg.records) >= 1
+    assert "FullName" in omg.column_headers
+
+
+@pytest.mark.parametrize("ignore", [[False, True, False], [0, 1, 0]])
+@pytest.mark.parametrize("input_format", ["csv", "xlsx", "json", "xml"])
+def test_streaming_input_matches_dataframe(tmp_path, input_format, ignore):
+    root = tmp_path / "root"
+    root.mkdir()
+    names = ["a.txt", "b.txt", "c.txt"]
+    for name in names:
+        (root / name).write_text(name)
+    df_input = pd.DataFrame({"FullName": [str(root / name) for name in names],
+                             "Title": ["A & co", None, "C"],
+                             "Description": ["First", "Second", None],
+                             "Security": ["open", None, "closed"],
+                             "Ignore": ignore})
+    input_file = tmp_path / f"input.{input_format}"
+    if input_format == "csv":
+        df_input.to_csv(input_file, index=False)
+    elif input_format == "xlsx":
+        df_input.to_excel(input_file, index=False)
+    elif input_format == "json":
+        df_input.to_json(input_file, orient="records")
+    else:
+        df_input.to_xml(input_file, index=False)
+
+    opexes = {}
+    for input_loader in ["stream", "dataframe"]:
+        omg = OpexManifestGenerator(root=str(root), output_path=str(tmp_path), input=str(input_file), input_loader=input_loader)
+        omg.main()
+        assert (omg.df is None) == (input_loader == "stream")
+        opexes[input_loader] = {p.name: p.read_bytes() for p in root.rglob("*.opex")}
+        OpexManifestGenerator(root=str(root)).clear_opex()
+    assert opexes["stream"] == opexes["dataframe"]
+    assert "b.txt.opex" not in opexes["stream"]
+    assert "c.txt.opex" in opexes["stream"]
+    assert b"A &amp; co" in opexes["stream"]["a.txt.opex"]
+
+
+def test_streaming_input_keeps_text_and_falls_back(tmp_path):
+    from opex_manifest_generator.loaders import load_records
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("FullName,SourceID,Ignore\n/a,0012,TRUE\n/b,NA,\n")
+    records = load_records(str(input_file), "FullName")
+    # Text isn't converted to numbers, so leading zeros are kept; blanks and NA are empty, as in a Dataframe.
+    assert records.rows == [("/a", "0012", True), ("/b", None, None)]
+
+    # JSON which isn't a list of records is read into a Dataframe.
+    input_file = tmp_path / "input.json"
+    pd.DataFrame({"FullName": ["/a"], "Title": ["A"]}).to_json(input_file)
+    assert load_records(str(input_file), "FullName") is None
+    omg = OpexManifestGenerator(root=str(tmp_path), input=str(input_file), input_loader="stream")
+    omg.init_df()
     assert omg.df is not None
-    assert len(omg.df) >= 1
-    assert "index" in omg.column_headers
+    assert omg.xip_df_lookup(omg.record_lookup("/a")) == ("A", None, None)
+
+
+@pytest.mark.parametrize("input_loader", ["stream", "dataframe"])
+def test_input_loads_only_used_columns(tmp_path, input_loader):
+    md_dir = tmp_path / "meta"
+    md_dir.mkdir()
+    (md_dir / "sample.xml").write_text('<?xml version="1.0"?><root xmlns="urn:test"><a>1</a></root>')
+    input_file = tmp_path / "input.csv"
+    pd.DataFrame({"FullName": ["/a", "/b"],
+                  "Title": ["A", "B"],
+                  "Security": ["open", "open"],
+                  "Identifier:code": ["X1", "X2"],
+                  "Removals": [None, True],
+                  "root:a": ["1", "2"],
+                  "Notes": ["unused", "unused"],
+                  "Unnamed: 7": [1, 2]}).to_csv(input_file, index=False)
+
+    omg = OpexManifestGenerator(root=str(tmp_path), input=str(input_file), input_loader=input_loader)
+    omg.init_df()
+    assert omg.column_headers == ["FullName", "Title", "Security", "Identifier:code"]
+
+    # Removals are kept with --remove, and template columns with -m.
+    omg = OpexManifestGenerator(root=str(tmp_path), input=str(input_file), input_loader=input_loader,
+                                metadata_dir=str(md_dir), metadata_flag='f', removal_flag=True)
+    omg.init_df()
+    assert omg.column_headers == ["FullName", "Title", "Security", "Identifier:code", "Removals", "root:a"]
+    assert omg.xip_df_lookup(omg.record_lookup("/b")) == ("B", None, "open")
+    if input_loader == "stream":
+        # Repeated values are held once.
+        security = omg.column_headers.index("Security")
+        assert omg.records.rows[0][security] is omg.records.rows[1][security]
+    else:
+        assert omg.df["Security"].dtype == "category"
+
+
+@pytest.mark.parametrize("input_loader", ["stream", "dataframe"])
+def test_removals_marked_by_any_value(tmp_path, input_loader):
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("FullName,Removals\n/a,0\n/b,no\n/c,\n")
+    omg = OpexManifestGenerator(root=str(tmp_path), input=str(input_file), input_loader=input_loader, removal_flag=True)
+    omg.init_df()
+    # Unlike Ignore, any value in Removals marks the row for removal.
+    assert [omg.removal_df_lookup(omg.record_lookup(path)) for path in ["/a", "/b", "/c"]] == [True, True, False]
 
 
 def test_input_option_sets_flags_with_special_columns(tmp_path):
@@ -314,3 +420,911 @@ def test_input_option_sets_flags_with_special_columns(tmp_path):
     assert omg.description_flag is True
     assert omg.security_flag is True
     assert omg.sourceid_flag is True
+
+
+def test_multi_hash_generator_matches_single_algorithm(tmp_path):
+    from opex_manifest_generator.hash import HashGenerator
+    p = tmp_path / "file.bin"
+    p.write_bytes(os.urandom(10000))
+
+    algorithms = ["SHA-1", "MD5", "SHA-256", "SHA-512"]
+    digests = HashGenerator(algorithm=algorithms).multi_hash_generator(str(p))
+
+    assert list(digests) == algorithms
+    for algorithm in algorithms:
+        assert digests[algorithm] == HashGenerator(algorithm=algorithm).hash_generator(str(p))
+    # Names are matched exactly, as for the multi-digest methods, so SHA256 isn't read as SHA-1.
+    assert HashGenerator(algorithm="SHA256").hash_generator(str(p)) == digests["SHA-256"]
+
+
+@pytest.mark.parametrize("buffer, read_mode, io_policy", [(None, "readinto", "default"), (7, "readinto", "default"),
+                                                        (None, "mmap", "default"), (None, "readinto", "fadvise"),
+                                                        (None, "mmap", "fadvise"), (None, "readinto", "direct")])
+def test_hash_read_modes_match_hashlib(tmp_path, monkeypatch, buffer, read_mode, io_policy):
+    import hashlib
+    from opex_manifest_generator import hash as hash_module
+    monkeypatch.setattr(hash_module, "MMAP_THRESHOLD", 1)
+    data = os.urandom(3 * 4096 + 123)
+    p = tmp_path / "file.bin"
+    p.write_bytes(data)
+    (tmp_path / "empty.bin").write_bytes(b"")
+
+    generator = hash_module.HashGenerator(algorithm=["SHA-1", "MD5"], buffer=buffer, read_mode=read_mode, io_policy=io_policy)
+    assert generator.multi_hash_generator(str(p)) == {"SHA-1": hashlib.sha1(data).hexdigest().upper(),
+                                                     "MD5": hashlib.md5(data).hexdigest().upper()}
+    assert generator.multi_hash_generator(str(tmp_path / "empty.bin"))["SHA-1"] == hashlib.sha1(b"").hexdigest().upper()
+
+
+def test_hash_buffer_sizing_and_options(tmp_path):
+    from opex_manifest_generator.hash import HashGenerator, MAX_BUFFER
+    generator = HashGenerator()
+    assert generator.buffer_size(100, 4096) == 4096
+    assert generator.buffer_size(10000, 4096) == 12288
+    assert generator.buffer_size(10 ** 10, 4096) == MAX_BUFFER
+    assert HashGenerator(buffer=65536).buffer_size(100, 4096) == 65536
+
+    options = tmp_path / "options.properties"
+    options.write_text("[options]\nHASH_BUFFER = 65536\nHASH_READ_MODE = mmap\n")
+    omg = OpexManifestGenerator(root=str(tmp_path), options_file=str(options))
+    assert (omg.hash_buffer, omg.hash_read_mode) == (65536, "mmap")
+    omg = OpexManifestGenerator(root=str(tmp_path), options_file=str(options), hash_buffer=0, hash_read_mode="readinto")
+    assert (omg.hash_buffer, omg.hash_read_mode) == (0, "readinto")
+
+
+def test_hash_rate_limit_and_stats(tmp_path, monkeypatch, caplog):
+    from opex_manifest_generator.hash import RateLimiter
+    sleeps = []
+    monkeypatch.setattr("opex_manifest_generator.hash.time.sleep", sleeps.append)
+    limiter = RateLimiter(1000)
+    limiter.consume(1000)
+    assert sleeps == []
+    limiter.consume(500)
+    assert sleeps and sleeps[0] == pytest.approx(0.5, abs=0.05)
+    monkeypatch.undo()
+
+    root = tmp_path / "root"
+    root.mkdir()
+    for i in range(3):
+        (root / f"file{i}.txt").write_bytes(b"x" * 1000)
+    omg = OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"], hash_io_policy="fadvise",
+                                hash_rate_limit=10 ** 9)
+    with caplog.at_level("INFO"):
+        omg.main()
+    assert omg.hash_stats.as_dict()["files"] == 3
+    assert omg.hash_stats.as_dict()["bytes"] == 3000
+    assert "Hashed 3 files" in caplog.text
+
+
+def test_generate_pax_zip_opex_fixity_multiple_algorithms_order(tmp_path):
+    zp = tmp_path / "test.pax.zip"
+    with zipfile.ZipFile(str(zp), 'w') as z:
+        z.writestr("a.txt", "a")
+        z.writestr("b.txt", "b")
+
+    omg = OpexManifestGenerator(root=str(tmp_path), algorithm=["SHA-1", "MD5"])
+    omg.fixities = ET.Element(f"{{{omg.opexns}}}Fixities")
+    returned_fixity = omg.generate_pax_zip_opex_fixity(str(zp), algorithm=omg.algorithm)
+
+    # algorithms stay the outer grouping, zip members the inner
+    assert [(item[0], os.path.basename(item[2])) for item in returned_fixity] == \
+        [("SHA-1", "a.txt"), ("SHA-1", "b.txt"), ("MD5", "a.txt"), ("MD5", "b.txt")]
+    assert [(f.get('type'), f.get('path')) for f in omg.fixities] == \
+        [("SHA-1", "a.txt"), ("SHA-1", "b.txt"), ("MD5", "a.txt"), ("MD5", "b.txt")]
+
+
+@pytest.mark.parametrize("jobs, read_mode, io_policy", [(1, "readinto", "default"), (4, "readinto", "default"),
+                                                      (1, "mmap", "fadvise"), (4, "readinto", "direct")])
+def test_hash_pax_zip_stored_and_deflated_members(tmp_path, monkeypatch, jobs, read_mode, io_policy):
+    import hashlib
+    from opex_manifest_generator import hash as hash_module
+    from opex_manifest_generator.hash import HashStats, hash_pax_zip
+    monkeypatch.setattr(hash_module, "MMAP_THRESHOLD", 1)
+    monkeypatch.setattr(hash_module, "DONTNEED_INTERVAL", 4096)
+    dropped = []
+    if hash_module.FADVISE:
+        fadvise = os.posix_fadvise
+        def record_fadvise(fd, offset, length, advice):
+            if advice == os.POSIX_FADV_DONTNEED:
+                dropped.append((offset, length))
+            return fadvise(fd, offset, length, advice)
+        monkeypatch.setattr(os, "posix_fadvise", record_fadvise)
+    zp = tmp_path / "test.pax.zip"
+    members = {f"dir/m{i}.bin": os.urandom(5000 + i * 997) for i in range(12)}
+    with zipfile.ZipFile(str(zp), 'w') as z:
+        for i, (name, data) in enumerate(members.items()):
+            info = zipfile.ZipInfo(name)
+            info.compress_type = zipfile.ZIP_DEFLATED if i % 2 else zipfile.ZIP_STORED
+            # Zip64 members carry an extra field in their local header, moving the data offset.
+            with z.open(info, 'w', force_zip64=(i % 3 == 0)) as w:
+                w.write(data)
+
+    stats = HashStats()
+    results = hash_pax_zip(str(zp), ["SHA-1", "MD5"], buffer=4096, jobs=jobs, stats=stats, read_mode=read_mode, io_policy=io_policy)
+    with zipfile.ZipFile(str(zp)) as z:
+        assert [name for name, _ in results] == z.namelist()
+    hashed = dict(results)
+    for name, data in members.items():
+        assert hashed[name] == {"SHA-1": hashlib.sha1(data).hexdigest().upper(), "MD5": hashlib.md5(data).hexdigest().upper()}
+    assert stats.files == len(results)
+    assert stats.bytes == sum(len(data) for data in members.values())
+    # Stored members are dropped from the page cache as they're hashed, as files are.
+    assert bool(dropped) == (hash_module.FADVISE and io_policy != "default")
+
+    # A corrupted stored member fails its CRC check, as zipfile would.
+    raw = bytearray(zp.read_bytes())
+    raw[raw.index(members["dir/m0.bin"][:64]) + 10] ^= 0xFF
+    zp.write_bytes(bytes(raw))
+    with pytest.raises(zipfile.BadZipFile):
+        hash_pax_zip(str(zp), ["SHA-1"], jobs=jobs, read_mode=read_mode, io_policy=io_policy)
+
+
+def _build_tree(base):
+    (base / "a" / "aa").mkdir(parents=True)
+    (base / "b").mkdir()
+    for n, folder in enumerate([base, base / "a", base / "a" / "aa", base / "b"]):
+        for i in range(5):
+            (folder / f"file{n}_{i}.txt").write_bytes(os.urandom(2000 + i))
+
+
+def _read_opexes(base):
+    return {str(p.relative_to(base)): p.read_bytes() for p in sorted(base.rglob("*.opex"))}
+
+
+@pytest.mark.parametrize("jobs_mode", ["thread", "process"])
+def test_main_jobs_output_matches_serial(tmp_path, jobs_mode):
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    out_serial = tmp_path / "serial"
+    out_parallel = tmp_path / "parallel"
+
+    OpexManifestGenerator(root=str(root), output_path=str(out_serial), algorithm=["SHA-1", "MD5"]).main()
+    serial = _read_opexes(root)
+    OpexManifestGenerator(root=str(root), clear_opex_flag=True).clear_opex()
+    OpexManifestGenerator(root=str(root), output_path=str(out_parallel), algorithm=["SHA-1", "MD5"],
+                          jobs=4, jobs_mode=jobs_mode).main()
+
+    assert _read_opexes(root) == serial
+    assert (out_parallel / "meta" / "root_Fixity.txt").read_text() == (out_serial / "meta" / "root_Fixity.txt").read_text()
+
+
+def test_generate_opex_dirs_lists_own_subfolders(tmp_path):
+    root = tmp_path / "root"
+    (root / "a" / "aa").mkdir(parents=True)
+    (root / "b").mkdir()
+
+    OpexManifestGenerator(root=str(root), output_path=str(tmp_path)).main()
+
+    ns = {"opex": "http://www.openpreservationexchange.org/opex/v1.2"}
+    root_folders = ET.parse(str(root / "root.opex")).findall('.//opex:Folder', ns)
+    a_folders = ET.parse(str(root / "a" / "a.opex")).findall('.//opex:Folder', ns)
+    assert [f.text for f in root_folders] == ["a", "b"]
+    assert [f.text for f in a_folders] == ["aa"]
+
+
+@pytest.mark.parametrize("partition_depth", [1, 2])
+def test_main_processes_output_matches_serial(tmp_path, partition_depth):
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    out_serial = tmp_path / "serial"
+    out_parallel = tmp_path / "parallel"
+
+    OpexManifestGenerator(root=str(root), output_path=str(out_serial), algorithm=["SHA-1"]).main()
+    serial = _read_opexes(root)
+    OpexManifestGenerator(root=str(root)).clear_opex()
+    OpexManifestGenerator(root=str(root), output_path=str(out_parallel), algorithm=["SHA-1"],
+                          processes=3, partition_depth=partition_depth).main()
+
+    assert _read_opexes(root) == serial
+    assert (out_parallel / "meta" / "root_Fixity.txt").read_text() == (out_serial / "meta" / "root_Fixity.txt").read_text()
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_exports_inside_root_are_not_walked(tmp_path, processes):
+    root = tmp_path / "acc"
+    root.mkdir()
+    _build_tree(root)
+    options = dict(root=str(root), algorithm=["SHA-1"], processes=processes, fixity_cache_flag=True)
+    OpexManifestGenerator(**options, output_path=str(tmp_path)).main()
+    expected_opexes = _read_opexes(root)
+    expected_fixity = (tmp_path / "meta" / "acc_Fixity.txt").read_text()
+    OpexManifestGenerator(root=str(root)).clear_opex()
+
+    # Without a meta folder the exports, the journal and the fixity cache are written into the root, as the walk goes.
+    OpexManifestGenerator(**options, output_path=str(root), meta_dir_flag=False).main()
+    assert _read_opexes(root) == expected_opexes
+    assert (root / "acc_Fixity.txt").read_text() == expected_fixity
+    assert not list(root.glob("*.part"))
+    assert not (root / "acc_Journal.jsonl").exists()
+
+
+def test_run_without_fixities_leaves_no_meta_folder(tmp_path):
+    root = tmp_path / "acc"
+    root.mkdir()
+    _build_tree(root)
+    OpexManifestGenerator(root=str(root), output_path=str(tmp_path)).main()
+    assert (root / "acc.opex").exists()
+    assert not (tmp_path / "meta").exists()
+
+    # A journaled run removes the meta folder it created, once the journal is removed.
+    OpexManifestGenerator(root=str(root)).clear_opex()
+    OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"], fixity_export_flag=False).main()
+    assert not (tmp_path / "meta").exists()
+
+
+def _worker_rate(_):
+    from opex_manifest_generator.hash import rate_limiter
+    return rate_limiter(opex_manifest._subtree_omg.hash_rate_limit).rate
+
+
+def test_processes_share_hash_rate_limit(tmp_path):
+    from concurrent.futures import ProcessPoolExecutor
+    from opex_manifest_generator.hash import rate_limiter
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    # Only two subtrees (a and b) are split out, so two of the four workers hash alongside the parent.
+    omg = OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"], hash_rate_limit=9 * 10 ** 9, processes=4)
+    omg.main()
+    assert omg.rate_participants == 3
+    assert rate_limiter(omg.hash_rate_limit).rate == 3 * 10 ** 9
+
+    omg = OpexManifestGenerator(root=str(tmp_path), algorithm=["SHA-1"], hash_rate_limit=9 * 10 ** 9, processes=4)
+    omg.rate_participants = 3
+    with ProcessPoolExecutor(max_workers=2, initializer=opex_manifest.init_subtree_worker, initargs=(omg,)) as pool:
+        worker_rates = list(pool.map(_worker_rate, range(4)))
+    # The active workers and the parent each take a third of the rate.
+    assert worker_rates == [3 * 10 ** 9] * 4
+
+
+def test_fixity_cache_reuses_unchanged_files(tmp_path):
+    from opex_manifest_generator.fixity_cache import FixityCache
+    p = tmp_path / "file.txt"
+    p.write_text("hello")
+    cache = FixityCache(str(tmp_path / "cache.sqlite"))
+
+    identity = FixityCache.identity(str(p))
+    assert cache.lookup(str(p), ["SHA-1"], identity) is None
+    cache.store(str(p), {"SHA-1": "ABC"}, identity)
+    assert cache.lookup(str(p), ["SHA-1"], identity) == {"SHA-1": "ABC"}
+    # a second algorithm not yet cached is a miss
+    assert cache.lookup(str(p), ["SHA-1", "MD5"], identity) is None
+
+    p.write_text("changed contents")
+    os.utime(str(p), ns=(1, 1))
+    assert cache.lookup(str(p), ["SHA-1"], FixityCache.identity(str(p))) is None
+    assert (cache.hits, cache.misses) == (1, 3)
+    # Changes are held until written together, so other processes sharing the cache are never locked out.
+    assert not cache.conn.in_transaction
+    cache.close()
+    reopened = FixityCache(str(tmp_path / "cache.sqlite"))
+    assert reopened.lookup(str(p), ["SHA-1"], identity) == {"SHA-1": "ABC"}
+    reopened.close()
+
+
+def test_fixity_cache_eviction(tmp_path):
+    from opex_manifest_generator.fixity_cache import FixityCache
+    cache = FixityCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for i in range(4):
+        cache.run_stamp = i
+        cache.store(f"/file{i}", {"SHA-1": str(i)}, (1, 1, 1, 1))
+    assert cache.evict() == 2
+    assert cache.lookup("/file3", ["SHA-1"], (1, 1, 1, 1)) == {"SHA-1": "3"}
+    assert cache.lookup("/file0", ["SHA-1"], (1, 1, 1, 1)) is None
+    cache.close()
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_main_fixity_cache_hits_on_rerun(tmp_path, processes):
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    out = tmp_path / "out"
+
+    first = OpexManifestGenerator(root=str(root), output_path=str(out), algorithm=["SHA-1"], processes=processes,
+                                  fixity_cache_flag=True)
+    first.main()
+    expected = _read_opexes(root)
+    assert first.fixity_cache_hits == 0 and first.fixity_cache_misses == 20
+
+    OpexManifestGenerator(root=str(root)).clear_opex()
+    second = OpexManifestGenerator(root=str(root), output_path=str(out), algorithm=["SHA-1"], jobs=2, processes=processes,
+                                   fixity_cache_flag=True)
+    second.main()
+    assert second.fixity_cache_hits == 20
+    assert (out / "meta" / "root_FixityCache.sqlite").exists()
+
+    # The cache is only kept when asked for.
+    OpexManifestGenerator(root=str(root)).clear_opex()
+    OpexManifestGenerator(root=str(root), output_path=str(tmp_path / "uncached"), algorithm=["SHA-1"], processes=processes).main()
+    assert not (tmp_path / "uncached" / "meta" / "root_FixityCache.sqlite").exists()
+    assert _read_opexes(root) == expected
+
+
+def test_index_df_lookup_missing_and_duplicate_paths(tmp_path):
+    omg = OpexManifestGenerator(root=str(tmp_path))
+    omg.df = pd.DataFrame([{omg.INDEX_FIELD: 'a', omg.TITLE_FIELD: 'A'},
+                           {omg.INDEX_FIELD: 'b', omg.TITLE_FIELD: 'B1'},
+                           {omg.INDEX_FIELD: 'b', omg.TITLE_FIELD: 'B2'}])
+    omg.column_headers = omg.df.columns.values.tolist()
+    omg.set_input_flags()
+
+    assert list(omg.index_df_lookup('a')) == [0]
+    assert omg.index_df_lookup('missing').empty
+    assert list(omg.index_df_lookup('b')) == [1, 2]
+    assert omg.xip_df_lookup(omg.index_df_lookup('a'))[0] == 'A'
+
+    # replacing the dataframe rebuilds the index
+    omg.df = pd.DataFrame([{omg.INDEX_FIELD: 'c', omg.TITLE_FIELD: 'C'}])
+    assert list(omg.index_df_lookup('c')) == [0]
+    assert omg.index_df_lookup('a').empty
+
+
+def test_records_normalise_nan_and_format_dates(tmp_path):
+    md_dir = tmp_path / "meta"
+    md_dir.mkdir()
+    (md_dir / "sample.xml").write_text('<?xml version="1.0"?><root xmlns="urn:test"><a/><d/></root>')
+
+    omg = OpexManifestGenerator(root=str(tmp_path), metadata_dir=str(md_dir))
+    omg.df = pd.DataFrame([{omg.INDEX_FIELD: 'file', omg.TITLE_FIELD: float('nan'), 'root:a': 7, 'root:d': pd.Timestamp('2020-01-02 03:04:05')},
+                           {omg.INDEX_FIELD: 'other', omg.TITLE_FIELD: 'T', 'root:a': 8, 'root:d': pd.NaT}])
+    omg.column_headers = omg.df.columns.values.tolist()
+    omg.set_input_flags()
+    omg.metadata_flag = 'f'
+    omg.init_generate_descriptive_metadata()
+
+    record = omg.record_lookup('file')
+    assert record.get(omg.TITLE_FIELD) is None
+    assert omg.xip_df_lookup(record) == (None, None, None)
+    assert omg.record_lookup('missing').empty
+
+    xml_desc = ET.Element('DescriptiveMetadata')
+    omg.generate_descriptive_metadata(xml_desc, record)
+    assert xml_desc.find('.//{urn:test}a').text == '7'
+    assert xml_desc.find('.//{urn:test}d').text == '2020-01-02T03:04:05.000Z'
+
+    xml_desc = ET.Element('DescriptiveMetadata')
+    omg.generate_descriptive_metadata(xml_desc, omg.record_lookup('other'))
+    assert xml_desc.find('.//{urn:test}d').text is None
+
+
+def test_descriptive_metadata_templates_parsed_once(tmp_path):
+    md_dir = tmp_path / "meta"
+    md_dir.mkdir()
+    (md_dir / "sample.xml").write_text('<?xml version="1.0"?><root xmlns="urn:test"><g><a/></g><g><a/></g></root>')
+
+    omg = OpexManifestGenerator(root=str(tmp_path), metadata_dir=str(md_dir))
+    omg.df = pd.DataFrame([{omg.INDEX_FIELD: 'one', 'root:g[2]/root:a': 'A1'},
+                           {omg.INDEX_FIELD: 'two', 'root:g[2]/root:a': 'A2'}])
+    omg.column_headers = omg.df.columns.values.tolist()
+    omg.set_input_flags()
+    omg.metadata_flag = 'e'
+    omg.init_generate_descriptive_metadata()
+    assert omg.xml_files[0]['data'][0]['ExactLocator'] == (1, 0)
+
+    # Entries are cloned from the template, so values never leak between entries or into the template.
+    outputs = []
+    for path in ('one', 'two'):
+        xml_desc = ET.Element('DescriptiveMetadata')
+        omg.generate_descriptive_metadata(xml_desc, omg.record_lookup(path))
+        outputs.append(xml_desc)
+    assert [g.find('{urn:test}a').text for g in outputs[0].iter('{urn:test}g')] == [None, 'A1']
+    assert [g.find('{urn:test}a').text for g in outputs[1].iter('{urn:test}g')] == [None, 'A2']
+    assert omg.xml_files[0]['template'].find('.//{urn:test}a').text is None
+
+    clone = pickle.loads(pickle.dumps(omg))
+    xml_desc = ET.Element('DescriptiveMetadata')
+    clone.generate_descriptive_metadata(xml_desc, clone.record_lookup('one'))
+    assert ET.tostring(xml_desc) == ET.tostring(outputs[0])
+
+
+def test_generate_opex_dirs_scans_each_folder_once(tmp_path, monkeypatch):
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    (root / "file0_0.txt.opex").write_text("<existing/>")
+    real_scandir = os.scandir
+    scanned = []
+
+    def counting_scandir(path):
+        scanned.append(str(path))
+        return real_scandir(path)
+
+    def no_stat_call(path):
+        raise AssertionError(f"unexpected file system call for {path}")
+
+    real_getsize = os.path.getsize
+
+    def created_getsize(path):
+        # Only files created during the walk, so missing from the scan, need sizing.
+        assert str(path).endswith(".zip")
+        return real_getsize(path)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    monkeypatch.setattr(os.path, "isdir", no_stat_call)
+    monkeypatch.setattr(os.path, "isfile", no_stat_call)
+    monkeypatch.setattr(os.path, "getsize", created_getsize)
+    OpexManifestGenerator(root=str(root), output_path=str(tmp_path), fixity_cache_flag=False, zip_flag=True, algorithm=["SHA-1"]).main()
+    monkeypatch.undo()
+
+    assert sorted(scanned) == sorted({str(root), str(root / "a"), str(root / "a" / "aa"), str(root / "b")})
+    ns = {"opex": "http://www.openpreservationexchange.org/opex/v1.2"}
+    files = ET.parse(str(root / "root.opex")).findall('.//opex:File', ns)
+    listed = {f.text: f.get("size") for f in files}
+    on_disk = {p.name: str(p.stat().st_size) for p in root.iterdir() if p.is_file() and p.name != "root.opex"}
+    assert listed == {name: (None if name.endswith(".opex") else size) for name, size in on_disk.items()}
+    # The existing opex is kept rather than overwritten.
+    assert (root / "file0_0.txt.opex").read_text() == "<existing/>"
+
+
+def test_generate_opex_dirs_deep_tree_and_walk_hooks(tmp_path):
+    root = tmp_path / "root"
+    deep = root
+    for _ in range(150):
+        deep = deep / "d"
+    deep.mkdir(parents=True)
+    (deep / "leaf.txt").write_text("leaf")
+    (root / "top.txt").write_text("top")
+
+    events = []
+    omg = OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"])
+    omg.add_walk_hook(lambda event, folder_path, paths: events.append((event, os.path.relpath(folder_path, root), list(paths))))
+    # Leave too little stack for a recursive walk of 150 folders.
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(len(inspect.stack()) + 100)
+    try:
+        omg.main()
+    finally:
+        sys.setrecursionlimit(limit)
+
+    assert (deep / "leaf.txt.opex").exists()
+    assert (deep / "d.opex").exists()
+    assert (root / "root.opex").exists()
+    folders = [(folder, paths) for event, folder, paths in events if event == "folder"]
+    # Post-order: the deepest folder completes first and root last, each once its Opex is written.
+    assert folders[0] == (os.path.relpath(deep, root), [str(deep / "d.opex")])
+    assert folders[-1] == (".", [str(root / "root.opex")])
+    files = [paths for event, folder, paths in events if event == "files" and folder == "."]
+    assert files == [[str(root / "top.txt")]]
+
+
+def test_list_export_matches_export_list_txt(tmp_path):
+    from auto_reference_generator.common import export_list_txt
+    lines = [["SHA-1", f"HASH{i}", f"/path/file{i}"] for i in range(5)]
+    export_list_txt(lines, str(tmp_path / "expected.txt"))
+
+    part = ListExport(str(tmp_path / "streamed.txt.part"), buffer_lines=2)
+    part.extend(lines[2:])
+    part.close()
+    export = ListExport(str(tmp_path / "streamed.txt"), buffer_lines=2)
+    export.extend(lines[:2])
+    export.append_part(part.output_file, len(part))
+    export.close()
+
+    assert (tmp_path / "streamed.txt").read_text() == (tmp_path / "expected.txt").read_text()
+    assert len(export) == 5
+    assert not (tmp_path / "streamed.txt.part").exists()
+
+
+def test_main_streams_exports_and_keeps_them_on_failure(tmp_path, monkeypatch):
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    omg = OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"])
+    omg.main()
+    assert omg.list_path == []
+    assert len(omg.list_fixity) == 20
+    assert len((tmp_path / "meta" / "root_Fixity.txt").read_text().splitlines()) == 20
+
+    # A failure part way through still leaves the fixities generated before it.
+    OpexManifestGenerator(root=str(root)).clear_opex()
+    real_write_opex = opex_manifest.write_opex
+
+    def failing_write_opex(path, opexxml, *args, **kwargs):
+        if os.path.basename(path) == "b":
+            raise OSError("disk full")
+        return real_write_opex(path, opexxml, *args, **kwargs)
+
+    monkeypatch.setattr(opex_manifest, "write_opex", failing_write_opex)
+    omg = OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"], keep_path_list=True)
+    with pytest.raises(OSError):
+        omg.main()
+    written = (tmp_path / "meta" / "root_Fixity.txt").read_text().splitlines()
+    assert len(written) == 15
+    assert [line.split("'")[-2] for line in written] == omg.list_path
+
+
+@pytest.mark.parametrize("fail_at, lose_records, processes, writer_threads",
+                         [(3, False, 1, 0), (9, False, 1, 0), (14, False, 2, 0), (9, True, 1, 0), (9, False, 1, 1), (14, False, 2, 1)])
+def test_resume_matches_uninterrupted_run(tmp_path, monkeypatch, fail_at, lose_records, processes, writer_threads):
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    options = dict(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1", "MD5"], fixity_cache_flag=False)
+    OpexManifestGenerator(**options).main()
+    fixity_export = tmp_path / "meta" / "root_Fixity.txt"
+    journal = tmp_path / "meta" / "root_Journal.jsonl"
+    expected_fixity = fixity_export.read_text()
+    expected_opexes = _read_opexes(root)
+    assert not journal.exists()
+    OpexManifestGenerator(root=str(root)).clear_opex()
+
+    real_write_opex = opex_manifest.write_opex
+    written = []
+
+    def interrupted_write_opex(path, opexxml, *args, **kwargs):
+        if len(written) == fail_at:
+            raise RuntimeError("interrupted")
+        written.append(path + ".opex")
+        return real_write_opex(path, opexxml, *args, **kwargs)
+
+    monkeypatch.setattr(opex_manifest, "write_opex", interrupted_write_opex)
+    with pytest.raises(RuntimeError):
+        OpexManifestGenerator(**options, writer_threads=writer_threads).main()
+    monkeypatch.undo()
+    assert journal.exists()
+    assert not list(root.rglob("*.tmp"))
+    if lose_records:
+        # A killed run loses journal records it hadn't flushed; their Opexes are generated again.
+        journal.write_text(journal.read_text().splitlines()[0] + "\n")
+
+    real_hash_file_measured = opex_manifest.hash_file_measured
+    hashed = []
+
+    def recording_hash_file_measured(file_path, *args):
+        hashed.append(file_path)
+        return real_hash_file_measured(file_path, *args)
+
+    monkeypatch.setattr(opex_manifest, "hash_file_measured", recording_hash_file_measured)
+    OpexManifestGenerator(**options, resume_flag=True, processes=processes, writer_threads=writer_threads).main()
+    assert fixity_export.read_text() == expected_fixity
+    assert _read_opexes(root) == expected_opexes
+    assert not journal.exists()
+    if processes == 1 and not lose_records and not writer_threads:
+        # Files completed before the interruption aren't hashed again.
+        assert not {path[:-len(".opex")] for path in written} & set(hashed)
+        assert len(hashed) == 20 - len([path for path in written if path.endswith(".txt.opex")])
+
+
+def test_resume_keeps_content_added_after_interruption(tmp_path, monkeypatch):
+    root = tmp_path / "root"
+    (root / "record.pax").mkdir(parents=True)
+    (root / "record.pax" / "one.txt").write_text("one")
+    (root / "file.txt").write_text("file")
+    options = dict(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"], fixity_cache_flag=False,
+                   pax_fixity=True, zip_flag=True)
+
+    real_write_opex = opex_manifest.write_opex
+    written = []
+
+    def interrupted_write_opex(path, opexxml, *args, **kwargs):
+        if len(written) == 2:
+            raise RuntimeError("interrupted")
+        written.append(path)
+        return real_write_opex(path, opexxml, *args, **kwargs)
+
+    monkeypatch.setattr(opex_manifest, "write_opex", interrupted_write_opex)
+    with pytest.raises(RuntimeError):
+        OpexManifestGenerator(**options).main()
+    monkeypatch.undo()
+    assert written == [str(root / "file.txt"), str(root / "record.pax" / "one.txt")]
+    assert (root / "record.pax" / "one.txt.zip").exists()
+    # Added after the interruption, so written since the run started; it's content all the same.
+    (root / "record.pax" / "two.txt").write_text("two")
+
+    OpexManifestGenerator(**options, resume_flag=True).main()
+    pax_fixities = ET.parse(str(root / "record.pax.opex")).findall(".//{*}Fixity")
+    # The Opex and Zip the interrupted run wrote into the PAX aren't taken for content.
+    assert sorted(fixity.get("path") for fixity in pax_fixities) == ["./one.txt", "./two.txt"]
+    fixity_export = (tmp_path / "meta" / "root_Fixity.txt").read_text()
+    assert ".zip" not in fixity_export and ".opex" not in fixity_export
+
+
+def test_opex_writer_matches_serial_run_and_raises_errors(tmp_path, monkeypatch):
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    options = dict(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"], fixity_cache_flag=False, zip_flag=True)
+    OpexManifestGenerator(**options).main()
+    expected_opexes = _read_opexes(root)
+    expected_zips = sorted(str(path.relative_to(root)) for path in root.rglob("*.zip"))
+    for path in list(root.rglob("*.zip")) + list(root.rglob("*.opex")):
+        path.unlink()
+
+    OpexManifestGenerator(**options, writer_threads=3, writer_queue=2).main()
+    assert _read_opexes(root) == expected_opexes
+    assert sorted(str(path.relative_to(root)) for path in root.rglob("*.zip")) == expected_zips
+
+    # A failed write is raised by the walk, and no Folder Opex is written above it.
+    OpexManifestGenerator(root=str(root)).clear_opex()
+    real_write_opex = opex_manifest.write_opex
+
+    def failing_write_opex(path, opexxml, *args, **kwargs):
+        if os.path.basename(path) == "file0_0.txt":
+            raise OSError("disk full")
+        return real_write_opex(path, opexxml, *args, **kwargs)
+
+    monkeypatch.setattr(opex_manifest, "write_opex", failing_write_opex)
+    with pytest.raises(OSError, match="disk full"):
+        OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"], writer_threads=2).main()
+    assert not (root / "root.opex").exists()
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_profile_reports_stages(tmp_path, processes):
+    import json, pstats
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1", "MD5"], fixity_cache_flag=False,
+                          processes=processes, profile_flag=True, cprofile_flag=True).main()
+    report = json.loads((tmp_path / "meta" / "root_Profile.json").read_text())
+    stages = report["stages"]
+    assert stages["file"]["count"] == 20
+    assert stages["hash"]["count"] == 20
+    assert stages["folder"]["count"] == 4
+    assert stages["scan"]["count"] == 4
+    # Every File's Opex and every Folder's Opex is written.
+    assert stages["write"]["count"] == 24
+    for row in stages.values():
+        assert row["p50_ms"] <= row["p90_ms"] <= row["p99_ms"] <= row["max_ms"]
+    assert len(stages["file"]["slowest"]) == 10
+    assert stages["file"]["slowest"][0]["ms"] == pytest.approx(stages["file"]["max_ms"])
+    assert report["hashing"]["files"] == 20
+    assert "Slowest file" in (tmp_path / "meta" / "root_Profile.txt").read_text()
+    pstats.Stats(str(tmp_path / "meta" / "root_Profile.prof"))
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_progress_counts_each_stage(tmp_path, caplog, processes):
+    import logging
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    omg = OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"], fixity_cache_flag=False,
+                                processes=processes, progress_flag=True, progress_interval=0.001)
+    with caplog.at_level(logging.INFO):
+        omg.main()
+    total_bytes = sum(p.stat().st_size for p in root.rglob("*.txt"))
+    status = omg.progress.status()
+    # Subtree workers add to the same counts.
+    assert (status["folders"], status["files"], status["bytes"]) == (4, 20, total_bytes)
+    assert (status["hashed_files"], status["hashed_bytes"]) == (20, total_bytes)
+    assert status["written"] == 24
+    assert "Progress complete: 20 " in caplog.text
+
+    assert omg.prescan() == {'folders': 4, 'files': 20, 'bytes': total_bytes}
+    omg.progress.totals = omg.prescan()
+    status = omg.progress.status()
+    assert status["percent"] == 100
+    assert status["eta_seconds"] == 0
+    assert "of 20 Files (100.0%)" in omg.progress.line()
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_metrics_export(tmp_path, processes):
+    import json
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1", "MD5"], processes=processes,
+                          zip_flag=True, metrics_format="json", fixity_cache_flag=True).main()
+    metrics = json.loads((tmp_path / "meta" / "root_Metrics.json").read_text())
+    total_bytes = sum(p.stat().st_size for p in root.rglob("*.txt"))
+    assert metrics["complete"] is True
+    assert metrics["entries"] == {"counts": {"folder": 4, "file": 20}, "bytes": total_bytes}
+    assert metrics["hashing"]["bytes_by_algorithm"] == {"SHA-1": total_bytes, "MD5": total_bytes}
+    # Every File's Opex and every Folder's Opex is written, and each File zipped with its Opex.
+    assert metrics["opexes"]["written"] == 24
+    assert metrics["opexes"]["bytes"] == sum(p.stat().st_size for p in root.rglob("*.opex"))
+    assert metrics["zips"] == {"written": 20, "bytes": sum(p.stat().st_size for p in root.rglob("*.zip"))}
+    assert metrics["fixity_cache"] == {"hits": 0, "misses": 20, "hit_ratio": 0.0}
+    assert metrics["stages"]["file"]["count"] == 20
+    # os.times counts whole clock ticks, so a short run's CPU time can be a tick under the stage timers'.
+    assert metrics["stages"]["hash"]["cpu_seconds"] <= metrics["cpu_seconds"] + 1 / os.sysconf("SC_CLK_TCK")
+    # Only the metrics were asked for, so no profile report is written.
+    assert not (tmp_path / "meta" / "root_Profile.json").exists()
+
+    OpexManifestGenerator(root=str(root)).clear_opex()
+    OpexManifestGenerator(root=str(root), output_path=str(tmp_path), processes=processes, metrics_format="prometheus").main()
+    text = (tmp_path / "meta" / "root_Metrics.prom").read_text()
+    assert f'opex_run_entries{{root="{root}",kind="folder"}} 4.0' in text
+    assert f'opex_run_complete{{root="{root}"}} 1.0' in text
+    assert "# TYPE opex_run_stage_cpu_seconds gauge" in text
+    with pytest.raises(ValueError):
+        OpexManifestGenerator(root=str(root), output_path=str(tmp_path), metrics_format="xml").main()
+
+
+def test_pandas_only_imported_for_dataframes(tmp_path):
+    import subprocess
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    code = inspect.cleandoc(f"""
+        import sys
+        from opex_manifest_generator import HashGenerator, OpexManifestGenerator, __version__
+        OpexManifestGenerator(root={str(root)!r}, output_path={str(tmp_path)!r}, algorithm=["SHA-1"]).main()
+        assert "pandas" not in sys.modules and "auto_reference_generator" not in sys.modules, "imported without a Dataframe"
+        OpexManifestGenerator(root={str(root)!r}, output_path={str(tmp_path)!r}, clear_opex_flag=True, autoref_flag="catalog").main()
+        assert "pandas" in sys.modules and "auto_reference_generator" in sys.modules
+        """)
+    subprocess.run([sys.executable, "-c", code], check=True, capture_output=True)
+    version = subprocess.run([sys.executable, "-c", "import sys; sys.argv = ['opex_generate', '--version']; "
+                              "from opex_manifest_generator.cli import run_cli; run_cli()"], check=True, capture_output=True, text=True)
+    assert version.stdout.startswith("opex_generate ")
+
+
+def test_write_opex_is_atomic_and_resume_checks_options(tmp_path, monkeypatch):
+    from opex_manifest_generator import common
+    target = tmp_path / "file.txt"
+    target.write_text("content")
+    (tmp_path / "file.txt.opex").write_text("<previous/>")
+
+    def failing_replace(src, dst):
+        raise OSError("interrupted")
+
+    monkeypatch.setattr(common.os, "replace", failing_replace)
+    with pytest.raises(OSError):
+        common.write_opex(str(target), ET.Element("OPEXMetadata"))
+    monkeypatch.undo()
+    assert (tmp_path / "file.txt.opex").read_text() == "<previous/>"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["file.txt", "file.txt.opex"]
+
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    journal = tmp_path / "meta" / "root_Journal.jsonl"
+    omg = OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"])
+    omg.open_journal()
+    omg.begin_journal()
+    omg.close_journal()
+    assert journal.exists()
+    with pytest.raises(ValueError):
+        OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["MD5"], resume_flag=True).main()
+    OpexManifestGenerator(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"], journal_flag=False).main()
+    assert journal.exists()
+
+
+def _opex_inodes(base):
+    return {str(p.relative_to(base)): p.stat().st_ino for p in base.rglob("*.opex")}
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_incremental_only_regenerates_changes(tmp_path, processes):
+    root = tmp_path / "root"
+    root.mkdir()
+    _build_tree(root)
+    options = dict(root=str(root), output_path=str(tmp_path), algorithm=["SHA-1"], fixity_cache_flag=False,
+                   incremental_flag=True, processes=processes)
+    OpexManifestGenerator(**options).main()
+    fixity_export = tmp_path / "meta" / "root_Fixity.txt"
+    expected_fixity = fixity_export.read_text()
+
+    # Opexes are renamed into place, so a rewritten Opex has a new inode.
+    inodes = _opex_inodes(root)
+    omg = OpexManifestGenerator(**options)
+    omg.main()
+    assert _opex_inodes(root) == inodes
+    assert omg.incremental_counts == {'regenerated': 0, 'skipped': 24, 'orphans': 0}
+    assert fixity_export.read_text() == expected_fixity
+
+    # Entries are held back and written in short transactions, so the write lock isn't held between them.
+    snapshot = TreeSnapshot(omg.snapshot_path, omg.journal_settings(), commit_interval=10)
+    identity = TreeSnapshot.identity(str(root / "file0_0.txt"))
+    assert snapshot.unchanged_file(str(root / "file0_0.txt"), identity) is not None
+    snapshot.store_file(str(root / "file0_0.txt"), identity, [])
+    assert not snapshot.conn.in_transaction
+    assert snapshot.unchanged_file(str(root / "file0_0.txt"), identity) is not None
+    snapshot.close()
+
+    (root / "a" / "file1_0.txt").write_bytes(os.urandom(3000))
+    (root / "a" / "aa" / "new.txt").write_bytes(os.urandom(100))
+    (root / "file0_0.txt").unlink()
+    shutil.rmtree(root / "b")
+    omg = OpexManifestGenerator(**options)
+    omg.main()
+    after = _opex_inodes(root)
+    # Changed Files, the Folder whose Manifest changed and the Folders above it.
+    assert sorted(path for path in after if inodes.get(path) != after[path]) == \
+        sorted([os.path.join("a", "file1_0.txt.opex"), os.path.join("a", "aa", "new.txt.opex"),
+                os.path.join("a", "aa", "aa.opex"), os.path.join("a", "a.opex"), "root.opex"])
+    assert omg.incremental_counts == {'regenerated': 5, 'skipped': 13, 'orphans': 1}
+    assert not (root / "file0_0.txt.opex").exists()
+
+    incremental_opexes = _read_opexes(root)
+    incremental_fixity = fixity_export.read_text()
+    OpexManifestGenerator(root=str(root)).clear_opex()
+    OpexManifestGenerator(root=str(root), output_path=str(tmp_path / "full"), algorithm=["SHA-1"], fixity_cache_flag=False).main()
+    assert incremental_opexes == _read_opexes(root)
+    assert incremental_fixity == (tmp_path / "full" / "meta" / "root_Fixity.txt").read_text()
+
+
+@pytest.mark.parametrize("pretty_print", [True, False])
+@pytest.mark.parametrize("folders,files", [([], []), (["a & b", "<c>"], []), ([], [("x\r.txt", "content", 3)]),
+                                           ([f"folder{i}" for i in range(3000)], [(f"f{i}.txt.opex", "metadata", None) for i in range(2500)])])
+def test_manifest_chunks_match_lxml_tree(tmp_path, pretty_print, folders, files):
+    from opex_manifest_generator import common
+    ns = "http://www.openpreservationexchange.org/opex/v1.2"
+
+    def skeleton():
+        root = ET.Element(f"{{{ns}}}OPEXMetadata", nsmap={"opex": ns})
+        transfer = ET.SubElement(root, f"{{{ns}}}Transfer")
+        manifest = ET.SubElement(transfer, f"{{{ns}}}Manifest")
+        folders_xml = ET.SubElement(manifest, f"{{{ns}}}Folders")
+        files_xml = ET.SubElement(manifest, f"{{{ns}}}Files")
+        # A PAX Folder's own Files are already in the tree.
+        pax_file = ET.SubElement(files_xml, f"{{{ns}}}File")
+        pax_file.set("type", "content")
+        pax_file.text = "inner/file.txt"
+        ET.SubElement(ET.SubElement(root, f"{{{ns}}}Properties"), f"{{{ns}}}Title").text = "T & <t>"
+        return root, folders_xml, files_xml
+
+    root, folders_xml, files_xml = skeleton()
+    for name in folders:
+        ET.SubElement(folders_xml, f"{{{ns}}}Folder").text = name
+    for name, file_type, size in files:
+        file = ET.SubElement(files_xml, f"{{{ns}}}File")
+        file.set("type", file_type)
+        if size is not None:
+            file.set("size", str(size))
+        file.text = name
+    expected = common.opex_bytes(root, pretty_print=pretty_print)
+
+    root, folders_xml, files_xml = skeleton()
+    path = common.write_opex(str(tmp_path / "folder"), root, common.manifest_chunks(root, folders_xml, files_xml, folders, files, pretty_print=pretty_print))
+    assert open(path, "rb").read() == expected
+    with pytest.raises(ValueError):
+        list(common.manifest_chunks(root, folders_xml, files_xml, ["bad\x01"], []))
+
+
+FILE_OPEX_CASES = {
+    "empty": {},
+    "fixities": {"fixities": [("SHA-1", "A" * 40, None), ("MD5", "B" * 32, None)]},
+    "no fixities": {"fixities": []},
+    "pax zip": {"source_id": "S&1", "fixities": [("SHA-1", "C" * 40, "dir\\m <1>.txt"), ("SHA-1", "D" * 40, 'q"\t.txt')]},
+    "properties": {"properties": dict(title="A & <B>\r", description="line\nbreak", security="closed", identifiers=[("code", "REF/1"), ("a\"b", "x'y")])},
+    "no identifiers": {"properties": dict(title="T", identifiers=[])},
+    "identifiers only": {"fixities": [("MD5", "E" * 32, None)], "properties": dict(identifiers=[("code", "é 😀")])},
+    "no properties": {"properties": dict()},
+}
+
+
+@pytest.mark.parametrize("pretty_print", [True, False])
+@pytest.mark.parametrize("case", FILE_OPEX_CASES)
+def test_file_opex_render_matches_lxml(case, pretty_print):
+    from opex_manifest_generator.common import opex_bytes
+    from opex_manifest_generator.serializer import FileOpex
+    data = FILE_OPEX_CASES[case]
+    opex = FileOpex("http://www.openpreservationexchange.org/opex/v1.2")
+    opex.source_id = data.get("source_id")
+    opex.fixities = data.get("fixities")
+    if "properties" in data:
+        opex.set_properties(**data["properties"])
+    assert opex.render(pretty_print=pretty_print) == opex_bytes(opex.to_element(), pretty_print=pretty_print)
+
+
+def test_file_opex_golden():
+    from opex_manifest_generator.serializer import FileOpex
+    opex = FileOpex("http://www.openpreservationexchange.org/opex/v1.2")
+    opex.fixities = [("SHA-1", "A" * 40, None)]
+    opex.set_properties(title="A & B", security="open", identifiers=[("code", "REF/1")])
+    assert opex.render().decode() == (
+        "<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+        '<opex:OPEXMetadata xmlns:opex="http://www.openpreservationexchange.org/opex/v1.2">\n'
+        "  <opex:Transfer>\n"
+        "    <opex:Fixities>\n"
+        f'      <opex:Fixity type="SHA-1" value="{"A" * 40}"/>\n'
+        "    </opex:Fixities>\n"
+        "  </opex:Transfer>\n"
+        "  <opex:Properties>\n"
+        "    <opex:Title>A &amp; B</opex:Title>\n"
+        "    <opex:SecurityDescriptor>open</opex:SecurityDescriptor>\n"
+        "    <opex:Identifiers>\n"
+        '      <opex:Identifier type="code">REF/1</opex:Identifier>\n'
+        "    </opex:Identifiers>\n"
+        "  </opex:Properties>\n"
+        "</opex:OPEXMetadata>\n")
+    opex.source_id = "bad\x01"
+    with pytest.raises(ValueError):
+        opex.render()